@@ -0,0 +1,25 @@
+"""Add tracklog DJ index
+
+Add an index on tracklog (dj_id, id), which is used to find the plays of a
+DJ that their chart snapshot has not counted yet.
+
+Revision ID: 0d5b7e2a9c14
+Revises: f3c8a1d6e027
+Create Date: 2026-10-19 10:48:05.731962
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '0d5b7e2a9c14'
+down_revision = 'f3c8a1d6e027'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_tracklog_dj_id_id', 'tracklog', ['dj_id', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_tracklog_dj_id_id', table_name='tracklog')
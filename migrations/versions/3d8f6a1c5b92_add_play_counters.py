@@ -0,0 +1,102 @@
+"""Add play counters
+
+Add the number of plays and the first and last play of each track, and the
+number of plays, vinyl plays and requests of each DJ, and count them from
+the existing plays.
+
+Revision ID: 3d8f6a1c5b92
+Revises: e2a6c0d9f514
+Create Date: 2026-10-18 18:52:37.104628
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '3d8f6a1c5b92'
+down_revision = 'e2a6c0d9f514'
+
+from alembic import op
+import sqlalchemy as sa
+
+batch_size = 5000
+
+track = sa.table(
+    'track',
+    sa.column('id', sa.Integer),
+    sa.column('play_count', sa.Integer),
+    sa.column('first_played', sa.DateTime),
+    sa.column('last_played', sa.DateTime),
+)
+
+dj = sa.table(
+    'dj',
+    sa.column('id', sa.Integer),
+    sa.column('play_count', sa.Integer),
+    sa.column('vinyl_play_count', sa.Integer),
+    sa.column('request_play_count', sa.Integer),
+)
+
+tracklog = sa.table(
+    'tracklog',
+    sa.column('id', sa.Integer),
+    sa.column('track_id', sa.Integer),
+    sa.column('dj_id', sa.Integer),
+    sa.column('played', sa.DateTime),
+    sa.column('vinyl', sa.Boolean),
+    sa.column('request', sa.Boolean),
+)
+
+
+def track_plays(aggregate):
+    return sa.select([aggregate]).\
+        where(tracklog.c.track_id == track.c.id).scalar_subquery()
+
+
+def dj_plays(*criteria):
+    return sa.select([sa.func.count(tracklog.c.id)]).\
+        where(tracklog.c.dj_id == dj.c.id).where(*criteria).\
+        scalar_subquery()
+
+
+def upgrade():
+    op.add_column('track', sa.Column('play_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('track', sa.Column('first_played', sa.DateTime(), nullable=True))
+    op.add_column('track', sa.Column('last_played', sa.DateTime(), nullable=True))
+    op.add_column('dj', sa.Column('play_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('dj', sa.Column('vinyl_play_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('dj', sa.Column('request_play_count', sa.Integer(), server_default='0', nullable=False))
+
+    conn = op.get_bind()
+    max_id = conn.execute(sa.select([sa.func.max(track.c.id)])).scalar() or 0
+    for start in range(0, max_id + 1, batch_size):
+        conn.execute(
+            track.update().
+            where(track.c.id >= start).
+            where(track.c.id < start + batch_size).
+            values(play_count=track_plays(sa.func.count(tracklog.c.id)),
+                   first_played=track_plays(sa.func.min(tracklog.c.played)),
+                   last_played=track_plays(sa.func.max(tracklog.c.played))))
+
+    conn.execute(dj.update().values(
+        play_count=dj_plays(),
+        vinyl_play_count=dj_plays(tracklog.c.vinyl == True),
+        request_play_count=dj_plays(tracklog.c.request == True)))
+
+    op.create_index(op.f('ix_track_play_count'), 'track', ['play_count'], unique=False)
+    op.create_index(op.f('ix_track_last_played'), 'track', ['last_played'], unique=False)
+    op.create_index(op.f('ix_dj_play_count'), 'dj', ['play_count'], unique=False)
+    op.create_index(op.f('ix_dj_vinyl_play_count'), 'dj', ['vinyl_play_count'], unique=False)
+    op.create_index(op.f('ix_dj_request_play_count'), 'dj', ['request_play_count'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_dj_request_play_count'), table_name='dj')
+    op.drop_index(op.f('ix_dj_vinyl_play_count'), table_name='dj')
+    op.drop_index(op.f('ix_dj_play_count'), table_name='dj')
+    op.drop_index(op.f('ix_track_last_played'), table_name='track')
+    op.drop_index(op.f('ix_track_play_count'), table_name='track')
+    op.drop_column('dj', 'request_play_count')
+    op.drop_column('dj', 'vinyl_play_count')
+    op.drop_column('dj', 'play_count')
+    op.drop_column('track', 'last_played')
+    op.drop_column('track', 'first_played')
+    op.drop_column('track', 'play_count')
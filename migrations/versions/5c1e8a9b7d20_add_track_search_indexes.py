@@ -0,0 +1,43 @@
+"""Add track search indexes
+
+Add an index on tracklog.track_id, which is used to count plays for search
+results. With PostgreSQL, also enable pg_trgm and add trigram indexes for
+track search.
+
+Revision ID: 5c1e8a9b7d20
+Revises: 9f3b2c7d4e61
+Create Date: 2026-10-18 15:37:12.604518
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5c1e8a9b7d20'
+down_revision = '9f3b2c7d4e61'
+
+from alembic import op
+import sqlalchemy as sa
+
+search_fields = ('artist', 'title', 'album', 'label')
+
+
+def upgrade():
+    op.create_index(op.f('ix_tracklog_track_id'), 'tracklog', ['track_id'], unique=False)
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        for field in search_fields:
+            op.create_index(
+                'ix_track_{}_trgm'.format(field),
+                'track',
+                [field],
+                unique=False,
+                postgresql_using='gin',
+                postgresql_ops={field: 'gin_trgm_ops'})
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for field in search_fields:
+            op.drop_index('ix_track_{}_trgm'.format(field), table_name='track')
+
+    op.drop_index(op.f('ix_tracklog_track_id'), table_name='tracklog')
@@ -0,0 +1,72 @@
+"""Add DJ chart snapshots
+
+Add tables with the number of plays of each artist, album and track by each
+DJ, which DJ charts are read from, and the state of each DJ's snapshot.
+Run `flask rebuild-dj-charts --all` after upgrading to build the snapshots;
+DJ charts are unavailable until a DJ's snapshot has been built, which the
+scheduler also does in the background.
+
+Revision ID: 7c2e9a4b1d38
+Revises: 3d8f6a1c5b92
+Create Date: 2026-10-18 21:14:09.583127
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '7c2e9a4b1d38'
+down_revision = '3d8f6a1c5b92'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('dj_chart_snapshot',
+    sa.Column('dj_id', sa.Integer(), nullable=False),
+    sa.Column('last_tracklog_id', sa.Integer(), nullable=False),
+    sa.Column('stale', sa.Boolean(), nullable=False),
+    sa.Column('updated', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['dj_id'], ['dj.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('dj_id')
+    )
+    op.create_index(op.f('ix_dj_chart_snapshot_stale'), 'dj_chart_snapshot', ['stale'], unique=False)
+    op.create_table('dj_artist_plays',
+    sa.Column('dj_id', sa.Integer(), nullable=False),
+    sa.Column('artist_key', sa.Unicode(length=255).with_variant(sa.Unicode(), 'postgresql'), nullable=False),
+    sa.Column('artist', sa.Unicode(length=255).with_variant(sa.Unicode(), 'postgresql'), nullable=True),
+    sa.Column('plays', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['dj_id'], ['dj.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('dj_id', 'artist_key')
+    )
+    op.create_index('ix_dj_artist_plays_dj_id_plays', 'dj_artist_plays', ['dj_id', 'plays'], unique=False)
+    op.create_table('dj_album_plays',
+    sa.Column('dj_id', sa.Integer(), nullable=False),
+    sa.Column('artist_key', sa.Unicode(length=255).with_variant(sa.Unicode(), 'postgresql'), nullable=False),
+    sa.Column('album_key', sa.Unicode(length=255).with_variant(sa.Unicode(), 'postgresql'), nullable=False),
+    sa.Column('artist', sa.Unicode(length=255).with_variant(sa.Unicode(), 'postgresql'), nullable=True),
+    sa.Column('album', sa.Unicode(length=255).with_variant(sa.Unicode(), 'postgresql'), nullable=True),
+    sa.Column('plays', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['dj_id'], ['dj.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('dj_id', 'artist_key', 'album_key')
+    )
+    op.create_index('ix_dj_album_plays_dj_id_plays', 'dj_album_plays', ['dj_id', 'plays'], unique=False)
+    op.create_table('dj_track_plays',
+    sa.Column('dj_id', sa.Integer(), nullable=False),
+    sa.Column('track_id', sa.Integer(), nullable=False),
+    sa.Column('plays', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['dj_id'], ['dj.id'], ondelete='CASCADE'),
+    sa.ForeignKeyConstraint(['track_id'], ['track.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('dj_id', 'track_id')
+    )
+    op.create_index('ix_dj_track_plays_dj_id_plays', 'dj_track_plays', ['dj_id', 'plays'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_dj_track_plays_dj_id_plays', table_name='dj_track_plays')
+    op.drop_table('dj_track_plays')
+    op.drop_index('ix_dj_album_plays_dj_id_plays', table_name='dj_album_plays')
+    op.drop_table('dj_album_plays')
+    op.drop_index('ix_dj_artist_plays_dj_id_plays', table_name='dj_artist_plays')
+    op.drop_table('dj_artist_plays')
+    op.drop_index(op.f('ix_dj_chart_snapshot_stale'), table_name='dj_chart_snapshot')
+    op.drop_table('dj_chart_snapshot')
@@ -0,0 +1,60 @@
+"""Add daily play rollups
+
+Add tables counting plays per day for each artist, album, track and DJ, which
+charts are summed from. Run `flask rebuild-chart-rollups` after upgrading to
+count existing plays.
+
+Revision ID: 9f3b2c7d4e61
+Revises: 32e36e5b2170
+Create Date: 2026-10-18 14:02:41.218734
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9f3b2c7d4e61'
+down_revision = '32e36e5b2170'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_table('artist_daily_plays',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('artist_key', sa.Unicode(length=255).with_variant(sa.Unicode(), 'postgresql'), nullable=False),
+    sa.Column('artist', sa.Unicode(length=255).with_variant(sa.Unicode(), 'postgresql'), nullable=True),
+    sa.Column('plays', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'artist_key')
+    )
+    op.create_table('album_daily_plays',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('artist_key', sa.Unicode(length=255).with_variant(sa.Unicode(), 'postgresql'), nullable=False),
+    sa.Column('album_key', sa.Unicode(length=255).with_variant(sa.Unicode(), 'postgresql'), nullable=False),
+    sa.Column('artist', sa.Unicode(length=255).with_variant(sa.Unicode(), 'postgresql'), nullable=True),
+    sa.Column('album', sa.Unicode(length=255).with_variant(sa.Unicode(), 'postgresql'), nullable=True),
+    sa.Column('plays', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('day', 'artist_key', 'album_key')
+    )
+    op.create_table('track_daily_plays',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('track_id', sa.Integer(), nullable=False),
+    sa.Column('plays', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['track_id'], ['track.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('day', 'track_id')
+    )
+    op.create_table('dj_daily_plays',
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('dj_id', sa.Integer(), nullable=False),
+    sa.Column('plays', sa.Integer(), nullable=False),
+    sa.Column('vinyl_plays', sa.Integer(), nullable=False),
+    sa.Column('request_plays', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['dj_id'], ['dj.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('day', 'dj_id')
+    )
+
+
+def downgrade():
+    op.drop_table('dj_daily_plays')
+    op.drop_table('track_daily_plays')
+    op.drop_table('album_daily_plays')
+    op.drop_table('artist_daily_plays')
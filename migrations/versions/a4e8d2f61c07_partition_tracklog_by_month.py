@@ -0,0 +1,135 @@
+"""Partition tracklog by month
+
+If TRACKLOG_PARTITIONING is enabled and the database is PostgreSQL, convert
+tracklog to a table partitioned by month of the played time, copying the
+existing plays; otherwise, this does nothing. To partition an existing
+database later, enable the option, then downgrade to the previous revision
+and upgrade again. The scheduler creates partitions for upcoming months.
+Plays without a played time cannot be placed in a partition, so the upgrade
+fails if there are any; set their played time first.
+
+Downgrading copies the plays back into an ordinary table; partitions that
+were moved to the archive schema are left there.
+
+Revision ID: a4e8d2f61c07
+Revises: 7c2e9a4b1d38
+Create Date: 2026-10-18 22:31:47.260913
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a4e8d2f61c07'
+down_revision = '7c2e9a4b1d38'
+
+from alembic import op
+from flask import current_app
+import datetime
+import sqlalchemy as sa
+
+foreign_keys = [
+    ('tracklog_track_id_fkey', 'track_id', 'track'),
+    ('tracklog_djset_id_fkey', 'djset_id', 'set'),
+    ('tracklog_dj_id_fkey', 'dj_id', 'dj'),
+    ('tracklog_rotation_id_fkey', 'rotation_id', 'rotation'),
+]
+
+indexes = [
+    ('ix_tracklog_track_id', 'track_id'),
+    ('ix_tracklog_artist', 'artist'),
+]
+
+
+def is_partitioned(conn):
+    return conn.execute(sa.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+        "WHERE partrelid = to_regclass('tracklog'))")).scalar()
+
+
+def next_month(month):
+    if month.month == 12:
+        return datetime.datetime(month.year + 1, 1, 1)
+    return datetime.datetime(month.year, month.month + 1, 1)
+
+
+def upgrade():
+    conn = op.get_bind()
+    if conn.dialect.name != 'postgresql' or \
+            not current_app.config.get('TRACKLOG_PARTITIONING') or \
+            is_partitioned(conn):
+        return
+
+    # plays without a played time cannot be placed in a partition, and
+    # making one up would change them silently
+    missing = conn.execute(sa.text(
+        "SELECT count(*) FROM tracklog WHERE played IS NULL")).scalar()
+    if missing > 0:
+        raise RuntimeError(
+            "Cannot partition tracklog, as the played time of {0:d} "
+            "TrackLogs is not set".format(missing))
+
+    op.execute("ALTER TABLE tracklog RENAME TO tracklog_unpartitioned")
+    for name, column in indexes:
+        op.execute("ALTER INDEX {0} RENAME TO {0}_unpartitioned".format(name))
+    op.execute("ALTER TABLE tracklog_unpartitioned DROP CONSTRAINT "
+               "tracklog_pkey")
+
+    op.execute("CREATE TABLE tracklog (LIKE tracklog_unpartitioned "
+               "INCLUDING DEFAULTS) PARTITION BY RANGE (played)")
+    op.execute("ALTER TABLE tracklog ALTER COLUMN played SET NOT NULL")
+    op.execute("ALTER TABLE tracklog ADD CONSTRAINT tracklog_pkey "
+               "PRIMARY KEY (id, played)")
+    for name, column, table in foreign_keys:
+        op.execute('ALTER TABLE tracklog ADD CONSTRAINT {0} FOREIGN KEY '
+                   '({1}) REFERENCES "{2}" (id)'.format(name, column, table))
+    for name, column in indexes:
+        op.execute("CREATE INDEX {0} ON tracklog ({1})".format(name, column))
+
+    first = conn.execute(sa.text(
+        "SELECT min(played) FROM tracklog_unpartitioned")).scalar()
+    now = datetime.datetime.utcnow()
+    last = datetime.datetime(now.year, now.month, 1)
+    for i in range(current_app.config.get('TRACKLOG_PARTITIONS_AHEAD', 3)):
+        last = next_month(last)
+
+    month = datetime.datetime((first or now).year, (first or now).month, 1)
+    while month <= last:
+        op.execute(
+            "CREATE TABLE tracklog_{0:%Y_%m} PARTITION OF tracklog "
+            "FOR VALUES FROM ('{0:%Y-%m-%d}') TO ('{1:%Y-%m-%d}')".format(
+                month, next_month(month)))
+        month = next_month(month)
+    op.execute("CREATE TABLE tracklog_default PARTITION OF tracklog DEFAULT")
+
+    op.execute("INSERT INTO tracklog SELECT * FROM tracklog_unpartitioned")
+    op.execute("ALTER SEQUENCE tracklog_id_seq OWNED BY tracklog.id")
+    op.execute("DROP TABLE tracklog_unpartitioned")
+
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name != 'postgresql' or not is_partitioned(conn):
+        return
+
+    op.execute("ALTER TABLE tracklog RENAME TO tracklog_partitioned")
+    op.execute("ALTER TABLE tracklog_partitioned DROP CONSTRAINT "
+               "tracklog_pkey")
+    for name, column, table in foreign_keys:
+        op.execute("ALTER TABLE tracklog_partitioned DROP CONSTRAINT "
+                   "{0}".format(name))
+    for name, column in indexes:
+        op.execute("DROP INDEX {0}".format(name))
+
+    op.execute("CREATE TABLE tracklog (LIKE tracklog_partitioned "
+               "INCLUDING DEFAULTS)")
+    op.execute("ALTER TABLE tracklog ALTER COLUMN played DROP NOT NULL")
+    op.execute("INSERT INTO tracklog SELECT * FROM tracklog_partitioned")
+    op.execute("ALTER SEQUENCE tracklog_id_seq OWNED BY tracklog.id")
+    op.execute("DROP TABLE tracklog_partitioned CASCADE")
+
+    op.execute("ALTER TABLE tracklog ADD CONSTRAINT tracklog_pkey "
+               "PRIMARY KEY (id)")
+    for name, column, table in foreign_keys:
+        op.execute('ALTER TABLE tracklog ADD CONSTRAINT {0} FOREIGN KEY '
+                   '({1}) REFERENCES "{2}" (id)'.format(name, column, table))
+    for name, column in indexes:
+        op.execute("CREATE INDEX {0} ON tracklog ({1})".format(name, column))
@@ -0,0 +1,86 @@
+"""Add track match keys
+
+Add hashes of the normalized artist, title, album, and label of each track,
+which are used to find matching tracks instead of comparing lower() of each
+field.
+
+Revision ID: b7d4f1a2c389
+Revises: 5c1e8a9b7d20
+Create Date: 2026-10-18 16:48:55.310927
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b7d4f1a2c389'
+down_revision = '5c1e8a9b7d20'
+
+from alembic import op
+import hashlib
+import sqlalchemy as sa
+import unicodedata
+
+batch_size = 5000
+
+track = sa.table(
+    'track',
+    sa.column('id', sa.Integer),
+    sa.column('artist', sa.Unicode),
+    sa.column('title', sa.Unicode),
+    sa.column('album', sa.Unicode),
+    sa.column('label', sa.Unicode),
+    sa.column('match_key', sa.String),
+    sa.column('partial_match_key', sa.String),
+)
+
+
+# a copy of the normalization in trackman.models as of this revision, so
+# that later changes to it do not change what this migration writes
+def normalize_match_value(value):
+    value = unicodedata.normalize('NFKC', value or "")
+    return " ".join(value.casefold().split())
+
+
+def match_key(*values):
+    return hashlib.sha256("\x1f".join(
+        normalize_match_value(value) for value in values).encode('utf-8')).\
+        hexdigest()
+
+
+def upgrade():
+    op.add_column('track', sa.Column('match_key', sa.String(length=64), nullable=True))
+    op.add_column('track', sa.Column('partial_match_key', sa.String(length=64), nullable=True))
+
+    conn = op.get_bind()
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select([track.c.id, track.c.artist, track.c.title,
+                       track.c.album, track.c.label]).
+            where(track.c.id > last_id).
+            order_by(track.c.id).
+            limit(batch_size)).fetchall()
+        if len(rows) <= 0:
+            break
+
+        conn.execute(
+            track.update().where(track.c.id == sa.bindparam('track_id')).
+            values(match_key=sa.bindparam('new_match_key'),
+                   partial_match_key=sa.bindparam('new_partial_match_key')),
+            [{
+                'track_id': row.id,
+                'new_match_key': match_key(
+                    row.artist, row.title, row.album, row.label),
+                'new_partial_match_key': match_key(
+                    row.artist, row.title, row.album),
+            } for row in rows])
+        last_id = rows[-1].id
+
+    op.create_index(op.f('ix_track_match_key'), 'track', ['match_key'], unique=False)
+    op.create_index(op.f('ix_track_partial_match_key'), 'track', ['partial_match_key'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_track_partial_match_key'), table_name='track')
+    op.drop_index(op.f('ix_track_match_key'), table_name='track')
+    op.drop_column('track', 'partial_match_key')
+    op.drop_column('track', 'match_key')
@@ -0,0 +1,22 @@
+"""Add user session token index
+
+Revision ID: e2a6c0d9f514
+Revises: b7d4f1a2c389
+Create Date: 2026-10-18 17:21:09.842216
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'e2a6c0d9f514'
+down_revision = 'b7d4f1a2c389'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index(op.f('ix_user_session_token'), 'user_session', ['token'], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f('ix_user_session_token'), table_name='user_session')
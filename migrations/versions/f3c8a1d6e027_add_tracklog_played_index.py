@@ -0,0 +1,30 @@
+"""Add tracklog played index
+
+Add an index on tracklog (played, id), which is the order in which the most
+recent plays are looked up for now playing and the last 15 tracks. With
+PostgreSQL, an index on played alone that partitioning used to create is
+dropped, as this one covers it.
+
+Revision ID: f3c8a1d6e027
+Revises: a4e8d2f61c07
+Create Date: 2026-10-19 10:12:38.516204
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'f3c8a1d6e027'
+down_revision = 'a4e8d2f61c07'
+
+from alembic import op
+import sqlalchemy as sa
+
+
+def upgrade():
+    op.create_index('ix_tracklog_played_id', 'tracklog', ['played', 'id'], unique=False)
+
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS ix_tracklog_played")
+
+
+def downgrade():
+    op.drop_index('ix_tracklog_played_id', table_name='tracklog')
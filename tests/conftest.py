@@ -0,0 +1,81 @@
+import atexit
+import contextlib
+import functools
+import json
+import os
+import shutil
+import tempfile
+
+import fakeredis
+import pytest
+import redis
+from sqlalchemy import event
+
+# trackman reads its config and connects to Redis when it is imported, so
+# both have to be set up before any test imports it
+redis_server = fakeredis.FakeServer()
+redis.from_url = functools.partial(fakeredis.FakeRedis.from_url,
+                                   server=redis_server)
+
+config_dir = tempfile.mkdtemp(prefix='trackman-tests-')
+atexit.register(shutil.rmtree, config_dir, ignore_errors=True)
+
+config_path = os.path.join(config_dir, 'config.json')
+with open(config_path, 'w') as f:
+    json.dump({
+        'SECRET_KEY': 'test',
+        'AUTH_METHOD': 'google',
+        'GOOGLE_CLIENT_ID': 'test',
+        'GOOGLE_CLIENT_SECRET': 'test',
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{0}'.format(
+            os.path.join(config_dir, 'trackman.db')),
+        'WTF_CSRF_ENABLED': False,
+        # nothing listens here, so events fail without waiting on retries
+        'PUBSUB_PUB_URL_ALL': 'http://127.0.0.1:9/pub',
+        'PUBSUB_PUB_URL_DJ': 'http://127.0.0.1:9/dj/pub',
+        'PUBSUB_MAX_RETRIES': 0,
+    }, f)
+os.environ['APP_CONFIG_PATH'] = config_path
+
+
+@pytest.fixture
+def app():
+    from trackman import app, db, db_utils
+
+    with app.app_context():
+        db_utils.initdb()
+
+    yield app
+
+    with app.app_context():
+        db.drop_all(bind=None)
+    fakeredis.FakeRedis(server=redis_server).flushall()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def count_queries(app):
+    """Return a context manager that yields the list of SQL statements
+    executed within it."""
+    from trackman import db
+
+    @contextlib.contextmanager
+    def count_queries():
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        engine = db.get_engine(app)
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            event.remove(engine, 'before_cursor_execute',
+                         before_cursor_execute)
+
+    return count_queries
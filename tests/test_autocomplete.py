@@ -0,0 +1,79 @@
+import pytest
+
+from trackman import autocomplete
+
+ARTIST_PLAYS = [("Azz", 5), ("abc", 2)] + \
+    [("Aaa {0:02d}".format(i), 0) for i in range(20)] + [("Other", 1)]
+
+
+@pytest.fixture
+def index(app):
+    """Add a track by each artist with the given number of plays and build
+    the index."""
+    from trackman import db
+    from trackman.models import Track
+
+    with app.app_context():
+        for artist, plays in ARTIST_PLAYS:
+            track = Track("Title", artist, "Album", "Label")
+            track.play_count = plays
+            db.session.add(track)
+        db.session.commit()
+        autocomplete.rebuild()
+        yield
+
+
+def test_short_prefixes_rank_every_match(index, monkeypatch):
+    # only the first few matches are ranked by the lexical scan
+    monkeypatch.setattr(autocomplete, 'SCAN_LIMIT', 5)
+
+    assert autocomplete.complete('artist', "a", limit=3) == \
+        ["Azz", "abc", "Aaa 00"]
+    assert autocomplete.complete('artist', "A", limit=3) == \
+        ["Azz", "abc", "Aaa 00"]
+    assert autocomplete.complete('artist', "az") == ["Azz"]
+    assert autocomplete.complete('artist', "q") == []
+
+
+def test_long_prefixes_are_scanned(index):
+    assert autocomplete.complete('artist', "aaa 1", limit=2) == \
+        ["Aaa 10", "Aaa 11"]
+    assert autocomplete.complete('artist', "azz") == ["Azz"]
+
+
+def test_plays_are_counted_in_prefixes(index):
+    from trackman.models import Track
+
+    track = Track.query.filter(Track.artist == "Aaa 05").one()
+    autocomplete.count_plays([track] * 10)
+
+    assert autocomplete.complete('artist', "a", limit=2) == \
+        ["Aaa 05", "Azz"]
+    assert autocomplete.complete('artist', "aa", limit=2) == \
+        ["Aaa 05", "Aaa 00"]
+
+
+def test_edits_update_prefixes(index):
+    from trackman import db
+    from trackman.models import Track
+
+    track = Track.query.filter(Track.artist == "Azz").one()
+    track.artist = "Quux"
+    old_values = autocomplete.edited_values([track])
+    db.session.commit()
+    autocomplete.update_tracks([track], old_values)
+
+    assert autocomplete.complete('artist', "a", limit=1) == ["abc"]
+    assert autocomplete.complete('artist', "q") == ["Quux"]
+
+
+def test_rebuild_removes_stale_prefixes(index):
+    from trackman.models import Track
+
+    # a track that is indexed but not in the database
+    autocomplete.add_track(Track("Title", "Zed", "Album", "Label"))
+    assert autocomplete.complete('artist', "z") == ["Zed"]
+
+    autocomplete.rebuild()
+    assert autocomplete.complete('artist', "z") == []
+    assert autocomplete.complete('artist', "a", limit=1) == ["Azz"]
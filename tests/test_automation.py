@@ -0,0 +1,60 @@
+import datetime
+
+import pytest
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+PASSWORD = "test"
+
+
+@pytest.fixture
+def automation(app):
+    """Enable automation with a known password."""
+    from trackman import onair
+
+    app.config['AUTOMATION_PASSWORD'] = PASSWORD
+    with app.app_context():
+        onair.enable_automation()
+    yield
+    app.config['AUTOMATION_PASSWORD'] = ""
+
+
+def log_batch(client, *played):
+    return client.post('/api/automation/log/batch', json={
+        'password': PASSWORD,
+        'plays': [{
+            'title': "Title {0:d}".format(i),
+            'artist': "Artist",
+            'album': "Album",
+            'label': "Label",
+            'played': p.strftime(DATE_FORMAT),
+        } for i, p in enumerate(played)],
+    })
+
+
+def test_batch_skips_plays_before_djset(app, client, automation):
+    from trackman.models import DJSet, TrackLog
+
+    now = datetime.datetime.utcnow().replace(microsecond=0)
+    start = now - datetime.timedelta(hours=1)
+
+    rv = log_batch(client, start, now)
+    assert rv.status_code == 201
+    assert rv.get_json()['logged'] == 2
+
+    rv = log_batch(client, start - datetime.timedelta(hours=1), now)
+    assert rv.status_code == 201
+    result = rv.get_json()
+    assert result['success'] is False
+    assert result['logged'] == 1
+    assert result['skipped'] == 1
+
+    rv = log_batch(client, start - datetime.timedelta(hours=2))
+    assert rv.status_code == 200
+    assert rv.get_json()['skipped'] == 1
+
+    with app.app_context():
+        djset = DJSet.query.one()
+        assert djset.dtstart == start
+        plays = TrackLog.query.filter_by(djset_id=djset.id).all()
+        assert len(plays) == 3
+        assert all(play.played >= djset.dtstart for play in plays)
@@ -0,0 +1,40 @@
+import datetime
+
+from trackman import charts
+
+
+def test_counts_merge_partial_days_into_top_rollups(app):
+    from trackman import db, playstats
+    from trackman.models import DJ, DJSet, Track, TrackLog
+
+    with app.app_context():
+        dj = DJ("DJ", "DJ")
+        tracks = [Track("Title", "Artist {0}".format(name), "Album", "Label")
+                  for name in "ABC"]
+        db.session.add_all([dj] + tracks)
+        db.session.commit()
+        djset = DJSet(dj.id)
+        db.session.add(djset)
+        db.session.commit()
+
+        now = datetime.datetime.utcnow()
+        earlier = now - datetime.timedelta(days=5)
+        # A and B are the most played on whole days, but C overtakes them
+        # with plays in the partial day at the end of the range
+        for track, whole_days, partial_day in zip(tracks, (3, 2, 1),
+                                                  (0, 0, 3)):
+            for played in [earlier] * whole_days + [now] * partial_day:
+                tracklog = TrackLog(track.id, djset.id)
+                tracklog.played = played
+                db.session.add(tracklog)
+        db.session.commit()
+        playstats.rebuild_all()
+
+        start = now - datetime.timedelta(days=10)
+        assert charts.artist_counts(start, now, limit=2) == \
+            [["Artist C", 4], ["Artist A", 3]]
+        assert charts.album_counts(start, now, limit=1) == \
+            [["Artist C", "Album", 4]]
+        assert [[track.id, plays] for track, plays in
+                charts.track_counts(start, now, limit=2)] == \
+            [[tracks[2].id, 4], [tracks[0].id, 3]]
@@ -0,0 +1,51 @@
+import datetime
+
+from trackman import djcharts
+
+
+def log_set(dj_id, tracks):
+    """Log a set of a DJ playing the provided tracks, and end it."""
+    from trackman import db, lib
+    from trackman.models import DJSet
+
+    djset = DJSet(dj_id)
+    db.session.add(djset)
+    db.session.commit()
+
+    now = datetime.datetime.utcnow()
+    lib.log_tracks([(track, now) for track in tracks], djset.id)
+    djset.dtend = datetime.datetime.utcnow()
+    db.session.commit()
+    return djset
+
+
+def test_sets_only_update_built_snapshots(app):
+    from trackman import db, lib, playstats
+    from trackman.models import DJ, DJChartSnapshot, Track
+
+    with app.app_context():
+        dj = DJ("DJ", "DJ")
+        track = Track("Title", "Artist", "Album", "Label")
+        db.session.add_all([dj, track])
+        db.session.commit()
+        dj_id = dj.id
+
+        # snapshots are not built when a set ends
+        lib.update_dj_charts(log_set(dj_id, [track]))
+        assert DJChartSnapshot.query.get(dj_id) is None
+        assert djcharts.album_chart(dj_id) is None
+
+        assert djcharts.build_missing() == 1
+        assert djcharts.album_chart(dj_id) == [("Artist", "Album", 1)]
+
+        lib.update_dj_charts(log_set(dj_id, [track, track]))
+        assert djcharts.album_chart(dj_id) == [("Artist", "Album", 3)]
+
+        # nor are stale snapshots rebuilt
+        playstats.mark_dj_charts_stale(DJChartSnapshot.dj_id == dj_id)
+        db.session.commit()
+        lib.update_dj_charts(log_set(dj_id, [track]))
+        assert djcharts.album_chart(dj_id) == [("Artist", "Album", 3)]
+
+        assert djcharts.rebuild_stale() == 1
+        assert djcharts.album_chart(dj_id) == [("Artist", "Album", 4)]
@@ -0,0 +1,96 @@
+import datetime
+
+import pytest
+
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
+DJ_COUNT = 3
+TRACK_COUNT = 10
+
+
+@pytest.fixture
+def playlists(app):
+    """Log a set for each of several DJs, each playing every track, and
+    return the IDs of the sets and tracks."""
+    from trackman import db
+    from trackman.models import DJ, DJSet, Rotation, Track, TrackLog
+
+    with app.app_context():
+        rotations = Rotation.query.all()
+        tracks = [Track("Title {0:d}".format(i), "Artist {0:d}".format(i),
+                        "Album {0:d}".format(i), "Label")
+                  for i in range(TRACK_COUNT)]
+        djs = [DJ("DJ {0:d}".format(i), "DJ {0:d}".format(i))
+               for i in range(DJ_COUNT)]
+        db.session.add_all(tracks + djs)
+        db.session.commit()
+
+        djsets = [DJSet(dj.id) for dj in djs]
+        db.session.add_all(djsets)
+        db.session.commit()
+
+        for djset in djsets:
+            for i, track in enumerate(tracks):
+                db.session.add(TrackLog(
+                    track.id, djset.id,
+                    rotation=rotations[i % len(rotations)]))
+        db.session.commit()
+
+        return {
+            'djset_ids': [djset.id for djset in djsets],
+            'track_ids': [track.id for track in tracks],
+        }
+
+
+def date_range():
+    now = datetime.datetime.utcnow()
+    return {
+        'start': (now - datetime.timedelta(days=1)).strftime(DATE_FORMAT),
+        'end': (now + datetime.timedelta(days=1)).strftime(DATE_FORMAT),
+    }
+
+
+def get(client, count_queries, url, **params):
+    """Request a URL, returning the JSON response and the statements that
+    were executed. The related rows of each TrackLog are eagerly loaded, so
+    the number of statements does not depend on the number of rows."""
+    with count_queries() as statements:
+        r = client.get(url, query_string=params)
+    assert r.status_code == 200
+    return r.get_json(), statements
+
+
+def test_last15(client, count_queries, playlists):
+    data, statements = get(client, count_queries, '/api/playlists/last15')
+    assert len(data['tracks']) == 15
+    assert len(statements) == 1
+
+
+def test_playlist(client, count_queries, playlists):
+    data, statements = get(
+        client, count_queries,
+        '/api/playlists/set/{0:d}'.format(playlists['djset_ids'][0]))
+    assert len(data['tracks']) == TRACK_COUNT
+    assert len(statements) == 2
+
+
+def test_track_plays(client, count_queries, playlists):
+    data, statements = get(
+        client, count_queries,
+        '/api/playlists/track/{0:d}'.format(playlists['track_ids'][0]))
+    assert len(data['plays']) == DJ_COUNT
+    assert len(statements) == 2
+
+
+def test_sets_by_date_range(client, count_queries, playlists):
+    data, statements = get(client, count_queries,
+                           '/api/playlists/date/range', **date_range())
+    assert len(data['sets']) == DJ_COUNT
+    assert len(statements) == 1
+
+
+def test_tracklogs_by_date_range(client, count_queries, playlists):
+    data, statements = get(client, count_queries,
+                           '/api/playlists/tracklogs/date/range',
+                           **date_range())
+    assert len(data['tracklogs']) == DJ_COUNT * TRACK_COUNT
+    assert len(statements) == 1
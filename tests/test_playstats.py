@@ -0,0 +1,47 @@
+import datetime
+
+from trackman import playstats
+
+
+def counters(dj_id, track_ids):
+    from trackman.models import DJ, Track
+
+    tracks = Track.query.filter(Track.id.in_(track_ids)).order_by(Track.id)
+    return (
+        DJ.query.get(dj_id).play_count,
+        [(t.play_count, t.first_played, t.last_played) for t in tracks],
+    )
+
+
+def test_log_tracks_increments_counters(app):
+    from trackman import db, lib
+    from trackman.models import DJSet, Track
+
+    with app.app_context():
+        tracks = [Track("Title {0:d}".format(i), "Artist", "Album", "Label")
+                  for i in range(2)]
+        djset = DJSet(1)
+        db.session.add_all(tracks + [djset])
+        db.session.commit()
+
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        track_ids = [track.id for track in tracks]
+        lib.log_tracks([(tracks[0], now - datetime.timedelta(hours=1))],
+                       djset.id)
+        lib.log_tracks([
+            (tracks[1], now),
+            (tracks[0], now - datetime.timedelta(hours=2)),
+            (tracks[0], now - datetime.timedelta(minutes=5)),
+        ], djset.id)
+
+        logged = counters(1, track_ids)
+        assert logged == (4, [
+            (3, now - datetime.timedelta(hours=2),
+             now - datetime.timedelta(minutes=5)),
+            (1, now, now),
+        ])
+
+        playstats.reconcile_counters()
+        db.session.commit()
+        db.session.expire_all()
+        assert counters(1, track_ids) == logged
@@ -0,0 +1,153 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import queue
+import threading
+
+import pytest
+
+from trackman import pubsub
+
+TIMEOUT = 5
+
+
+class NchanHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.put(json.loads(body))
+        self.server.gate.wait(TIMEOUT)
+
+        data = json.dumps({'subscribers': 0}).encode('utf-8')
+        self.send_response(self.server.status)
+        self.send_header('Content-Type', "application/json")
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class Nchan(ThreadingHTTPServer):
+    """A stand-in for the nchan publisher endpoint that records the messages
+    posted to it. Responses are held until the gate is set."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super(Nchan, self).__init__(('127.0.0.1', 0), NchanHandler)
+        self.status = 200
+        self.requests = queue.Queue()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:{0:d}/pub".format(self.server_port)
+
+    def received(self):
+        messages = []
+        while not self.requests.empty():
+            messages.append(self.requests.get())
+        return messages
+
+
+@pytest.fixture
+def nchan():
+    server = Nchan()
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.gate.set()
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(pubsub.time, 'sleep', lambda seconds: None)
+
+
+def track_event(event, tracklog_id, title):
+    return {
+        'event': event,
+        'tracklog': {'tracklog_id': tracklog_id, 'title': title},
+    }
+
+
+def publish(publisher, url, message, retries=0, max_queue=10):
+    publisher.enqueue(pubsub.PublishEntry(url, message, retries, TIMEOUT),
+                      max_queue)
+
+
+def test_coalesces_pending_track_events(nchan):
+    publisher = pubsub.Publisher()
+
+    # hold the worker in its first request so that the rest are pending
+    nchan.gate.clear()
+    publish(publisher, nchan.url, track_event('track_change', 1, "First"))
+    assert nchan.requests.get(timeout=TIMEOUT)['tracklog']['tracklog_id'] == 1
+
+    publish(publisher, nchan.url, track_event('track_change', 2, "Old"))
+    publish(publisher, nchan.url, {'event': 'session_start'})
+    publish(publisher, nchan.url, track_event('track_edit', 2, "New"))
+    nchan.gate.set()
+    assert publisher.flush(TIMEOUT)
+
+    assert nchan.received() == [
+        track_event('track_change', 2, "New"),
+        {'event': 'session_start'},
+    ]
+    stats = publisher.stats()
+    assert stats['published'] == 4
+    assert stats['coalesced'] == 1
+    assert stats['sent'] == 3
+    assert stats['queue_depth'] == 0
+
+
+def test_retries_are_bounded(nchan):
+    publisher = pubsub.Publisher()
+    nchan.status = 503
+
+    publish(publisher, nchan.url, track_event('track_change', 1, "Title"),
+            retries=2)
+    assert publisher.flush(TIMEOUT)
+
+    assert len(nchan.received()) == 3
+    stats = publisher.stats()
+    assert stats['retries'] == 2
+    assert stats['failed'] == 1
+    assert stats['sent'] == 0
+
+
+def test_drops_events_when_nchan_is_down():
+    server = Nchan()
+    url = server.url
+    server.server_close()
+    publisher = pubsub.Publisher()
+
+    publish(publisher, url, track_event('track_change', 1, "Title"),
+            retries=1)
+    assert publisher.flush(TIMEOUT)
+
+    stats = publisher.stats()
+    assert stats['retries'] == 1
+    assert stats['failed'] == 1
+    assert stats['sent'] == 0
+
+
+def test_drops_events_when_queue_is_full(nchan):
+    publisher = pubsub.Publisher()
+    nchan.gate.clear()
+    publish(publisher, nchan.url, {'event': 'session_start'}, max_queue=2)
+    nchan.requests.get(timeout=TIMEOUT)
+
+    for i in range(3):
+        publish(publisher, nchan.url, track_event('track_change', i, "Title"),
+                max_queue=2)
+    assert publisher.stats()['dropped'] == 1
+
+    nchan.gate.set()
+    assert publisher.flush(TIMEOUT)
+    assert [m['tracklog']['tracklog_id'] for m in nchan.received()] == [0, 1]
+    assert publisher.stats()['sent'] == 3
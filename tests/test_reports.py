@@ -0,0 +1,40 @@
+import datetime
+
+import pytest
+
+from trackman import reports
+
+
+@pytest.mark.parametrize('snapshot', [False, True])
+def test_report_track_information(app, snapshot):
+    from trackman import db
+    from trackman.models import DJSet, Track, TrackLog
+
+    with app.app_context():
+        track = Track("Title", "Artist", "Album", "Label")
+        djset = DJSet(1)
+        db.session.add_all([track, djset])
+        db.session.commit()
+
+        # a play logged before track information was recorded with plays
+        db.session.add(TrackLog(track.id, djset.id))
+        db.session.commit()
+
+        # and one of the track as it was when it was played
+        tracklog = TrackLog(track.id, djset.id)
+        tracklog.title = "Old Title"
+        tracklog.artist = "Old Artist"
+        tracklog.album = "Old Album"
+        tracklog.label = "Old Label"
+        db.session.add(tracklog)
+        db.session.commit()
+
+        now = datetime.datetime.utcnow()
+        rows = reports.report_query(
+            reports.get_report('soundexchange'),
+            now - datetime.timedelta(hours=1), now, snapshot=snapshot).all()
+        assert [row[2:] for row in rows] == [
+            ("Artist", "Title", "Album", "Label"),
+            ("Old Artist", "Old Title", "Old Album", "Old Label")
+            if snapshot else ("Artist", "Title", "Album", "Label"),
+        ]
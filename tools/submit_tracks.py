@@ -1,25 +1,78 @@
 #!/usr/bin/python3
 
 import argparse
+import concurrent.futures
 import mutagen
 import requests
 
 parser = argparse.ArgumentParser(
     description="Submit a playlist of tracks to Trackman")
-parser.add_argument('playlist', help="A text file with one file per line")
+parser.add_argument('playlist', help="A text file with one file per line, "
+                    "optionally preceded by an ISO 8601 timestamp of when "
+                    "it was played and a tab")
+parser.add_argument('--url', default="http://localhost:9070",
+                    help="Base URL of Trackman")
+parser.add_argument('--password', default="hackme",
+                    help="Automation password")
+parser.add_argument('--dj-id', type=int, help="DJ ID to log tracks as")
+parser.add_argument('--chunk-size', type=int, default=500,
+                    help="Number of tracks to submit in each request")
+parser.add_argument('--workers', type=int, default=8,
+                    help="Number of files to read at once")
 args = parser.parse_args()
 
+
+def read_entry(line):
+    if '\t' in line:
+        played, path = line.split('\t', 1)
+    else:
+        played, path = None, line
+
+    track = mutagen.File(path, easy=True)
+    if track is None:
+        raise ValueError("Unsupported file: {}".format(path))
+
+    play = {}
+    for field in ('title', 'artist', 'album', 'label'):
+        values = track.get(field) or [""]
+        play[field] = values[0]
+    if played is not None:
+        play['played'] = played
+    return play
+
+
+def submit(session, plays):
+    data = {
+        'password': args.password,
+        'plays': plays,
+    }
+    if args.dj_id is not None:
+        data['dj_id'] = args.dj_id
+
+    r = session.post(args.url + '/api/automation/log/batch', json=data)
+    r.raise_for_status()
+    result = r.json()
+    # airlog entries are skipped, which is not an error for a backfill
+    if not result['success'] and 'logged' not in result:
+        raise RuntimeError(result.get('error', "Tracks were not logged"))
+    return result
+
+
 with open(args.playlist) as f:
-    for line in f:
-        path = line.strip()
-        track = mutagen.File(path)
-        r = requests.post(
-            'http://localhost:9070/api/automation/log',
-            data={
-                'password': "hackme",
-                'title': track.get('title', ''),
-                'artist': track.get('artist', ''),
-                'album': track.get('album', ''),
-                'label': track.get('label', ''),
-            })
-        r.raise_for_status()
+    lines = [line.strip() for line in f if len(line.strip()) > 0]
+
+session = requests.Session()
+with concurrent.futures.ThreadPoolExecutor(args.workers) as executor:
+    chunk = []
+    for play in executor.map(read_entry, lines):
+        chunk.append(play)
+        if len(chunk) >= args.chunk_size:
+            result = submit(session, chunk)
+            print("Logged {0:d} tracks, skipped {1:d}".format(
+                result['logged'], result['skipped']))
+            chunk = []
+
+    if len(chunk) > 0:
+        result = submit(session, chunk)
+        print("Logged {0:d} tracks, skipped {1:d}".format(
+            result['logged'], result['skipped']))
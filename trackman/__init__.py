@@ -2,12 +2,12 @@ from dateutil import tz
 from flask import Flask, Request
 from flask_caching import Cache
 from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
 from flask_wtf.csrf import CSRFProtect
 import humanize
 import os
 import redis
 from . import defaults
+from .replica import RoutingSQLAlchemy
 import uuid
 import datetime
 import sentry_sdk
@@ -18,7 +18,7 @@ from sentry_sdk.integrations.sqlalchemy import SqlalchemyIntegration
 try:
     import uwsgi
 except ImportError:
-    pass
+    uwsgi = None
 
 json_mimetypes = ['application/json']
 
@@ -102,12 +102,12 @@ if app.config['PROXY_FIX']:
 redis_conn = redis.from_url(app.config['REDIS_URL'])
 
 csrf = CSRFProtect(app)
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)
 migrate = Migrate(app, db)
 
 from trackman.auth import AuthManager, current_user
 auth_manager = AuthManager()
-auth_manager.init_app(app, db)
+auth_manager.init_app(app, db, redis_conn)
 
 if len(app.config['SENTRY_DSN']) > 0:
     sentry_sdk.init(
@@ -149,7 +149,12 @@ def init_app():
     from trackman import admin
     app.register_blueprint(admin.bp, url_prefix='/admin')
 
-    from . import admin_views, cli, models, views
+    from . import admin_views, cli, conditional, instrumentation, models, \
+        replica, views
+    conditional.init_app(app)
+    instrumentation.init_app(app)
+    replica.init_app(app)
+
     from .api import api, api_bp
     from .library import library_bp
     from .library import views as library_views
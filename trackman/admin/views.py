@@ -1,16 +1,15 @@
-from flask import current_app, flash, redirect, render_template, request, \
-    url_for
-import csv
+from flask import abort, current_app, flash, redirect, render_template, \
+    request, stream_with_context, url_for, Response
 import dateutil.parser
-import io
 
-from trackman import auth_manager, db, format_datetime
+from trackman import auth_manager, db, invalidation
 from trackman.auth import login_required
 from trackman.admin import bp
 from trackman.admin.auth import views as auth_views
 from trackman.forms import DJRegisterForm, DJAdminEditForm, RotationForm, \
     RotationEditForm, DJDeleteClaimForm
-from trackman.models import DJ, DJClaim, Rotation, TrackLog
+from trackman.models import DJ, DJClaim, Rotation
+from trackman.reports import REPORTS, generate_csv, get_report
 
 
 @bp.route('/')
@@ -75,6 +74,7 @@ def dj_edit(id):
             db.session.rollback()
             raise
 
+        invalidation.invalidate_all()
         flash('DJ edited.')
         return redirect(url_for('admin.djs'), 303)
 
@@ -110,40 +110,34 @@ def dj_edit_claims(dj_id):
 @bp.route('/reports')
 @auth_manager.check_access('library')
 def reports():
-    return render_template('admin/reports.html')
+    return render_template(
+        'admin/reports.html',
+        reports=[report() for report in REPORTS.values()])
 
 
-@bp.route('/reports/bmi', methods=['GET', 'POST'])
+@bp.route('/reports/<string:name>', methods=['GET', 'POST'])
 @auth_manager.check_access('library')
-def reports_bmi():
+def report(name):
+    try:
+        report = get_report(name)
+    except ValueError:
+        abort(404)
+
     if request.method == 'POST':
         start = dateutil.parser.parse(request.form['dtstart'])
         end = dateutil.parser.parse(request.form['dtend'])
         end = end.replace(hour=23, minute=59, second=59)
 
-        f = io.StringIO()
-        writer = csv.writer(f)
-
-        tracks = TrackLog.query.filter(TrackLog.played >= start,
-                                       TrackLog.played <= end).all()
-        for track in tracks:
-            writer.writerow([
-                current_app.config['TRACKMAN_NAME'],
-                format_datetime(track.played),
-                track.track.title,
-                track.track.artist,
-            ])
-
-        f.seek(0)
-
-        filename = end.strftime("bmirep-%Y-%m-%d.csv")
-        return f.read(), {
-            "Content-Type": "text/csv; charset=utf-8",
-            "Content-Disposition":
-                "attachment; filename=\"{0}\"".format(filename),
-        }
+        filename = end.strftime(report.filename_format)
+        return Response(
+            stream_with_context(generate_csv(report, start, end)),
+            headers={
+                "Content-Type": "text/csv; charset=utf-8",
+                "Content-Disposition":
+                    "attachment; filename=\"{0}\"".format(filename),
+            })
     else:
-        return render_template('admin/reports_bmi.html')
+        return render_template('admin/report.html', report=report)
 
 
 @bp.route('/rotations')
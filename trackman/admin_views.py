@@ -3,7 +3,7 @@ from flask import current_app, flash, jsonify, render_template, \
 import datetime
 import hmac
 
-from . import db, redis_conn
+from . import db, invalidation, onair
 from .auth import current_user
 from .blueprints import private_bp
 from .forms import DJRegisterForm, DJReactivateForm
@@ -37,11 +37,11 @@ def login():
 
         return redirect(url_for('.log'))
 
-    automation = redis_conn.get('automation_enabled') == b"true"
+    state = onair.get_state()
+    automation = bool(state.automation_enabled)
 
-    onair_djset_id = redis_conn.get('onair_djset_id')
-    if onair_djset_id is not None:
-        onair_djset = DJSet.query.get(int(onair_djset_id))
+    if state.djset_id is not None:
+        onair_djset = DJSet.query.get(state.djset_id)
         if onair_djset is not None and onair_djset.dj_id <= 1:
             onair_djset = None
     else:
@@ -97,6 +97,7 @@ def login_all():
         except:
             db.session.rollback()
             raise
+        invalidation.invalidate(invalidation.DJS, invalidation.dj_scope(dj.id))
 
         current_app.logger.warning(
             "Trackman: {airname} logged in from {ip} using {ua}".format(
@@ -109,11 +110,11 @@ def login_all():
 
         return redirect(url_for('.log'))
 
-    automation = redis_conn.get('automation_enabled') == b"true"
+    state = onair.get_state()
+    automation = bool(state.automation_enabled)
 
-    onair_djset_id = redis_conn.get('onair_djset_id')
-    if onair_djset_id is not None:
-        onair_djset = DJSet.query.get(int(onair_djset_id))
+    if state.djset_id is not None:
+        onair_djset = DJSet.query.get(state.djset_id)
         if onair_djset is not None and onair_djset.dj_id <= 1:
             onair_djset = None
     else:
@@ -128,8 +129,7 @@ def login_all():
 @private_bp.route('/automation/start', methods=['POST'])
 @dj_only
 def start_automation():
-    automation = redis_conn.get('automation_enabled') == b"true"
-    if not automation:
+    if not onair.is_automation_enabled():
         current_app.logger.warning(
             "Trackman: Start automation from {ip} using {ua}".format(
                 ip=request.remote_addr,
@@ -0,0 +1,497 @@
+"""Columnar snapshot of every play, for charts and ad hoc reports.
+
+Plays are exported from tracklog, joined with their tracks, into NumPy
+arrays with one element per play. Artists and albums are dictionary encoded:
+each play stores an integer code, and the normalized key and lowest display
+value of each code are stored once. Charts and reports are then computed
+with vectorized group-bys over the arrays instead of SQL against the tables
+tracks are logged to.
+
+The snapshot is stored compressed in Redis so that every process shares it,
+and each process keeps the copy it last loaded until the stored version
+changes. The scheduler exports plays logged since the last refresh every few
+minutes and pushes them to a list of chunks beside the snapshot, which each
+process appends to its copy, so that a refresh costs time proportional to the
+new plays rather than to the whole history. Every night the snapshot is
+rebuilt from scratch, which merges the chunks into it and reflects edited and
+deleted plays.
+
+Times are stored in UTC, as in tracklog. Display values are the lowest seen
+in the whole history rather than in the period of a chart, so they may
+differ in capitalization from the SQL charts.
+"""
+
+from flask import current_app
+import collections
+import datetime
+import io
+import numpy as np
+import redis
+from dateutil import tz
+from . import db, redis_conn
+from .charts import CHART_PER_PAGE
+from .models import DJ, Rotation, Track, TrackLog
+from .playstats import normalize
+
+SNAPSHOT_KEY = "trackman_analytics"
+CHUNKS_KEY = "trackman_analytics_chunks"
+KEY_SEPARATOR = "\x1f"
+
+# if the nightly rebuild has not run, the chunks are merged into the snapshot
+# once there are a day's worth of them
+MAX_CHUNKS = 144
+
+# column: dtype
+COLUMNS = collections.OrderedDict([
+    ('id', np.int64),
+    ('played', 'datetime64[s]'),
+    ('dj_id', np.int32),
+    ('track_id', np.int32),
+    ('rotation_id', np.int32),
+    ('artist', np.int32),
+    ('album', np.int32),
+    ('vinyl', np.bool_),
+    ('request', np.bool_),
+    ('new', np.bool_),
+])
+
+# columns exported as they are, in the order of play_query(), and the value
+# stored when they are null
+PLAY_COLUMNS = collections.OrderedDict([
+    ('id', None),
+    ('played', None),
+    ('dj_id', 0),
+    ('track_id', 0),
+    ('rotation_id', -1),
+    ('vinyl', False),
+    ('request', False),
+    ('new', False),
+])
+
+
+def lowest(values, new_values):
+    return tuple(
+        new if old is None or (new is not None and new < old) else old
+        for old, new in zip(values, new_values))
+
+
+class Dictionary(object):
+    """Dictionary encoding of strings. Each distinct key is assigned the
+    next code, and the lowest display values seen for it are kept, as min()
+    would when aggregating."""
+
+    def __init__(self, fields, keys=None, values=None):
+        self.fields = fields
+        self.keys = keys or []
+        self.values = values or []
+        self.codes = {key: code for code, key in enumerate(self.keys)}
+
+    def encode(self, key, values):
+        code = self.codes.get(key)
+        if code is None:
+            code = self.codes[key] = len(self.keys)
+            self.keys.append(key)
+            self.values.append(values)
+        else:
+            self.values[code] = lowest(self.values[code], values)
+        return code
+
+    def __len__(self):
+        return len(self.keys)
+
+    def to_arrays(self, prefix):
+        arrays = {}
+        arrays.update(pack_strings(prefix + "_keys", self.keys))
+        for i, field in enumerate(self.fields):
+            arrays.update(pack_strings(
+                "{0}_{1}".format(prefix, field),
+                [values[i] for values in self.values]))
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix, fields):
+        keys = unpack_strings(arrays, prefix + "_keys")
+        columns = [unpack_strings(arrays, "{0}_{1}".format(prefix, field))
+                   for field in fields]
+        return cls(fields, keys, list(zip(*columns)))
+
+
+def pack_strings(name, strings):
+    """Pack a list of strings into a byte array of their UTF-8 encodings
+    and an array of offsets into it. None is stored as an empty string."""
+    encoded = [(s or "").encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return {
+        name: np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        name + "_offsets": offsets,
+    }
+
+
+def unpack_strings(arrays, name):
+    data = arrays[name].tobytes()
+    offsets = arrays[name + "_offsets"].tolist()
+    return [data[offsets[i]:offsets[i + 1]].decode('utf-8')
+            for i in range(len(offsets) - 1)]
+
+
+class Snapshot(object):
+    def __init__(self, columns=None, artists=None, albums=None):
+        if columns is None:
+            columns = {name: np.zeros(0, dtype=dtype)
+                       for name, dtype in COLUMNS.items()}
+        self.columns = columns
+        self.artists = artists or Dictionary(('artist',))
+        self.albums = albums or Dictionary(('artist', 'album'))
+
+    def __len__(self):
+        return len(self.columns['id'])
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    @property
+    def last_tracklog_id(self):
+        if len(self) <= 0:
+            return 0
+        return int(self.columns['id'][-1])
+
+    def append(self, plays):
+        """Append plays, as returned by play_query(), to the columns."""
+        values = {name: [] for name in COLUMNS.keys()}
+        for play in plays:
+            for (name, null), value in zip(PLAY_COLUMNS.items(), play):
+                values[name].append(null if value is None else value)
+            artist, album = play[len(PLAY_COLUMNS):]
+            values['artist'].append(self.artists.encode(
+                normalize(artist), (artist,)))
+            values['album'].append(self.albums.encode(
+                normalize(artist) + KEY_SEPARATOR + normalize(album),
+                (artist, album)))
+
+        for name, dtype in COLUMNS.items():
+            self.columns[name] = np.concatenate([
+                self.columns[name], np.array(values[name], dtype=dtype)])
+        return len(values['id'])
+
+    def dump(self):
+        arrays = dict(self.columns)
+        arrays.update(self.artists.to_arrays('artists'))
+        arrays.update(self.albums.to_arrays('albums'))
+        f = io.BytesIO()
+        np.savez_compressed(f, **arrays)
+        return f.getvalue()
+
+    @classmethod
+    def load(cls, data):
+        with np.load(io.BytesIO(data)) as arrays:
+            arrays = {name: arrays[name] for name in arrays.files}
+        return cls(
+            {name: arrays[name] for name in COLUMNS.keys()},
+            Dictionary.from_arrays(arrays, 'artists', ('artist',)),
+            Dictionary.from_arrays(arrays, 'albums', ('artist', 'album')))
+
+    def range_mask(self, start=None, end=None):
+        mask = np.ones(len(self), dtype=np.bool_)
+        if start is not None:
+            mask &= self.columns['played'] >= np.datetime64(
+                start.replace(tzinfo=None), 's')
+        if end is not None:
+            mask &= self.columns['played'] <= np.datetime64(
+                end.replace(tzinfo=None), 's')
+        return mask
+
+
+def dump_plays(plays):
+    """Serialize plays, as returned by play_query(), as a chunk."""
+    arrays = {
+        name: np.array([null if play[i] is None else play[i]
+                        for play in plays], dtype=COLUMNS[name])
+        for i, (name, null) in enumerate(PLAY_COLUMNS.items())}
+    offset = len(PLAY_COLUMNS)
+    arrays.update(pack_strings('artist', [play[offset] for play in plays]))
+    arrays.update(pack_strings('album',
+                               [play[offset + 1] for play in plays]))
+    f = io.BytesIO()
+    np.savez_compressed(f, **arrays)
+    return f.getvalue()
+
+
+def load_plays(data):
+    """Return the plays in a chunk, in the form returned by play_query()."""
+    with np.load(io.BytesIO(data)) as arrays:
+        arrays = {name: arrays[name] for name in arrays.files}
+    columns = [arrays[name].tolist() for name in PLAY_COLUMNS.keys()]
+    columns.extend([s or None for s in unpack_strings(arrays, name)]
+                   for name in ('artist', 'album'))
+    return list(zip(*columns))
+
+
+def play_query():
+    return db.session.query(
+        TrackLog.id, TrackLog.played, TrackLog.dj_id, TrackLog.track_id,
+        TrackLog.rotation_id, TrackLog.vinyl, TrackLog.request,
+        TrackLog.new, Track.artist, Track.album).\
+        join(Track, Track.id == TrackLog.track_id).\
+        order_by(TrackLog.id)
+
+
+class SnapshotCache(object):
+    """The snapshot last loaded by this process, its version, and the number
+    of chunks that have been appended to it."""
+
+    def __init__(self):
+        self.version = None
+        self.snapshot = None
+        self.chunks = 0
+
+    def get(self):
+        with redis_conn.pipeline() as pipe:
+            pipe.hget(SNAPSHOT_KEY, 'version')
+            pipe.llen(CHUNKS_KEY)
+            version, chunks = pipe.execute()
+        if version is None:
+            return None
+
+        if version != self.version:
+            return self.load()
+        if chunks > self.chunks:
+            with redis_conn.pipeline() as pipe:
+                pipe.hget(SNAPSHOT_KEY, 'version')
+                pipe.lrange(CHUNKS_KEY, self.chunks, -1)
+                version, new_chunks = pipe.execute()
+            if version != self.version:
+                return self.load()
+            for data in new_chunks:
+                self.snapshot.append(load_plays(data))
+            self.chunks += len(new_chunks)
+        return self.snapshot
+
+    def load(self):
+        with redis_conn.pipeline() as pipe:
+            pipe.hget(SNAPSHOT_KEY, 'version')
+            pipe.hget(SNAPSHOT_KEY, 'data')
+            pipe.lrange(CHUNKS_KEY, 0, -1)
+            version, data, chunks = pipe.execute()
+        if version is None or data is None:
+            return None
+
+        snapshot = Snapshot.load(data)
+        for chunk in chunks:
+            snapshot.append(load_plays(chunk))
+        self.set(version, snapshot, len(chunks))
+        return snapshot
+
+    def set(self, version, snapshot, chunks=0):
+        self.version = version
+        self.snapshot = snapshot
+        self.chunks = chunks
+
+
+cache = SnapshotCache()
+
+
+def store(snapshot):
+    """Store the whole snapshot, replacing the stored one and its chunks."""
+    version = "{0:d}:{1}".format(snapshot.last_tracklog_id,
+                                 datetime.datetime.utcnow().isoformat())
+    with redis_conn.pipeline() as pipe:
+        pipe.hset(SNAPSHOT_KEY, mapping={
+            'version': version,
+            'data': snapshot.dump(),
+        })
+        pipe.delete(CHUNKS_KEY)
+        pipe.execute()
+    cache.set(version.encode('ascii'), snapshot)
+
+
+def store_chunk(plays):
+    """Push plays that have been appended to the cached snapshot as a chunk.
+    Returns False, and forgets the cached snapshot, if the stored snapshot
+    has changed since it was loaded."""
+    data = dump_plays(plays)
+    with redis_conn.pipeline() as pipe:
+        try:
+            pipe.watch(SNAPSHOT_KEY, CHUNKS_KEY)
+            stored = pipe.hget(SNAPSHOT_KEY, 'version') == cache.version \
+                and pipe.llen(CHUNKS_KEY) == cache.chunks
+            if stored:
+                pipe.multi()
+                pipe.rpush(CHUNKS_KEY, data)
+                pipe.execute()
+        except redis.WatchError:
+            stored = False
+
+    if stored:
+        cache.chunks += 1
+    else:
+        cache.set(None, None)
+    return stored
+
+
+def refresh(full=False, batch_size=10000):
+    """Append plays logged since the snapshot was last refreshed, or export
+    every play if `full` is true or there is no snapshot yet. Returns the
+    number of plays that were added."""
+    snapshot = None if full else cache.get()
+    if snapshot is None:
+        full = True
+        snapshot = Snapshot()
+
+    query = play_query().filter(TrackLog.id > snapshot.last_tracklog_id)
+    plays = query.yield_per(batch_size)
+    if not full:
+        plays = list(plays)
+    count = snapshot.append(plays)
+
+    if full or count > 0 and cache.chunks + 1 >= MAX_CHUNKS:
+        store(snapshot)
+    elif count > 0 and not store_chunk(plays):
+        current_app.logger.warning(
+            "Trackman: Analytics snapshot changed while it was being "
+            "refreshed, {0:d} plays will be added by the next "
+            "refresh".format(count))
+        return 0
+
+    current_app.logger.info(
+        "Trackman: Analytics snapshot refreshed with {0:d} plays, {1:d} "
+        "in total".format(count, len(snapshot)))
+    return count
+
+
+def get_snapshot():
+    """Return the current snapshot, exporting it first if there is none."""
+    snapshot = cache.get()
+    if snapshot is None:
+        refresh(full=True)
+        snapshot = cache.get()
+    return snapshot
+
+
+def top_codes(codes, limit, minlength=0, weights=None):
+    """Count the occurrences of each code and return arrays of the codes and
+    counts of the `limit` most common, the most common first."""
+    counts = np.bincount(codes, weights=weights, minlength=minlength)
+    if weights is not None:
+        counts = counts.astype(np.int64)
+    nonzero = np.flatnonzero(counts)
+    order = nonzero[np.argsort(-counts[nonzero], kind='stable')]
+    if limit is not None:
+        order = order[:limit]
+    return order, counts[order]
+
+
+def album_counts(start, end, limit=CHART_PER_PAGE, snapshot=None):
+    """Return a list of [artist, album, plays] for the provided range, with
+    the most played albums first, like charts.album_counts()."""
+    snapshot = snapshot or get_snapshot()
+    mask = snapshot.range_mask(start, end) & (snapshot['dj_id'] > 1)
+    codes, counts = top_codes(snapshot['album'][mask], limit,
+                              len(snapshot.albums))
+    return [list(snapshot.albums.values[code]) + [int(count)]
+            for code, count in zip(codes, counts)]
+
+
+def artist_counts(start, end, limit=CHART_PER_PAGE, snapshot=None):
+    """Return a list of [artist, plays] for the provided range, with the
+    most played artists first, like charts.artist_counts()."""
+    snapshot = snapshot or get_snapshot()
+    mask = snapshot.range_mask(start, end) & (snapshot['dj_id'] > 1)
+    codes, counts = top_codes(snapshot['artist'][mask], limit,
+                              len(snapshot.artists))
+    return [list(snapshot.artists.values[code]) + [int(count)]
+            for code, count in zip(codes, counts)]
+
+
+def load_djs(dj_ids):
+    djs = DJ.query.filter(DJ.id.in_([int(dj_id) for dj_id in dj_ids]),
+                          DJ.visible == True)
+    return {dj.id: dj for dj in djs}
+
+
+def dj_spin_counts(column=None, limit=CHART_PER_PAGE, snapshot=None):
+    """Return a list of [DJ, plays] of visible DJs over all plays, with the
+    DJs with the most plays first, like the DJ spin charts. If `column` is
+    'vinyl' or 'request', only those plays are counted."""
+    snapshot = snapshot or get_snapshot()
+    weights = snapshot[column] if column is not None else None
+    dj_ids, counts = top_codes(snapshot['dj_id'], None, weights=weights)
+    djs = load_djs(dj_ids)
+    results = [[djs[dj_id], int(count)] for dj_id, count in zip(
+        dj_ids.tolist(), counts) if dj_id in djs]
+    return results[:limit]
+
+
+def new_album_counts(start, end, limit=10, snapshot=None):
+    """Return the most played new albums of each rotation in each month of
+    the provided range, as an ordered dictionary mapping (month, rotation)
+    to a list of [artist, album, plays]."""
+    snapshot = snapshot or get_snapshot()
+    mask = snapshot.range_mask(start, end) & snapshot['new'] & \
+        (snapshot['dj_id'] > 1)
+    months = snapshot['played'][mask].astype('datetime64[M]').\
+        astype(np.int64)
+    groups, counts = np.unique(np.stack([
+        months,
+        snapshot['rotation_id'][mask].astype(np.int64),
+        snapshot['album'][mask].astype(np.int64),
+    ], axis=1), axis=0, return_counts=True)
+
+    rotations = {rotation.id: rotation.rotation
+                 for rotation in Rotation.query}
+    results = collections.OrderedDict()
+    # sort by month and rotation, then by plays in descending order
+    for i in np.lexsort((-counts, groups[:, 1], groups[:, 0])):
+        month, rotation_id, code = groups[i].tolist()
+        key = (str(np.datetime64(month, 'M')),
+               rotations.get(rotation_id, ""))
+        albums = results.setdefault(key, [])
+        if len(albums) < limit:
+            albums.append(list(snapshot.albums.values[code]) +
+                          [int(counts[i])])
+    return results
+
+
+def vinyl_share(start, end, snapshot=None):
+    """Return a list of [DJ, plays, vinyl plays, share of vinyl plays] of
+    the visible DJs who played tracks in the provided range, with the
+    highest share first."""
+    snapshot = snapshot or get_snapshot()
+    mask = snapshot.range_mask(start, end)
+    dj_ids = snapshot['dj_id'][mask]
+    plays = np.bincount(dj_ids)
+    vinyl = np.bincount(dj_ids, weights=snapshot['vinyl'][mask],
+                        minlength=len(plays)).astype(np.int64)
+
+    present = np.flatnonzero(plays)
+    share = vinyl[present] / plays[present]
+    order = present[np.argsort(-share, kind='stable')]
+    djs = load_djs(order)
+    return [[djs[dj_id], int(plays[dj_id]), int(vinyl[dj_id]),
+             float(vinyl[dj_id]) / plays[dj_id]]
+            for dj_id in order.tolist() if dj_id in djs]
+
+
+def local_hours(played):
+    """Return the hour of the day in local time of each UTC time. Each
+    distinct hour is only converted once."""
+    hours, inverse = np.unique(played.astype('datetime64[h]'),
+                               return_inverse=True)
+    local = np.array([
+        hour.astype(datetime.datetime).replace(tzinfo=tz.tzutc()).
+        astimezone(tz.tzlocal()).hour for hour in hours], dtype=np.int64)
+    return local[inverse.reshape(-1)]
+
+
+def request_rates(start, end, snapshot=None):
+    """Return a list of [hour, plays, requests, share of requests] for each
+    hour of the day in local time, over the provided range."""
+    snapshot = snapshot or get_snapshot()
+    mask = snapshot.range_mask(start, end)
+    hours = local_hours(snapshot['played'][mask])
+    plays = np.bincount(hours, minlength=24)
+    requests = np.bincount(hours, weights=snapshot['request'][mask],
+                           minlength=24).astype(np.int64)
+    return [[hour, int(plays[hour]), int(requests[hour]),
+             float(requests[hour]) / plays[hour] if plays[hour] > 0 else 0.0]
+            for hour in range(24)]
@@ -4,7 +4,7 @@ from flask_restful import Api
 
 from .v1.airlog import AirLog, AirLogList
 from .v1.autologout import AutologoutControl
-from .v1.automation import AutomationLog
+from .v1.automation import AutomationLog, AutomationLogBatch
 from .v1.dj import DJ
 from .v1.djset import DJSet, DJSetEnd, DJSetList
 from .v1.rotation import RotationList
@@ -29,6 +29,7 @@ CORS(api_bp, resources={
 
 api = Api(api_bp)
 api.add_resource(AutomationLog, '/api/automation/log')
+api.add_resource(AutomationLogBatch, '/api/automation/log/batch')
 api.add_resource(DJ, '/api/dj/<int:dj_id>')
 api.add_resource(DJSet, '/api/djset/<int:djset_id>')
 api.add_resource(DJSetEnd, '/api/djset/<int:djset_id>/end')
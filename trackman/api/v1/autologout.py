@@ -1,6 +1,6 @@
 from flask import current_app, request
 from flask_restful import abort
-from trackman import redis_conn
+from trackman import onair
 from .base import TrackmanOnAirResource
 
 
@@ -24,10 +24,9 @@ class AutologoutControl(TrackmanOnAirResource):
                   type: boolean
         """
 
-        dj_timeout = redis_conn.get('dj_timeout')
         return {
             'success': True,
-            'autologout': dj_timeout is None,
+            'autologout': onair.get_dj_timeout() is None,
         }
 
     def post(self):
@@ -65,15 +64,14 @@ class AutologoutControl(TrackmanOnAirResource):
                   message="No autologout field given in POST")
 
         if request.form['autologout'] == 'enable':
-            redis_conn.delete('dj_timeout')
+            onair.set_dj_timeout(None)
 
             return {
                 'success': True,
                 'autologout': True,
             }
         else:
-            redis_conn.set('dj_timeout',
-                           current_app.config['EXTENDED_DJ_TIMEOUT'])
+            onair.set_dj_timeout(current_app.config['EXTENDED_DJ_TIMEOUT'])
 
             return {
                 'success': True,
@@ -1,13 +1,79 @@
-from flask import current_app
+from flask import current_app, request
 from flask_restful import abort
-from trackman import db, redis_conn, models, playlists_cache
+import datetime
+import dateutil.parser
+from trackman import autocomplete, db, models, onair
 from trackman.forms import AutomationTrackLogForm
-from trackman.lib import log_track, find_or_add_track, logout_all_except, \
-        is_automation_enabled
+from trackman.lib import log_track, log_tracks, find_or_add_track, \
+        find_or_add_tracks, logout_all_except, invalidate_djsets, \
+        update_dj_charts
 from trackman.view_utils import local_only
 from .base import TrackmanStudioResource
 
 
+AIRLOG_ARTISTS = ("wuvt", "pro", "soo", "psa", "lnr", "ua")
+AIRLOG_NOT_IMPLEMENTED = "AirLog logging not yet implemented"
+BEFORE_DJSET = "Plays from before the automation DJSet started were not " \
+    "logged"
+BATCH_LIMIT = 1000
+
+
+def is_airlog(artist):
+    # TODO: implement airlog logging
+    return artist.lower() in AIRLOG_ARTISTS
+
+
+def get_automation_djset(state, dj_id, dtstart=None):
+    """Return the ID of the automation DJSet to log tracks to for `dj_id`,
+    starting a new one at `dtstart` if needed, or None if automation was
+    disabled in the meantime."""
+    if state.djset_id is not None and state.dj_id == dj_id:
+        # the DJSet on air is already ours, so there is no need to lock
+        # and check the open DJSets; just make sure automation was not
+        # disabled while the tracks were being looked up
+        if onair.is_automation_enabled():
+            return state.djset_id
+        else:
+            return None
+
+    # find an existing automation DJSet to use or create a new one
+    automation_set, ended_djsets = logout_all_except(dj_id)
+    if automation_set is not None:
+        if len(ended_djsets) > 0:
+            try:
+                db.session.commit()
+            except:
+                db.session.rollback()
+                raise
+            invalidate_djsets(*ended_djsets)
+            update_dj_charts(*ended_djsets)
+
+        djset_id = automation_set.id
+    else:
+        automation_set = models.DJSet(dj_id)
+        if dtstart is not None:
+            automation_set.dtstart = dtstart
+        db.session.add(automation_set)
+        try:
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+        invalidate_djsets(automation_set, *ended_djsets)
+        update_dj_charts(*ended_djsets)
+
+        djset_id = automation_set.id
+        current_app.logger.info(
+            "Trackman: Automation DJSet ID {0} created for DJ ID "
+            "{1}".format(djset_id, dj_id))
+
+    # put the DJSet on air only if automation is still enabled, as the
+    # state may have changed while we were running the above queries
+    if not onair.start_automation_set(dj_id, djset_id):
+        return None
+    return djset_id
+
+
 class AutomationLog(TrackmanStudioResource):
     method_decorators = [local_only]
 
@@ -69,7 +135,8 @@ class AutomationLog(TrackmanStudioResource):
         if form.password.data != current_app.config['AUTOMATION_PASSWORD']:
             abort(401, success=False, message="Invalid automation password")
 
-        if not is_automation_enabled():
+        state = onair.get_state()
+        if not state.automation_enabled:
             return {
                 'success': False,
                 'error': "Automation not enabled",
@@ -87,11 +154,10 @@ class AutomationLog(TrackmanStudioResource):
         if len(album) <= 0:
             album = "Not Available"
 
-        if artist.lower() in ("wuvt", "pro", "soo", "psa", "lnr", "ua"):
-            # TODO: implement airlog logging
+        if is_airlog(artist):
             return {
                 'success': False,
-                'message': "AirLog logging not yet implemented",
+                'message': AIRLOG_NOT_IMPLEMENTED,
             }
 
         label = form.label.data
@@ -105,9 +171,8 @@ class AutomationLog(TrackmanStudioResource):
             # Handle automation not providing a label
             label = "Not Available"
             tracks = models.Track.query.filter(
-                db.func.lower(models.Track.title) == db.func.lower(title),
-                db.func.lower(models.Track.artist) == db.func.lower(artist),
-                db.func.lower(models.Track.album) == db.func.lower(album))
+                models.Track.partial_match_key == models.match_key(
+                    artist, title, album)).order_by(models.Track.id)
             if tracks.count() == 0:
                 track = models.Track(title, artist, album, label)
                 db.session.add(track)
@@ -116,6 +181,7 @@ class AutomationLog(TrackmanStudioResource):
                 except:
                     db.session.rollback()
                     raise
+                autocomplete.add_track(track)
             else:
                 notauto = tracks.filter(models.Track.label != "Not Available")
                 if notauto.count() == 0:
@@ -130,40 +196,198 @@ class AutomationLog(TrackmanStudioResource):
         else:
             dj_id = 1
 
-        # find a DJSet to use
-        onair_dj_id = redis_conn.get('onair_dj_id')
-        djset_id = redis_conn.get('onair_djset_id')
-
-        if djset_id != None and onair_dj_id == dj_id:
-            djset_id = int(djset_id)
-        else:
-            # find an existing automation DJSet to use or create a new one
-            automation_set = logout_all_except(dj_id)
-            if automation_set is not None:
-                djset_id = automation_set.id
-            else:
-                automation_set = models.DJSet(dj_id)
-                db.session.add(automation_set)
-                try:
-                    db.session.commit()
-                except:
-                    db.session.rollback()
-                    raise
-                playlists_cache.clear()
+        djset_id = get_automation_djset(state, dj_id)
 
-                djset_id = automation_set.id
-                current_app.logger.info(
-                    "Trackman: Automation DJSet ID {0} created for DJ ID "
-                    "{1}".format(djset_id, dj_id))
-
-            redis_conn.set('onair_dj_id', dj_id)
-            redis_conn.set('onair_djset_id', djset_id)
-
-        # check again if automation is enabled as the state may have changed
-        # while we were running the above queries
-        # if it is and we now have a valid DJSet, log the track
-        if is_automation_enabled() and djset_id is not None:
+        # if we now have a valid DJSet, log the track
+        if djset_id is not None:
             log_track(track.id, djset_id, track=track)
             return {'success': True}, 201
         else:
             return {'success': False}
+
+
+def parse_play(play, now):
+    """Return a (title, artist, album, label, played) tuple for a play
+    submitted to AutomationLogBatch. Raises ValueError if it is invalid."""
+    if not isinstance(play, dict):
+        raise ValueError("Play must be an object")
+
+    values = []
+    for field in ('title', 'artist', 'album', 'label'):
+        value = play.get(field) or ""
+        if not isinstance(value, str):
+            raise ValueError("{} must be a string".format(field.title()))
+        values.append(value.strip())
+
+    title, artist, album, label = values
+    if len(title) <= 0:
+        raise ValueError("Title must be provided")
+    if len(artist) <= 0:
+        raise ValueError("Artist must be provided")
+    if len(album) <= 0:
+        album = "Not Available"
+
+    played = play.get('played')
+    if played is None:
+        played = now
+    else:
+        try:
+            played = dateutil.parser.isoparse(played)
+        except (TypeError, ValueError):
+            raise ValueError("Played must be an ISO 8601 timestamp")
+        if played.tzinfo is not None:
+            played = played.astimezone(datetime.timezone.utc).\
+                replace(tzinfo=None)
+        if played > now:
+            raise ValueError("Played must not be in the future")
+
+    return title, artist, album, label, played
+
+
+class AutomationLogBatch(TrackmanStudioResource):
+    method_decorators = [local_only]
+
+    def post(self):
+        """
+        Log a batch of tracks played by automation, such as to backfill plays
+        missed during an outage. Plays are logged to the automation DJSet on
+        air, or to a new one starting at the earliest play. Plays from before
+        the automation DJSet on air started are skipped, as they were played
+        during another DJSet.
+        ---
+        operationId: logAutomationTracks
+        tags:
+        - trackman
+        - tracklog
+        - automation
+        parameters:
+        - in: body
+          name: body
+          required: true
+          schema:
+            type: object
+            properties:
+              password:
+                type: string
+                description: Automation password
+              dj_id:
+                type: integer
+                description: DJ ID to use; will default to 1 if not provided
+              plays:
+                type: array
+                description: Plays to log, up to 1000
+                items:
+                  type: object
+                  properties:
+                    title:
+                      type: string
+                    artist:
+                      type: string
+                    album:
+                      type: string
+                    label:
+                      type: string
+                    played:
+                      type: string
+                      format: date-time
+                      description: When the track was played; defaults to
+                        now
+        responses:
+          200:
+            description: Tracks accepted, but not logged
+            schema:
+              type: object
+              properties:
+                success:
+                  type: boolean
+          201:
+            description: Tracks logged; success is false and skipped is the
+              number of plays that were not logged if there were airlog
+              entries, which cannot be logged yet, or plays from before the
+              automation DJSet started
+            schema:
+              type: object
+              properties:
+                success:
+                  type: boolean
+                logged:
+                  type: integer
+                skipped:
+                  type: integer
+                message:
+                  type: string
+          400:
+            description: Bad request
+          401:
+            description: Invalid automation password
+        """
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            abort(400, success=False, message="A JSON object is required")
+
+        if data.get('password') != current_app.config['AUTOMATION_PASSWORD']:
+            abort(401, success=False, message="Invalid automation password")
+
+        state = onair.get_state()
+        if not state.automation_enabled:
+            return {
+                'success': False,
+                'error': "Automation not enabled",
+            }
+
+        plays = data.get('plays')
+        if not isinstance(plays, list) or len(plays) <= 0:
+            abort(400, success=False, message="Plays must be provided")
+        if len(plays) > BATCH_LIMIT:
+            abort(400, success=False,
+                  message="At most {0:d} plays may be logged at "
+                  "once".format(BATCH_LIMIT))
+
+        try:
+            dj_id = int(data.get('dj_id') or 1)
+        except (TypeError, ValueError):
+            abort(400, success=False, message="Invalid DJ ID")
+
+        now = datetime.datetime.utcnow()
+        parsed = []
+        for i, play in enumerate(plays):
+            try:
+                parsed.append(parse_play(play, now))
+            except ValueError as exc:
+                abort(400, success=False,
+                      message="Play {0:d}: {1}".format(i, exc))
+
+        # as with single plays, airlog entries are not logged, and the
+        # batch is reported as not entirely successful
+        messages = []
+        tracklogs = [play for play in parsed if not is_airlog(play[1])]
+        if len(tracklogs) < len(parsed):
+            messages.append(AIRLOG_NOT_IMPLEMENTED)
+
+        djset_id = None
+        if len(tracklogs) > 0:
+            djset_id = get_automation_djset(
+                state, dj_id, min(play[4] for play in tracklogs))
+            if djset_id is None:
+                return {'success': False}
+
+            # plays from before the DJSet started were played during another
+            # one, so they are skipped rather than listed in its playlist
+            dtstart = models.DJSet.query.get(djset_id).dtstart
+            if any(play[4] < dtstart for play in tracklogs):
+                tracklogs = [play for play in tracklogs
+                             if play[4] >= dtstart]
+                messages.append(BEFORE_DJSET)
+
+        skipped = len(parsed) - len(tracklogs)
+        result = {'success': skipped <= 0, 'logged': 0, 'skipped': skipped}
+        if len(messages) > 0:
+            result['message'] = "; ".join(messages)
+        if len(tracklogs) <= 0:
+            return result
+
+        tracks = find_or_add_tracks([play[:4] for play in tracklogs])
+        result['logged'] = log_tracks(
+            [(track, play[4]) for track, play in zip(tracks, tracklogs)],
+            djset_id)
+        return result, 201
@@ -1,5 +1,6 @@
 from flask_restful import Resource
-from trackman import csrf, playlists_cache, charts_cache
+from trackman import csrf, conditional, invalidation, playlists_cache, \
+    charts_cache, replica
 from trackman.view_utils import ajax_only, local_only, dj_only, dj_interact, \
     require_dj_session, require_onair
 
@@ -23,17 +24,34 @@ class TrackmanStudioResource(TrackmanResource):
     method_decorators = [local_only, ajax_only, dj_interact]
 
 
-class PlaylistResource(Resource):
+class CachedResource(Resource):
+    @classmethod
+    def get_cached(cls, *args, **kwargs):
+        """Call get() through the caching decorators, as a request to the
+        resource would, so that views built on the resource share its cache
+        and validators."""
+        meth = cls().get
+        for decorator in cls.method_decorators['get']:
+            meth = decorator(meth)
+        return meth(*args, **kwargs)
+
+
+class PlaylistResource(CachedResource):
     method_decorators = {
         'get': [
-            playlists_cache.memoize(args_to_ignore=['self', 'cls']),
+            invalidation.memoize(playlists_cache),
+            replica.read_only,
         ],
     }
 
+    def cache_scopes(self, *args, **kwargs):
+        return []
+
 
-class ChartResource(Resource):
+class ChartResource(CachedResource):
     method_decorators = {
         'get': [
-            charts_cache.memoize(args_to_ignore=['self', 'cls']),
+            conditional.memoize(charts_cache),
+            replica.read_only,
         ],
     }
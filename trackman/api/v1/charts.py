@@ -1,9 +1,16 @@
 from flask_restful import abort, Resource
-from trackman import db, charts
-from trackman.models import DJ, Track, TrackLog
+from trackman import db, charts, djcharts
+from trackman.models import DJ
 from .base import ChartResource
 
 
+# returned rather than raised, so that it is neither cached nor logged
+NOT_BUILT = {
+    'success': False,
+    'message': "The charts for this DJ have not been built yet",
+}, 503
+
+
 class Charts(Resource):
     def get(self):
         return {
@@ -20,19 +27,7 @@ class AlbumCharts(ChartResource):
         except ValueError:
             abort(404)
 
-        results = charts.get(
-            'albums_{0}_{1}'.format(start, end),
-            Track.query.with_entities(
-                db.func.min(Track.artist),
-                db.func.min(Track.album),
-                db.func.count(TrackLog.id)).
-            join(TrackLog).filter(db.and_(
-                TrackLog.dj_id > 1,
-                TrackLog.played >= start,
-                TrackLog.played <= end)).
-            group_by(db.func.lower(Track.artist),
-                     db.func.lower(Track.album)).
-            order_by(db.func.count(TrackLog.id).desc()))
+        results = charts.album_chart(start, end)
 
         return {
             'start': start,
@@ -44,16 +39,10 @@ class AlbumCharts(ChartResource):
 class DJAlbumCharts(ChartResource):
     def get(self, dj_id):
         dj = DJ.query.get_or_404(dj_id)
-        results = charts.get(
-            'albums_dj_{}'.format(dj_id),
-            Track.query.with_entities(
-                db.func.min(Track.artist),
-                db.func.min(Track.album),
-                db.func.count(TrackLog.id)).
-            join(TrackLog).filter(TrackLog.dj_id == dj.id).
-            group_by(db.func.lower(Track.artist),
-                     db.func.lower(Track.album)).
-            order_by(db.func.count(TrackLog.id).desc()))
+        results = djcharts.album_chart(dj.id)
+        if results is None:
+            return NOT_BUILT
+        results = charts.rank(results)
 
         return {
             'dj': dj.serialize(),
@@ -68,17 +57,7 @@ class ArtistCharts(ChartResource):
         except ValueError:
             abort(404)
 
-        results = charts.get(
-            'artists_{0}_{1}'.format(start, end),
-            Track.query.with_entities(
-                db.func.min(Track.artist),
-                db.func.count(TrackLog.id)).
-            join(TrackLog).filter(db.and_(
-                TrackLog.dj_id > 1,
-                TrackLog.played >= start,
-                TrackLog.played <= end)).
-            group_by(db.func.lower(Track.artist)).
-            order_by(db.func.count(TrackLog.id).desc()))
+        results = charts.artist_chart(start, end)
 
         return {
             'start': start,
@@ -90,14 +69,10 @@ class ArtistCharts(ChartResource):
 class DJArtistCharts(ChartResource):
     def get(self, dj_id):
         dj = DJ.query.get_or_404(dj_id)
-        results = charts.get(
-            'artists_dj_{}'.format(dj_id),
-            Track.query.with_entities(
-                db.func.min(Track.artist),
-                db.func.count(TrackLog.id)).
-            join(TrackLog).filter(TrackLog.dj_id == dj.id).
-            group_by(db.func.lower(Track.artist)).
-            order_by(db.func.count(TrackLog.id).desc()))
+        results = djcharts.artist_chart(dj.id)
+        if results is None:
+            return NOT_BUILT
+        results = charts.rank(results)
 
         return {
             'dj': dj.serialize(),
@@ -112,38 +87,22 @@ class TrackCharts(ChartResource):
         except ValueError:
             abort(404)
 
-        subquery = TrackLog.query.\
-            with_entities(TrackLog.track_id,
-                          db.func.count(TrackLog.id).label('count')).\
-            filter(TrackLog.dj_id > 1,
-                   TrackLog.played >= start,
-                   TrackLog.played <= end).\
-            group_by(TrackLog.track_id).subquery()
-        results = charts.get(
-            'tracks_{start}_{end}'.format(start=start, end=end),
-            Track.query.with_entities(Track, subquery.c.count).
-            join(subquery).order_by(db.desc(subquery.c.count)))
+        results = charts.track_chart(start, end)
 
         return {
             'start': start,
             'end': end,
-            'results': [(x[0].serialize(), x[1], x[2]) for x in results],
+            'results': [(x[0], x[1], x[2]) for x in results],
         }
 
 
 class DJTrackCharts(ChartResource):
     def get(self, dj_id):
         dj = DJ.query.get_or_404(dj_id)
-
-        subquery = TrackLog.query.\
-            with_entities(TrackLog.track_id,
-                          db.func.count(TrackLog.id).label('count')).\
-            filter(TrackLog.dj_id == dj.id).\
-            group_by(TrackLog.track_id).subquery()
-        results = charts.get(
-            'tracks_dj_{}'.format(dj_id),
-            Track.query.with_entities(Track, subquery.c.count).
-            join(subquery).order_by(db.desc(subquery.c.count)))
+        results = djcharts.track_chart(dj.id)
+        if results is None:
+            return NOT_BUILT
+        results = charts.rank(results)
 
         return {
             'dj': dj.serialize(),
@@ -153,55 +112,38 @@ class DJTrackCharts(ChartResource):
 
 class DJSpinCharts(ChartResource):
     def get(self):
-        subquery = TrackLog.query.\
-            with_entities(TrackLog.dj_id,
-                          db.func.count(TrackLog.id).label('count')).\
-            group_by(TrackLog.dj_id).subquery()
-
         results = charts.get(
             'dj_spins',
-            DJ.query.with_entities(DJ, subquery.c.count).
-            join(subquery).filter(DJ.visible == True).
-            order_by(db.desc(subquery.c.count)))
+            DJ.query.with_entities(DJ, DJ.play_count).
+            filter(DJ.visible == True, DJ.play_count > 0).
+            order_by(db.desc(DJ.play_count)))
 
         return {
-            'results': [(x[0].serialize(), x[1], x[2]) for x in results],
+            'results': [(x[0], x[1], x[2]) for x in results],
         }
 
 
 class DJVinylSpinCharts(ChartResource):
     def get(self):
-        subquery = TrackLog.query.\
-            with_entities(TrackLog.dj_id,
-                          db.func.count(TrackLog.id).label('count')).\
-            filter(TrackLog.vinyl == True).\
-            group_by(TrackLog.dj_id).subquery()
-
         results = charts.get(
             'dj_vinyl_spins',
-            DJ.query.with_entities(DJ, subquery.c.count).
-            join(subquery).filter(DJ.visible == True).
-            order_by(db.desc(subquery.c.count)))
+            DJ.query.with_entities(DJ, DJ.vinyl_play_count).
+            filter(DJ.visible == True, DJ.vinyl_play_count > 0).
+            order_by(db.desc(DJ.vinyl_play_count)))
 
         return {
-            'results': [(x[0].serialize(), x[1], x[2]) for x in results],
+            'results': [(x[0], x[1], x[2]) for x in results],
         }
 
 
 class DJRequestCharts(ChartResource):
     def get(self):
-        subquery = TrackLog.query.\
-            with_entities(TrackLog.dj_id,
-                          db.func.count(TrackLog.id).label('count')).\
-            filter(TrackLog.request == True).\
-            group_by(TrackLog.dj_id).subquery()
-
         results = charts.get(
             'dj_requests',
-            DJ.query.with_entities(DJ, subquery.c.count).
-            join(subquery).filter(DJ.visible == True).
-            order_by(db.desc(subquery.c.count)))
+            DJ.query.with_entities(DJ, DJ.request_play_count).
+            filter(DJ.visible == True, DJ.request_play_count > 0).
+            order_by(db.desc(DJ.request_play_count)))
 
         return {
-            'results': [(x[0].serialize(), x[1], x[2]) for x in results],
+            'results': [(x[0], x[1], x[2]) for x in results],
         }
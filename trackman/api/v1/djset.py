@@ -1,9 +1,9 @@
 import datetime
 from flask import current_app, request, session
 from flask_restful import abort
-from trackman import db, redis_conn, mail, models, playlists_cache, pubsub
-from trackman.lib import check_onair, disable_automation, \
-    logout_all_except
+from trackman import db, mail, models, onair, pubsub
+from trackman.lib import disable_automation, invalidate_djsets, \
+    logout_all_except, update_dj_charts
 from .base import TrackmanResource
 
 
@@ -86,7 +86,8 @@ class DJSetEnd(TrackmanResource):
         except:
             db.session.rollback()
             raise
-        playlists_cache.clear()
+        invalidate_djsets(djset)
+        update_dj_charts(djset)
 
         session.pop('dj_id', None)
         session.pop('djset_id', None)
@@ -97,18 +98,10 @@ class DJSetEnd(TrackmanResource):
                 'event': "session_end",
             })
 
-        if check_onair(djset_id):
-            redis_conn.delete('onair_dj_id')
-            redis_conn.delete('onair_djset_id')
-
-        # Reset the dj activity timeout period
-        redis_conn.delete('dj_timeout')
-
-        # Set dj_active expiration to NO_DJ_TIMEOUT to reduce automation
-        # start time
-        redis_conn.set('dj_active', 'false')
-        redis_conn.expire(
-            'dj_active', int(current_app.config['NO_DJ_TIMEOUT']))
+        # Take the set off the air, reset the dj activity timeout period,
+        # and set the dj_active expiration to NO_DJ_TIMEOUT to reduce
+        # automation start time
+        onair.end_set(djset_id, int(current_app.config['NO_DJ_TIMEOUT']))
 
         # email playlist
         if request.form.get('email_playlist', 'false') == 'true':
@@ -161,7 +154,7 @@ class DJSetList(TrackmanResource):
 
         # Close open DJSets, and see if we have one that belongs to the current
         # DJ that we can reuse
-        djset = logout_all_except(dj.id)
+        djset, ended_djsets = logout_all_except(dj.id)
         if djset is None:
             djset = models.DJSet(dj.id)
             db.session.add(djset)
@@ -171,10 +164,10 @@ class DJSetList(TrackmanResource):
         except:
             db.session.rollback()
             raise
-        playlists_cache.clear()
+        invalidate_djsets(djset, *ended_djsets)
+        update_dj_charts(*ended_djsets)
 
-        redis_conn.set('onair_dj_id', dj_id)
-        redis_conn.set('onair_djset_id', djset.id)
+        onair.start_set(dj_id, djset.id)
         session['djset_id'] = djset.id
 
         return {
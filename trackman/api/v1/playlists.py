@@ -1,14 +1,26 @@
 import datetime
-from flask import request
+from flask import current_app, request, Response
 from flask_restful import abort, Resource
-from trackman import db
-from trackman.lib import get_current_tracklog, serialize_trackinfo
+from trackman import db, invalidation, nowplaying, pagination
 from trackman.models import DJ, DJSet, Track, TrackLog
 from trackman.view_utils import list_archives
 from .base import PlaylistResource
 
 
-class NowPlaying(PlaylistResource):
+def snapshot_reads():
+    return current_app.config['TRACKLOG_SNAPSHOT_READS']
+
+
+def paginate(query, columns, descending=False):
+    try:
+        return pagination.paginate(
+            query, columns, request.args.get('cursor'),
+            request.args.get('limit'), descending)
+    except ValueError as exc:
+        abort(400, success=False, message=str(exc))
+
+
+class NowPlaying(Resource):
     def get(self):
         """
         Retrieve information about what is currently playing.
@@ -20,11 +32,13 @@ class NowPlaying(PlaylistResource):
         - tracklog
         - track
         """
-        tracklog = TrackLog.query.order_by(db.desc(TrackLog.id)).first()
-        return tracklog.api_serialize()
+        return Response(nowplaying.get('json'), mimetype="application/json")
 
 
 class Last15Tracks(PlaylistResource):
+    def cache_scopes(self):
+        return [invalidation.NOW_PLAYING]
+
     def get(self):
         """
         Retrieve information about the last 15 tracks that were played.
@@ -36,13 +50,16 @@ class Last15Tracks(PlaylistResource):
         - tracklog
         - track
         """
-        tracks = TrackLog.query.order_by(db.desc(TrackLog.id)).limit(15).all()
+        tracks = nowplaying.latest_first(TrackLog.query.options(
+            *TrackLog.api_serialize_options(snapshot_reads()))).\
+            limit(15).all()
         return {
-            'tracks': [t.api_serialize() for t in tracks],
+            'tracks': [t.api_serialize(snapshot=snapshot_reads())
+                       for t in tracks],
         }
 
 
-class LatestTrack(PlaylistResource):
+class LatestTrack(Resource):
     def get(self):
         """
         Retrieve information about what is currently playing in the old format.
@@ -54,10 +71,14 @@ class LatestTrack(PlaylistResource):
         - tracklog
         - track
         """
-        return serialize_trackinfo(get_current_tracklog())
+        return Response(nowplaying.get('trackinfo'),
+                        mimetype="application/json")
 
 
 class PlaylistsByDay(PlaylistResource):
+    def cache_scopes(self, year, month, day):
+        return [invalidation.day_scope(datetime.date(year, month, day))]
+
     def get(self, year, month, day):
         """
         Get a list of playlists played on a particular day.
@@ -88,7 +109,7 @@ class PlaylistsByDay(PlaylistResource):
         """
         dtstart = datetime.datetime(year, month, day, 0, 0, 0)
         dtend = datetime.datetime(year, month, day, 23, 59, 59)
-        sets = DJSet.query.\
+        sets = DJSet.query.options(db.joinedload(DJSet.dj)).\
             filter(DJSet.dtstart >= dtstart, DJSet.dtstart <= dtend).\
             all()
 
@@ -113,13 +134,14 @@ class PlaylistsByDateRange(Resource):
         except ValueError:
             abort(400)
 
-        sets = DJSet.query.\
-            filter(DJSet.dtstart >= start, DJSet.dtstart <= end).\
-            order_by(db.desc(DJSet.dtstart)).\
-            limit(300).all()
+        sets, next_cursor = paginate(
+            DJSet.query.options(db.joinedload(DJSet.dj)).
+            filter(DJSet.dtstart >= start, DJSet.dtstart <= end),
+            [DJSet.dtstart, DJSet.id], descending=True)
 
         return {
             'sets': [s.serialize() for s in sets],
+            'next': next_cursor,
         }
 
 
@@ -133,17 +155,23 @@ class PlaylistsTrackLogsByDateRange(Resource):
         except ValueError:
             abort(400)
 
-        tracklogs = TrackLog.query.\
-            filter(TrackLog.played >= start, TrackLog.played <= end).\
-            order_by(db.desc(TrackLog.id)).\
-            limit(300).all()
+        tracklogs, next_cursor = paginate(
+            TrackLog.query.
+            options(*TrackLog.api_serialize_options(snapshot_reads())).
+            filter(TrackLog.played >= start, TrackLog.played <= end),
+            [TrackLog.played, TrackLog.id], descending=True)
 
         return {
-            'tracklogs': [t.api_serialize() for t in tracklogs],
+            'tracklogs': [t.api_serialize(snapshot=snapshot_reads())
+                          for t in tracklogs],
+            'next': next_cursor,
         }
 
 
 class PlaylistDJs(PlaylistResource):
+    def cache_scopes(self):
+        return [invalidation.DJS]
+
     def get(self):
         """
         List DJs who have played something recently.
@@ -161,6 +189,9 @@ class PlaylistDJs(PlaylistResource):
 
 
 class PlaylistAllDJs(PlaylistResource):
+    def cache_scopes(self):
+        return [invalidation.DJS]
+
     def get(self):
         """
         List all DJs, even those that haven't played anything in a while.
@@ -178,9 +209,16 @@ class PlaylistAllDJs(PlaylistResource):
 
 
 class PlaylistsByDJ(PlaylistResource):
+    def cache_scopes(self, dj_id):
+        return [invalidation.dj_scope(dj_id)]
+
     def get(self, dj_id):
         """
         Get a list of playlists played by a particular DJ.
+
+        Playlists are returned newest first, 300 at a time unless a limit
+        is given (at most 1000); pass the returned next cursor to get the
+        following page.
         ---
         operationId: getPlaylistsByDJ
         tags:
@@ -192,20 +230,33 @@ class PlaylistsByDJ(PlaylistResource):
           type: integer
           required: true
           description: The ID of a DJ
+        - in: query
+          name: cursor
+          type: string
+          description: The next cursor from the previous page of results
+        - in: query
+          name: limit
+          type: integer
+          description: The maximum number of results to return
         responses:
           404:
             description: DJ not found
         """
         dj = DJ.query.get_or_404(dj_id)
-        sets = DJSet.query.filter(DJSet.dj_id == dj_id).order_by(
-            DJSet.dtstart.desc()).all()
+        sets, next_cursor = paginate(
+            DJSet.query.filter(DJSet.dj_id == dj_id),
+            [DJSet.dtstart, DJSet.id], descending=True)
         return {
             'dj': dj.serialize(),
             'sets': [s.serialize() for s in sets],
+            'next': next_cursor,
         }
 
 
 class Playlist(PlaylistResource):
+    def cache_scopes(self, set_id):
+        return [invalidation.djset_scope(set_id)]
+
     def get(self, set_id):
         """
         Get a list of tracks and archive links for a playlist.
@@ -225,21 +276,31 @@ class Playlist(PlaylistResource):
             description: Playlist not found
         """
         djset = DJSet.query.get_or_404(set_id)
-        tracks = TrackLog.query.filter(TrackLog.djset_id == djset.id).order_by(
-            TrackLog.played).all()
+        tracks = TrackLog.query.\
+            options(*TrackLog.api_serialize_options(snapshot_reads())).\
+            filter(TrackLog.djset_id == djset.id).\
+            order_by(TrackLog.played).all()
 
         data = djset.serialize()
         data.update({
             'archives': [list(a) for a in list_archives(djset)],
-            'tracks': [t.api_serialize() for t in tracks],
+            'tracks': [t.api_serialize(snapshot=snapshot_reads())
+                       for t in tracks],
         })
         return data
 
 
 class PlaylistTrack(PlaylistResource):
+    def cache_scopes(self, track_id):
+        return [invalidation.track_scope(track_id)]
+
     def get(self, track_id):
         """
         Get information about a Track.
+
+        Plays of the track are returned newest first, 300 at a time unless
+        a limit is given (at most 1000); pass the returned next cursor to
+        get the following page. play_count is the total number of plays.
         ---
         operationId: getPlaylistTrack
         tags:
@@ -251,14 +312,27 @@ class PlaylistTrack(PlaylistResource):
           type: integer
           required: true
           description: The ID of an existing Track
+        - in: query
+          name: cursor
+          type: string
+          description: The next cursor from the previous page of results
+        - in: query
+          name: limit
+          type: integer
+          description: The maximum number of results to return
         responses:
           404:
             description: Track not found
         """
         track = Track.query.get_or_404(track_id)
-        tracklogs = TrackLog.query.filter(TrackLog.track_id == track.id).\
-            order_by(TrackLog.played).all()
+        tracklogs, next_cursor = paginate(
+            TrackLog.query.
+            options(*TrackLog.api_serialize_options()).
+            filter(TrackLog.track_id == track.id),
+            [TrackLog.played, TrackLog.id], descending=True)
 
         data = track.api_serialize()
+        data['play_count'] = track.play_count
         data['plays'] = [tl.api_serialize() for tl in tracklogs]
+        data['next'] = next_cursor
         return data
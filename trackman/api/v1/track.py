@@ -1,6 +1,6 @@
 from flask import request, session
 from flask_restful import abort
-from trackman import db, models
+from trackman import autocomplete, db, models, search
 from trackman.forms import TrackAddForm
 from trackman.lib import find_or_add_track
 from .base import TrackmanResource, TrackmanDJResource
@@ -152,80 +152,23 @@ class TrackSearch(TrackmanResource):
             description: Bad request
         """
 
-        base_query = models.Track.query.outerjoin(models.TrackLog).\
-            order_by(models.Track.plays)
-
-        # To verify some data was searched for
-        somesearch = False
-
-        tracks = base_query
-
-        # Do case-insensitive exact matching first
-
-        artist = request.args.get('artist', '').strip()
-        if len(artist) > 0:
-            somesearch = True
-            tracks = tracks.filter(
-                db.func.lower(models.Track.artist) == db.func.lower(artist))
-
-        title = request.args.get('title', '').strip()
-        if len(title) > 0:
-            somesearch = True
-            tracks = tracks.filter(
-                db.func.lower(models.Track.title) == db.func.lower(title))
-
-        album = request.args.get('album', '').strip()
-        if len(album) > 0:
-            somesearch = True
-            tracks = tracks.filter(
-                db.func.lower(models.Track.album) == db.func.lower(album))
-
-        label = request.args.get('label', '').strip()
-        if len(label) > 0:
-            somesearch = True
-            tracks = tracks.filter(
-                db.func.lower(models.Track.label) == db.func.lower(label))
+        criteria = {}
+        for field in search.SEARCH_FIELDS:
+            value = request.args.get(field, '').strip()
+            if len(value) > 0:
+                criteria[field] = value
 
         # This means there was a bad search, stop searching
-        if somesearch is False:
+        if len(criteria) <= 0:
             return {
                 'success': False,
                 'message': "All provided fields to match against are empty",
                 'results': [],
             }
 
-        # Check if results
-
-        tracks = tracks.limit(8).all()
-        if len(tracks) == 0:
-            tracks = base_query
-
-            # if there are too few results, append some similar results
-            artist = request.args.get('artist', '').strip()
-            if len(artist) > 0:
-                somesearch = True
-                tracks = tracks.filter(
-                    models.Track.artist.ilike(''.join(['%', artist, '%'])))
-
-            title = request.args.get('title', '').strip()
-            if len(title) > 0:
-                somesearch = True
-                tracks = tracks.filter(
-                    models.Track.title.ilike(''.join(['%', title, '%'])))
-
-            album = request.args.get('album', '').strip()
-            if len(album) > 0:
-                somesearch = True
-                tracks = tracks.filter(
-                    models.Track.album.ilike(''.join(['%', album, '%'])))
-
-            label = request.args.get('label', '').strip()
-            if len(label) > 0:
-                somesearch = True
-                tracks = tracks.filter(
-                    models.Track.label.ilike(''.join(['%', label, '%'])))
-
-            tracks = tracks.limit(8).all()
+        # Do case-insensitive exact matching first, then fall back to similar
+        # results if there are none
+        tracks = search.search_tracks(criteria, limit=8)
 
         if len(tracks) > 0:
             results = [t.serialize() for t in tracks]
@@ -284,6 +227,21 @@ class TrackAutoComplete(TrackmanResource):
         """
 
         field = request.args['field']
+
+        # Use the prefix index when only the field being completed is
+        # provided, which is how the DJ interface uses autocomplete
+        if field in autocomplete.FIELDS:
+            criteria = [f for f in autocomplete.FIELDS
+                        if len(request.args.get(f, '').strip()) > 0]
+            if criteria == [field]:
+                results = autocomplete.complete(
+                    field, request.args[field].strip(), limit=25)
+                if results is not None:
+                    return {
+                        'success': True,
+                        'results': results,
+                    }
+
         if field == 'artist':
             base_query = models.Track.query.\
                 with_entities(models.Track.artist).\
@@ -1,7 +1,7 @@
 import dateutil.parser
 from flask import session
 from flask_restful import abort
-from trackman import db, models
+from trackman import db, invalidation, models, nowplaying, playstats
 from trackman.forms import TrackLogForm, TrackLogEditForm
 from trackman.lib import fixup_current_track, log_track, find_or_add_track
 from .base import TrackmanOnAirResource
@@ -17,14 +17,6 @@ class TrackLog(TrackmanOnAirResource):
 
         return tracklog
 
-    def _get_current_id(self):
-        current_tracklog = models.TrackLog.query.with_entities(
-            models.TrackLog.id).order_by(db.desc(models.TrackLog.id)).first()
-        if current_tracklog is not None:
-            return current_tracklog[0]
-        else:
-            return None
-
     def delete(self, tracklog_id):
         """
         Delete an existing logged track entry
@@ -56,14 +48,17 @@ class TrackLog(TrackmanOnAirResource):
         """
 
         tracklog = self._load(tracklog_id)
-        current_tracklog_id = self._get_current_id()
+        current_tracklog_id = nowplaying.get_current_id()
+        scopes = invalidation.tracklog_scopes(tracklog)
         db.session.delete(tracklog)
+        playstats.remove_play(tracklog)
         try:
             db.session.commit()
         except:
             db.session.rollback()
             raise
 
+        invalidation.invalidate(*scopes)
         if tracklog_id == current_tracklog_id:
             fixup_current_track("track_delete")
 
@@ -115,7 +110,9 @@ class TrackLog(TrackmanOnAirResource):
         """
 
         tracklog = self._load(tracklog_id)
-        current_tracklog_id = self._get_current_id()
+        current_tracklog_id = nowplaying.get_current_id()
+        scopes = invalidation.tracklog_scopes(tracklog)
+        old_play = playstats.play_info(tracklog)
 
         form = TrackLogEditForm(meta={'csrf': False})
         artist = form.artist.data
@@ -134,6 +131,7 @@ class TrackLog(TrackmanOnAirResource):
                     album,
                     label))
                 tracklog.track_id = track.id
+                tracklog.set_snapshot(track)
             else:
                 abort(400, success=False, errors=form.errors,
                       message="The track information you entered did not validate. Common reasons for this include missing or improperly entered information, especially the label. Please try again. If you continue to get this message after several attempts, and you're sure the information is correct, please contact the IT staff for help.")
@@ -155,12 +153,17 @@ class TrackLog(TrackmanOnAirResource):
                   message="Rotation specified by rotation_id does not exist")
         tracklog.rotation_id = rotation.id
 
+        playstats.replace_play(old_play, tracklog,
+                               models.Track.query.get(tracklog.track_id))
+
         try:
             db.session.commit()
         except:
             db.session.rollback()
             raise
 
+        invalidation.invalidate(
+            invalidation.track_scope(tracklog.track_id), *scopes)
         if tracklog_id == current_tracklog_id:
             fixup_current_track()
 
@@ -1,5 +1,7 @@
 import base64
+import collections
 import datetime
+import hashlib
 import os
 from flask import abort, json, make_response, redirect, request, session, \
         url_for, _request_ctx_stack
@@ -12,17 +14,20 @@ from .utils import current_user, current_user_roles, \
 
 
 class AuthManager(object):
-    def __init__(self, app=None, db=None):
+    def __init__(self, app=None, db=None, redis_conn=None):
         self.all_roles = set()
 
         self.exempt_methods = set(['OPTIONS'])
+        self.session_cache_counters = collections.Counter()
 
         if app is not None and db is not None:
-            self.init_app(app, db)
+            self.init_app(app, db, redis_conn)
 
-    def init_app(self, app, db):
+    def init_app(self, app, db, redis_conn=None):
         self.app = app
         self.db = db
+        self.redis_conn = redis_conn
+        app.config.setdefault('AUTH_SESSION_CACHE_TTL', 300)
 
         app.auth_manager = self
         app.context_processor(_user_context_processor)
@@ -67,6 +72,70 @@ class AuthManager(object):
     def generate_session_token(self):
         return base64.urlsafe_b64encode(os.urandom(64)).decode('ascii')
 
+    def session_cache_key(self, session_token):
+        # avoid storing usable session tokens in Redis
+        return "user_session_{0}".format(
+            hashlib.sha256(session_token.encode('utf-8')).hexdigest())
+
+    def get_cached_session(self, session_token):
+        """Return the id_token, roles, login time, and expiration time of a
+        session, or None if the session does not exist. Sessions are cached
+        in Redis, if available, to avoid a query on every request."""
+        if self.redis_conn is not None:
+            cached = self.redis_conn.get(self.session_cache_key(session_token))
+            if cached is not None:
+                self.session_cache_counters['hits'] += 1
+                data = json.loads(cached)
+                return (data['id_token'], set(data['roles']),
+                        datetime.datetime.utcfromtimestamp(data['login_at']),
+                        datetime.datetime.utcfromtimestamp(data['expires']))
+            self.session_cache_counters['misses'] += 1
+
+        user_session = UserSession.query.filter(
+            UserSession.token == session_token,
+        ).first()
+        if user_session is None:
+            return None
+
+        id_token = json.loads(user_session.id_token)
+        roles = user_session.roles
+
+        if self.redis_conn is not None:
+            ttl = min(
+                self.app.config['AUTH_SESSION_CACHE_TTL'],
+                int((user_session.expires -
+                     datetime.datetime.utcnow()).total_seconds()))
+            if ttl > 0:
+                epoch = datetime.datetime(1970, 1, 1)
+                self.redis_conn.set(
+                    self.session_cache_key(session_token),
+                    json.dumps({
+                        'id_token': id_token,
+                        'roles': list(roles),
+                        'login_at': (user_session.login_at -
+                                     epoch).total_seconds(),
+                        'expires': (user_session.expires -
+                                    epoch).total_seconds(),
+                    }),
+                    ex=ttl)
+
+        return id_token, roles, user_session.login_at, user_session.expires
+
+    def invalidate_session(self, session_token):
+        """Remove a session from the cache. This must be called whenever a
+        session is deleted."""
+        if self.redis_conn is not None:
+            self.redis_conn.delete(self.session_cache_key(session_token))
+
+    def session_cache_stats(self):
+        hits = self.session_cache_counters['hits']
+        misses = self.session_cache_counters['misses']
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses > 0 else None,
+        }
+
     def load_user_session(self):
         ctx = _request_ctx_stack.top
 
@@ -76,13 +145,13 @@ class AuthManager(object):
             ctx.user_roles = set([])
         else:
             now = datetime.datetime.utcnow()
-            user_session = UserSession.query.filter(
-                UserSession.token == session_token,
-            ).first()
-            if user_session is not None and \
-                    now > user_session.login_at and now < user_session.expires:
-                ctx.user = User(json.loads(user_session.id_token))
-                ctx.user_roles = user_session.roles
+            user_session = self.get_cached_session(session_token)
+            if user_session is not None:
+                id_token, roles, login_at, expires = user_session
+
+            if user_session is not None and now > login_at and now < expires:
+                ctx.user = User(id_token)
+                ctx.user_roles = roles
             else:
                 ctx.user = AnonymousUserMixin()
                 ctx.user_roles = set([])
@@ -152,6 +221,7 @@ class AuthManager(object):
                 except:
                     self.db.session.rollback()
                     raise
+                self.invalidate_session(session_token)
 
         _request_ctx_stack.top.user = AnonymousUserMixin()
         _request_ctx_stack.top.user_roles = set([])
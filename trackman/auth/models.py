@@ -25,7 +25,7 @@ class UserRole(db.Model):
 class UserSession(db.Model):
     __tablename__ = "user_session"
     id = db.Column(db.Integer, primary_key=True)
-    token = db.Column(db.String(255), nullable=False)
+    token = db.Column(db.String(255), nullable=False, index=True)
     sub = db.Column(db.Unicode(255), nullable=False)
     id_token = db.Column(db.UnicodeText)
     login_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
@@ -1,5 +1,6 @@
 import datetime
-from flask import abort, Blueprint, flash, redirect, render_template, session, url_for
+from flask import abort, Blueprint, current_app, flash, redirect, \
+    render_template, session, url_for
 from trackman import db
 from . import login_required, logout_user
 from .utils import current_user
@@ -37,6 +38,7 @@ def revoke_session(session_id):
         db.session.rollback()
         raise
 
+    current_app.auth_manager.invalidate_session(user_session.token)
     flash("Session revoked.")
     return redirect(url_for(".view_sessions"))
 
@@ -0,0 +1,273 @@
+"""Prefix index used for track autocompletion.
+
+Each distinct value of a track field is stored in a Redis sorted set as
+"<lowercase value>\\0<value>" with a score of zero, so that values starting
+with a prefix can be found with ZRANGEBYLEX regardless of case. A hash per
+field holds the number of plays for each value, which is used to rank the
+matches. The index is rebuilt from the database by the scheduler and is kept
+up to date as tracks are added, edited and played in between.
+
+Short prefixes match too many values to rank them all on each request, so
+for each prefix of up to PREFIX_INDEX_LENGTH characters, a sorted set holds
+the values starting with it scored by their plays, and the most played are
+read from it directly. Longer prefixes only rank the first SCAN_LIMIT
+matching values in lexical order, so if more values match, the ranking is
+approximate.
+"""
+
+import collections
+from . import db, redis_conn
+from .models import Track
+
+FIELDS = ('artist', 'title', 'album', 'label')
+KEY_PREFIX = "autocomplete_"
+# changed whenever the layout of the index changes, so that an index built
+# by an older version is not used until it has been rebuilt
+READY_KEY = KEY_PREFIX + "ready_2"
+SCAN_LIMIT = 1000
+PREFIX_INDEX_LENGTH = 2
+REBUILD_BATCH_SIZE = 5000
+
+# Find values starting with a prefix and return those with the most plays
+complete_script = redis_conn.register_script("""
+local unpack = unpack or table.unpack
+local members = redis.call('ZRANGEBYLEX', KEYS[1], ARGV[1], ARGV[2],
+                           'LIMIT', 0, tonumber(ARGV[3]))
+if #members == 0 then
+    return {}
+end
+
+local values = {}
+for i, member in ipairs(members) do
+    values[i] = string.sub(member, string.find(member, '\\0', 1, true) + 1)
+end
+
+local weights = redis.call('HMGET', KEYS[2], unpack(values))
+local order = {}
+for i = 1, #values do
+    order[i] = {i, tonumber(weights[i]) or 0}
+end
+table.sort(order, function(a, b)
+    if a[2] ~= b[2] then
+        return a[2] > b[2]
+    end
+    return a[1] < b[1]
+end)
+
+local results = {}
+for i = 1, math.min(#order, tonumber(ARGV[4])) do
+    results[i] = values[order[i][1]]
+end
+return results
+""")
+
+
+def index_key(field):
+    return KEY_PREFIX + field
+
+
+def weights_key(field):
+    return KEY_PREFIX + field + "_weights"
+
+
+def prefix_key(field, prefix):
+    return KEY_PREFIX + field + "_prefix_" + prefix
+
+
+def prefixes_key(field):
+    return KEY_PREFIX + field + "_prefixes"
+
+
+def member(value):
+    return "{0}\0{1}".format(value.lower(), value)
+
+
+def value_prefixes(value):
+    lowered = value.lower()
+    return [lowered[:i] for i in range(
+        1, min(len(lowered), PREFIX_INDEX_LENGTH) + 1)]
+
+
+def is_ready():
+    return redis_conn.exists(READY_KEY) > 0
+
+
+def complete(field, prefix, limit=25):
+    """Return up to `limit` values of `field` starting with `prefix`,
+    ignoring case, with the most played values first. Returns None if the
+    index has not been built yet."""
+    if not is_ready():
+        return None
+
+    prefix = prefix.lower()
+    if len(prefix) <= PREFIX_INDEX_LENGTH:
+        # scores are negated plays, so that ties are in lexical order
+        results = redis_conn.zrange(prefix_key(field, prefix), 0, limit - 1)
+        return [value.decode('utf-8') for value in results]
+
+    prefix = prefix.encode('utf-8')
+    results = complete_script(
+        keys=[index_key(field), weights_key(field)],
+        args=[b'[' + prefix, b'[' + prefix + b'\xff', SCAN_LIMIT, limit])
+    return [value.decode('utf-8') for value in results]
+
+
+def add_track(track, pipe=None):
+    """Add the values of a Track to the index."""
+    execute = pipe is None
+    if pipe is None:
+        pipe = redis_conn.pipeline(transaction=False)
+
+    for field in FIELDS:
+        value = getattr(track, field)
+        if value is not None and len(value) > 0:
+            pipe.zadd(index_key(field), {member(value): 0})
+            for prefix in value_prefixes(value):
+                pipe.zadd(prefix_key(field, prefix), {value: 0}, nx=True)
+                pipe.sadd(prefixes_key(field), prefix)
+
+    if execute:
+        pipe.execute()
+
+
+def count_play(track):
+    """Count a play of a Track towards the weight of each of its values."""
+    count_plays([track])
+
+
+def count_plays(tracks):
+    """Count a play of each Track in `tracks`, which may include the same
+    Track more than once, towards the weight of each of its values."""
+    counts = collections.Counter(
+        (field, getattr(track, field)) for track in tracks
+        for field in FIELDS)
+
+    pipe = redis_conn.pipeline(transaction=False)
+    for (field, value), count in counts.items():
+        if value is not None and len(value) > 0:
+            pipe.hincrby(weights_key(field), value, count)
+            for prefix in value_prefixes(value):
+                pipe.zincrby(prefix_key(field, prefix), -count, value)
+                pipe.sadd(prefixes_key(field), prefix)
+    pipe.execute()
+
+
+def track_values(tracks):
+    """Return the (field, value) pairs for the provided tracks."""
+    return set((field, getattr(track, field))
+               for track in tracks for field in FIELDS)
+
+
+def edited_values(tracks):
+    """Return the (field, value) pairs that edits to the provided tracks are
+    replacing. This must be called before the changes are flushed."""
+    values = set()
+    for track in tracks:
+        state = db.inspect(track)
+        for field in FIELDS:
+            history = getattr(state.attrs, field).history
+            if history.has_changes():
+                values.update((field, value) for value in history.deleted)
+    return values
+
+
+def remove_unused(values):
+    """Remove (field, value) pairs from the index if no track has that value
+    anymore. This should be called after changes have been committed."""
+    pipe = redis_conn.pipeline(transaction=False)
+    for field, value in values:
+        if value is None or len(value) <= 0:
+            continue
+
+        in_use = db.session.query(Track.query.filter(
+            getattr(Track, field) == value).exists()).scalar()
+        if not in_use:
+            pipe.zrem(index_key(field), member(value))
+            pipe.hdel(weights_key(field), value)
+            for prefix in value_prefixes(value):
+                pipe.zrem(prefix_key(field, prefix), value)
+    pipe.execute()
+
+
+def update_tracks(tracks, old_values=()):
+    """Update the index after tracks have been added or edited, where
+    `old_values` is the result of edited_values() before the edit."""
+    pipe = redis_conn.pipeline(transaction=False)
+    for track in tracks:
+        add_track(track, pipe)
+    pipe.execute()
+
+    remove_unused(old_values)
+
+
+def rebuild():
+    """Rebuild the index from the database. The new index replaces the old
+    one atomically once it is complete."""
+    for field in FIELDS:
+        column = getattr(Track, field)
+        new_field = field + "_new"
+        new_index_key = index_key(new_field)
+        new_weights_key = weights_key(new_field)
+        new_prefixes = set()
+        redis_conn.delete(new_index_key, new_weights_key)
+
+        values = db.session.query(column, db.func.sum(Track.play_count)).\
+            filter(column != None, column != "").\
+            group_by(column)
+
+        members = {}
+        weights = {}
+        prefix_members = collections.defaultdict(dict)
+        for value, plays in values:
+            members[member(value)] = 0
+            if plays > 0:
+                weights[value] = plays
+            for prefix in value_prefixes(value):
+                prefix_members[prefix][value] = -plays
+
+            if len(members) >= REBUILD_BATCH_SIZE:
+                redis_conn.zadd(new_index_key, members)
+                members = {}
+                write_prefixes(new_field, prefix_members, new_prefixes)
+                prefix_members.clear()
+            if len(weights) >= REBUILD_BATCH_SIZE:
+                redis_conn.hset(new_weights_key, mapping=weights)
+                weights = {}
+
+        if len(members) > 0:
+            redis_conn.zadd(new_index_key, members)
+        if len(weights) > 0:
+            redis_conn.hset(new_weights_key, mapping=weights)
+        write_prefixes(new_field, prefix_members, new_prefixes)
+
+        old_prefixes = [prefix.decode('utf-8') for prefix in
+                        redis_conn.smembers(prefixes_key(field))]
+
+        pipe = redis_conn.pipeline()
+        pipe.delete(index_key(field), weights_key(field),
+                    prefixes_key(field),
+                    *[prefix_key(field, prefix) for prefix in old_prefixes])
+        if redis_conn.exists(new_index_key):
+            pipe.rename(new_index_key, index_key(field))
+        if redis_conn.exists(new_weights_key):
+            pipe.rename(new_weights_key, weights_key(field))
+        for prefix in new_prefixes:
+            pipe.rename(prefix_key(new_field, prefix),
+                        prefix_key(field, prefix))
+        if len(new_prefixes) > 0:
+            pipe.sadd(prefixes_key(field), *new_prefixes)
+        pipe.execute()
+
+    redis_conn.set(READY_KEY, "true")
+
+
+def write_prefixes(field, prefix_members, written):
+    """Add values to the sorted sets of their prefixes, deleting each set
+    first if it has not been written to yet by this rebuild."""
+    pipe = redis_conn.pipeline(transaction=False)
+    for prefix, values in prefix_members.items():
+        if prefix not in written:
+            pipe.delete(prefix_key(field, prefix))
+            written.add(prefix)
+        pipe.zadd(prefix_key(field, prefix), values)
+    pipe.execute()
@@ -0,0 +1,307 @@
+"""Benchmarks of common operations against the current database.
+
+Each case is run a number of times, recording the latency and the number of
+database queries of each run. Results can be saved as JSON and compared with
+an earlier run to catch regressions. The cases run against whatever is in
+the database, which should first be filled with a realistic history using
+db_utils.generate_history(); note that the log_track case adds plays.
+"""
+
+import collections
+import datetime
+import random
+import statistics
+import time
+from sqlalchemy import event
+from . import analytics, app, charts, charts_cache, db, invalidation, lib
+from .models import DJ, DJSet, Track, TrackLog
+
+SAMPLE_SIZE = 200
+
+
+class QueryCounter(object):
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, conn, cursor, statement, parameters, context,
+                 executemany):
+        self.count += 1
+
+
+class BenchmarkContext(object):
+    """State shared by the benchmark cases: a test client with a DJ session,
+    samples of existing tracks and DJs to pick from, and a DJSet to log
+    tracks to."""
+
+    def __init__(self, seed=None):
+        self.rng = random.Random(seed)
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['dj_id'] = 1
+
+        self.track_ids = self.sample_ids(Track)
+        self.dj_ids = self.sample_ids(DJ, DJ.id > 1)
+        self.djset_ids = self.sample_ids(DJSet)
+        if len(self.track_ids) <= 0 or len(self.djset_ids) <= 0:
+            raise ValueError("The database must contain tracks and sets to "
+                             "run benchmarks")
+
+        first, last = TrackLog.query.with_entities(
+            db.func.min(TrackLog.played), db.func.max(TrackLog.played)).one()
+        self.last_played = last or datetime.datetime.utcnow()
+        # days of history that a random recent day can be picked from
+        self.recent_days = min(30, (self.last_played -
+                                    (first or self.last_played)).days)
+
+        djset = DJSet(1)
+        db.session.add(djset)
+        try:
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+        self.djset_id = djset.id
+
+    def sample_ids(self, model, *criteria):
+        max_id = db.session.query(db.func.max(model.id)).scalar() or 0
+        ids = [self.rng.randint(1, max_id) for i in range(SAMPLE_SIZE * 2)]
+        return [id for id, in model.query.with_entities(model.id).filter(
+            model.id.in_(ids), *criteria).limit(SAMPLE_SIZE)]
+
+    def random_track(self):
+        return Track.query.get(self.rng.choice(self.track_ids))
+
+    def random_dj_id(self):
+        if len(self.dj_ids) <= 0:
+            return 1
+        return self.rng.choice(self.dj_ids)
+
+    def prefix(self, value, length=None):
+        if length is None:
+            length = self.rng.randint(2, 4)
+        return value[:length]
+
+    def get(self, url):
+        def request():
+            r = self.client.get(url, headers={
+                'X-Requested-With': "XMLHttpRequest"})
+            if r.status_code != 200:
+                raise RuntimeError("GET {0} returned {1:d}".format(
+                    url, r.status_code))
+        return request
+
+    def close(self):
+        djset = DJSet.query.get(self.djset_id)
+        djset.dtend = datetime.datetime.utcnow()
+        try:
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+
+
+def case_log_track(ctx):
+    track_id = ctx.rng.choice(ctx.track_ids)
+    return lambda: lib.log_track(track_id, ctx.djset_id)
+
+
+def case_find_or_add_track(ctx):
+    track = ctx.random_track()
+    values = (track.title, track.artist, track.album, track.label)
+    return lambda: lib.find_or_add_track(Track(*values))
+
+
+def case_track_search(ctx):
+    track = ctx.random_track()
+    return ctx.get("/api/search?artist={0}".format(
+        ctx.prefix(track.artist, 5)))
+
+
+def case_autocomplete(ctx):
+    track = ctx.random_track()
+    return ctx.get("/api/autocomplete?field=artist&artist={0}".format(
+        ctx.prefix(track.artist)))
+
+
+def chart_case(path):
+    def case(ctx):
+        return ctx.get("/api/charts/" + path.format(dj_id=ctx.random_dj_id()))
+    return case
+
+
+def case_playlist_now_playing(ctx):
+    return ctx.get("/api/now_playing")
+
+
+def case_playlist_last15(ctx):
+    return ctx.get("/api/playlists/last15")
+
+
+def case_playlist_date(ctx):
+    day = ctx.last_played - datetime.timedelta(
+        days=ctx.rng.randint(0, ctx.recent_days))
+    return ctx.get("/api/playlists/date/{0:d}/{1:d}/{2:d}".format(
+        day.year, day.month, day.day))
+
+
+def case_playlist_date_range(ctx):
+    end = ctx.last_played - datetime.timedelta(
+        days=ctx.rng.randint(0, ctx.recent_days))
+    start = end - datetime.timedelta(days=7)
+    return ctx.get("/api/playlists/date/range?start={0}&end={1}".format(
+        start.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        end.strftime("%Y-%m-%dT%H:%M:%S.000Z")))
+
+
+def case_playlist_dj(ctx):
+    return ctx.get("/api/playlists/dj/{0:d}".format(ctx.random_dj_id()))
+
+
+def case_playlist_set(ctx):
+    return ctx.get("/api/playlists/set/{0:d}".format(
+        ctx.rng.choice(ctx.djset_ids)))
+
+
+def case_playlist_track(ctx):
+    return ctx.get("/api/playlists/track/{0:d}".format(
+        ctx.rng.choice(ctx.track_ids)))
+
+
+def chart_function_case(period, count, compare_analytics=False):
+    # the chart functions are called directly, so the chart cache is not
+    # involved; the analytics snapshot is loaded before the run starts
+    def case(ctx):
+        start, end = charts.get_range(period)
+        if compare_analytics:
+            snapshot = analytics.get_snapshot()
+            f = getattr(analytics, count)
+            return lambda: charts.rank(f(start, end, snapshot=snapshot))
+        else:
+            f = getattr(charts, count)
+            return lambda: charts.rank(f(start, end))
+    return case
+
+
+def case_sql_dj_spins(ctx):
+    return lambda: charts.rank(
+        DJ.query.with_entities(DJ, DJ.play_count).
+        filter(DJ.visible == True, DJ.play_count > 0).
+        order_by(db.desc(DJ.play_count)).
+        limit(charts.CHART_PER_PAGE).all())
+
+
+def case_analytics_dj_spins(ctx):
+    snapshot = analytics.get_snapshot()
+    return lambda: charts.rank(analytics.dj_spin_counts(snapshot=snapshot))
+
+
+def case_deduplicate_all_tracks(ctx):
+    return lambda: lib.deduplicate_all_tracks(dry_run=True)
+
+
+CASES = collections.OrderedDict([
+    ('log_track', case_log_track),
+    ('find_or_add_track', case_find_or_add_track),
+    ('track_search', case_track_search),
+    ('autocomplete', case_autocomplete),
+    ('charts_albums', chart_case("albums")),
+    ('charts_albums_weekly', chart_case("albums/weekly")),
+    ('charts_artists', chart_case("artists")),
+    ('charts_artists_monthly', chart_case("artists/monthly")),
+    ('charts_tracks', chart_case("tracks")),
+    ('charts_tracks_yearly', chart_case("tracks/yearly")),
+    ('charts_dj_albums', chart_case("dj/{dj_id}/albums")),
+    ('charts_dj_artists', chart_case("dj/{dj_id}/artists")),
+    ('charts_dj_tracks', chart_case("dj/{dj_id}/tracks")),
+    ('charts_dj_spins', chart_case("dj/spins")),
+    ('charts_dj_vinyl_spins', chart_case("dj/vinyl_spins")),
+    ('charts_dj_requests', chart_case("dj/requests")),
+    ('playlist_now_playing', case_playlist_now_playing),
+    ('playlist_last15', case_playlist_last15),
+    ('playlist_date', case_playlist_date),
+    ('playlist_date_range', case_playlist_date_range),
+    ('playlist_dj', case_playlist_dj),
+    ('playlist_set', case_playlist_set),
+    ('playlist_track', case_playlist_track),
+    ('deduplicate_all_tracks', case_deduplicate_all_tracks),
+    ('sql_albums', chart_function_case(None, 'album_counts')),
+    ('analytics_albums',
+     chart_function_case(None, 'album_counts', True)),
+    ('sql_artists_yearly', chart_function_case('yearly', 'artist_counts')),
+    ('analytics_artists_yearly',
+     chart_function_case('yearly', 'artist_counts', True)),
+    ('sql_dj_spins', case_sql_dj_spins),
+    ('analytics_dj_spins', case_analytics_dj_spins),
+])
+
+
+def summarize(latencies, queries):
+    latencies = sorted(latencies)
+    return {
+        'iterations': len(latencies),
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'median_ms': statistics.median(latencies) * 1000,
+        'p95_ms': latencies[int(len(latencies) * 0.95)] * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'queries': statistics.mean(queries),
+    }
+
+
+def run_case(ctx, case, iterations, cached=False):
+    latencies = []
+    queries = []
+    for i in range(iterations):
+        f = case(ctx)
+        if not cached:
+            invalidation.invalidate_all()
+            charts_cache.clear()
+        db.session.remove()
+
+        counter = QueryCounter()
+        event.listen(db.engine, 'before_cursor_execute', counter)
+        try:
+            start = time.perf_counter()
+            f()
+            latencies.append(time.perf_counter() - start)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', counter)
+        queries.append(counter.count)
+    return summarize(latencies, queries)
+
+
+def run(names=None, iterations=10, cached=False, seed=None):
+    """Run the named cases, or all of them, and return a dictionary of the
+    results for each case. Unless `cached` is true, the playlist and chart
+    caches are cleared before each run."""
+    if names is None or len(names) <= 0:
+        names = list(CASES.keys())
+
+    ctx = BenchmarkContext(seed)
+    try:
+        results = collections.OrderedDict()
+        for name in names:
+            results[name] = run_case(ctx, CASES[name], iterations, cached)
+        return results
+    finally:
+        ctx.close()
+
+
+def compare(results, baseline, threshold=0.25):
+    """Compare results with the results of an earlier run and return a list
+    of regressions: cases whose median latency grew by more than
+    `threshold`, or that make more queries than before."""
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+
+        if result['median_ms'] > previous['median_ms'] * (1 + threshold):
+            regressions.append(
+                "{0}: median {1:.2f} ms, was {2:.2f} ms".format(
+                    name, result['median_ms'], previous['median_ms']))
+        if result['queries'] > previous['queries']:
+            regressions.append(
+                "{0}: {1:.1f} queries, was {2:.1f}".format(
+                    name, result['queries'], previous['queries']))
+    return regressions
@@ -1,14 +1,45 @@
+"""Chart queries and the cache they are stored in.
+
+Charts for a range are keyed by the range, which is reduced to whole hours,
+so a chart is computed at most once an hour for each range and shared by
+every request for it. The scheduler computes the current weekly, monthly and
+yearly charts at the start of each hour, so that they are already stored by
+the time they are requested.
+"""
+
+import collections
 import datetime
 import dateutil
 import pytz
-from .models import TrackLog
+from . import charts_cache, db
+from .models import AlbumDailyPlays, ArtistDailyPlays, Track, \
+    TrackDailyPlays, TrackLog
+from .playstats import normalize
 
 CHART_PER_PAGE = 250
+HISTORY_START_KEY = "history_start"
+HISTORY_START_TIMEOUT = 86400
+PREWARM_PERIODS = ('weekly', 'monthly', 'yearly')
+EDGE_BATCH_SIZE = 500
+
+
+def get_history_start():
+    """Return when the first track was logged, or None if no tracks have been
+    logged yet. This is cached, since it only changes if the first play is
+    deleted, and then only by a little."""
+    start = charts_cache.get(HISTORY_START_KEY)
+    if start is None:
+        start = TrackLog.query.with_entities(
+            db.func.min(TrackLog.played)).scalar()
+        if start is not None:
+            charts_cache.set(HISTORY_START_KEY, start,
+                             timeout=HISTORY_START_TIMEOUT)
+    return start
 
 
 def get_range(period=None, year=None, month=None, week=None):
-    first_track = TrackLog.query.order_by(TrackLog.played).first()
-    if first_track is None:
+    history_start = get_history_start()
+    if history_start is None:
         raise ValueError("Cannot determine range without any logged tracks")
 
     now = datetime.datetime.utcnow()
@@ -35,13 +66,13 @@ def get_range(period=None, year=None, month=None, week=None):
             start = datetime.datetime(year=now.year, month=1, day=1)
             end = now
     elif period is None:
-        start = first_track.played
+        start = history_start
         end = datetime.datetime.utcnow()
     else:
         raise ValueError(
             "Period must be one of 'weekly', 'monthly', 'yearly', or None.")
 
-    if first_track.played.tzinfo is not None:
+    if history_start.tzinfo is not None:
         # add tzinfo to now to avoid attempted comparison of offset-aware and
         # offset-naive timezones
         now = now.replace(tzinfo=pytz.UTC)
@@ -53,8 +84,8 @@ def get_range(period=None, year=None, month=None, week=None):
     end = end.replace(minute=0, second=0, microsecond=0)
 
     # enforce datetime boundaries
-    if start < first_track.played:
-        start = first_track.played
+    if start < history_start:
+        start = history_start
     if end > now:
         end = now
 
@@ -67,13 +98,13 @@ def get_range(period=None, year=None, month=None, week=None):
     return start, end
 
 
-def get(cache_key, query, limit=CHART_PER_PAGE):
-    results = []
+def rank(results, limit=CHART_PER_PAGE):
+    ranked = []
     ranking = 0
     last_value = None
     increment = 1
 
-    for result in query.limit(limit):
+    for result in results[:limit]:
         # calculate an appropriate ranking for each result
         # rankings will be tied for results that have the same value
         if result[-1] == last_value:
@@ -82,6 +113,218 @@ def get(cache_key, query, limit=CHART_PER_PAGE):
             last_value = result[-1]
             ranking += increment
             increment = 1
-        results.append(list(result) + [ranking])
+        ranked.append(list(result) + [ranking])
+
+    return ranked
+
 
+def get_cached(cache_key, compute):
+    """Return the chart stored under `cache_key`, computing and storing it
+    first if it is missing."""
+    results = charts_cache.get("chart_" + cache_key)
+    if results is None:
+        results = compute()
+        charts_cache.set("chart_" + cache_key, results)
     return results
+
+
+def serialize_row(row):
+    return [value.serialize() if isinstance(value, db.Model) else value
+            for value in row]
+
+
+def get(cache_key, query, limit=CHART_PER_PAGE):
+    """Return the ranked results of a chart query, stored under `cache_key`.
+    Any models in the results are serialized so that they can be stored."""
+    return get_cached(cache_key, lambda: rank(
+        [serialize_row(row) for row in query.limit(limit)], limit))
+
+
+def split_range(start, end):
+    """Split a chart range into the whole days that are read from the daily
+    rollups, returned as (first_day, last_day) with last_day excluded, and
+    filters for the partial days at either end, which are counted from
+    TrackLog directly."""
+    def midnight(day):
+        return datetime.datetime.combine(day, datetime.time(),
+                                         tzinfo=start.tzinfo)
+
+    first_day = start.date()
+    if start > midnight(first_day):
+        first_day += datetime.timedelta(days=1)
+    last_day = end.date()
+
+    if first_day >= last_day:
+        return None, [db.and_(TrackLog.played >= start,
+                              TrackLog.played <= end)]
+
+    edges = [db.and_(TrackLog.played >= midnight(last_day),
+                     TrackLog.played <= end)]
+    if start < midnight(first_day):
+        edges.append(db.and_(TrackLog.played >= start,
+                             TrackLog.played < midnight(first_day)))
+    return (first_day, last_day), edges
+
+
+def add_count(counts, key, values, plays):
+    row = counts.get(key)
+    if row is None:
+        counts[key] = list(values) + [plays]
+        return
+
+    row[-1] += plays
+    for i, value in enumerate(values):
+        if row[i] is None or (value is not None and value < row[i]):
+            row[i] = value
+
+
+def sorted_counts(counts):
+    return sorted(counts.values(), key=lambda row: row[-1], reverse=True)
+
+
+def rollup_query(model, key_columns, value_columns, days):
+    return db.session.query(
+        *key_columns,
+        *[db.func.min(column) for column in value_columns],
+        db.func.sum(model.plays).label('plays')).\
+        filter(model.day >= days[0], model.day < days[1]).\
+        group_by(*key_columns)
+
+
+def range_counts(model, key_columns, value_columns, start, end, edge_query,
+                 limit):
+    """Return a list of values + [plays] of the `limit` most played keys in
+    the provided range, with the most played first. Whole days are summed
+    from the rollups in `model`, grouped by `key_columns`; `edge_query`
+    returns the keys and values of each play in the partial days at either
+    end. Only the most played keys of the rollups are read, along with the
+    keys played in the partial days, since those plays can only add to the
+    counts of the keys they were counted for."""
+    days, edges = split_range(start, end)
+
+    edge_counts = {}
+    for edge in edges:
+        for key, values in edge_query(edge):
+            add_count(edge_counts, key, values, 1)
+
+    counts = {}
+    if days is not None:
+        query = rollup_query(model, key_columns, value_columns, days)
+        rows = query.order_by(db.desc('plays'), *key_columns).limit(limit).\
+            all()
+
+        keys = len(key_columns)
+        missing = list(set(edge_counts) -
+                       set(tuple(row[:keys]) for row in rows))
+        for i in range(0, len(missing), EDGE_BATCH_SIZE):
+            batch = missing[i:i + EDGE_BATCH_SIZE]
+            if keys == 1:
+                criterion = key_columns[0].in_([key[0] for key in batch])
+            else:
+                criterion = db.tuple_(*key_columns).in_(batch)
+            rows.extend(query.filter(criterion))
+
+        for row in rows:
+            add_count(counts, tuple(row[:keys]), row[keys:-1], int(row[-1]))
+
+    for key, row in edge_counts.items():
+        add_count(counts, key, row[:-1], row[-1])
+
+    return sorted_counts(counts)[:limit]
+
+
+def album_counts(start, end, limit=CHART_PER_PAGE):
+    """Return a list of [artist, album, plays] for the provided range, with
+    the most played albums first. Only the first `limit` albums are
+    returned."""
+    def edge_query(edge):
+        for artist, album in db.session.query(Track.artist, Track.album).\
+                join(TrackLog).filter(TrackLog.dj_id > 1, edge):
+            yield (normalize(artist), normalize(album)), (artist, album)
+
+    return range_counts(
+        AlbumDailyPlays,
+        [AlbumDailyPlays.artist_key, AlbumDailyPlays.album_key],
+        [AlbumDailyPlays.artist, AlbumDailyPlays.album],
+        start, end, edge_query, limit)
+
+
+def artist_counts(start, end, limit=CHART_PER_PAGE):
+    """Return a list of [artist, plays] for the provided range, with the
+    most played artists first. Only the first `limit` artists are
+    returned."""
+    def edge_query(edge):
+        for artist, in db.session.query(Track.artist).join(TrackLog).\
+                filter(TrackLog.dj_id > 1, edge):
+            yield (normalize(artist),), (artist,)
+
+    return range_counts(
+        ArtistDailyPlays, [ArtistDailyPlays.artist_key],
+        [ArtistDailyPlays.artist], start, end, edge_query, limit)
+
+
+def track_counts(start, end, limit=CHART_PER_PAGE):
+    """Return a list of [Track, plays] for the provided range, with the most
+    played tracks first. Only the first `limit` tracks are returned."""
+    def edge_query(edge):
+        for track_id, in db.session.query(TrackLog.track_id).\
+                filter(TrackLog.dj_id > 1, edge):
+            yield (track_id,), (track_id,)
+
+    results = range_counts(
+        TrackDailyPlays, [TrackDailyPlays.track_id],
+        [TrackDailyPlays.track_id], start, end, edge_query, limit)
+    tracks = Track.query.filter(
+        Track.id.in_([track_id for track_id, plays in results]))
+    tracks = {track.id: track for track in tracks}
+    return [[tracks[track_id], plays] for track_id, plays in results
+            if track_id in tracks]
+
+
+def range_key(name, start, end):
+    return "{0}_{1}_{2}".format(name, start.isoformat(), end.isoformat())
+
+
+def album_chart(start, end):
+    """Return the ranked list of [artist, album, plays, rank] for the
+    provided range."""
+    return get_cached(range_key('albums', start, end),
+                      lambda: rank(album_counts(start, end)))
+
+
+def artist_chart(start, end):
+    """Return the ranked list of [artist, plays, rank] for the provided
+    range."""
+    return get_cached(range_key('artists', start, end),
+                      lambda: rank(artist_counts(start, end)))
+
+
+def track_chart(start, end):
+    """Return the ranked list of [track, plays, rank] for the provided range,
+    with each Track serialized."""
+    return get_cached(range_key('tracks', start, end), lambda: rank(
+        [serialize_row(row) for row in track_counts(start, end)]))
+
+
+RANGE_CHARTS = collections.OrderedDict([
+    ('albums', album_chart),
+    ('artists', artist_chart),
+    ('tracks', track_chart),
+])
+
+
+def prewarm():
+    """Compute and store the current weekly, monthly and yearly charts if
+    they have not been already. Returns the number of charts that are
+    stored."""
+    count = 0
+    for period in PREWARM_PERIODS:
+        try:
+            start, end = get_range(period)
+        except ValueError:
+            continue
+
+        for chart in RANGE_CHARTS.values():
+            chart(start, end)
+            count += 1
+    return count
@@ -1,7 +1,12 @@
 import click
+import datetime
+import json
 import os
+import statistics
 from apscheduler.schedulers.blocking import BlockingScheduler
-from . import app, db_utils, lib, pubsub, tasks
+from . import analytics, app, autocomplete, benchmark as benchmarks, \
+    db_utils, djcharts, lib, partitions, playstats, pubsub, search, tasks
+from .models import DJ
 
 
 @app.cli.command()
@@ -42,9 +47,22 @@ def sampledata():
 @app.cli.command()
 @click.option('--ignore-case/--no-ignore-case', default=False,
               help="Ignore capitalization.")
-def deduplicate_all_tracks(ignore_case):
+@click.option('--dry-run', is_flag=True,
+              help="Report the tracks that would be merged without merging "
+                   "them.")
+def deduplicate_all_tracks(ignore_case, dry_run):
     """Merge identical tracks."""
-    lib.deduplicate_all_tracks(ignore_case)
+    report = lib.deduplicate_all_tracks(ignore_case, dry_run)
+    for canonical_id, loser_ids in report['merges']:
+        click.echo("{0:d} <- {1}".format(
+            canonical_id, ", ".join(str(x) for x in loser_ids)))
+    click.echo("{0} {1:d} duplicate tracks into {2:d} tracks, repointing "
+               "{3:d} logged tracks and {4:d} track reports.".format(
+                   "Would merge" if dry_run else "Merged",
+                   report['tracks'],
+                   report['groups'],
+                   report['tracklogs'],
+                   report['reports']))
 
 
 @app.cli.command()
@@ -53,6 +71,208 @@ def autofill_na_labels():
     lib.autofill_na_labels()
 
 
+@app.cli.command()
+def backfill_tracklog_snapshots():
+    """Record track information on plays logged without it."""
+    click.echo("Backfill track information on plays...")
+    count = lib.backfill_tracklog_snapshots()
+    click.echo("Track information recorded on {0:d} plays.".format(count))
+
+
+@app.cli.command()
+def rebuild_chart_rollups():
+    """Recount the daily play rollups used for charts from scratch."""
+    click.echo("Rebuild chart rollups...")
+    plays = playstats.rebuild_all()
+    click.echo("Chart rollups rebuilt from {0:d} plays.".format(plays))
+
+
+@app.cli.command()
+@click.option('--all', 'rebuild_all', is_flag=True,
+              help="Rebuild the snapshots of every DJ who has played "
+                   "tracks, not just the stale ones.")
+def rebuild_dj_charts(rebuild_all):
+    """Build missing and rebuild stale chart snapshots of DJs."""
+    if rebuild_all:
+        click.echo("Rebuild chart snapshots of all DJs...")
+        count = djcharts.rebuild_all()
+    else:
+        click.echo("Build missing and rebuild stale DJ chart snapshots...")
+        count = djcharts.build_missing() + djcharts.rebuild_stale()
+    click.echo("Chart snapshots rebuilt for {0:d} DJs.".format(count))
+
+
+@app.cli.command()
+def maintain_tracklog_partitions():
+    """Create upcoming tracklog partitions and archive old ones."""
+    if not partitions.is_partitioned():
+        click.echo("The tracklog table is not partitioned.")
+        return
+
+    created, archived = partitions.maintain()
+    for name in created:
+        click.echo("Created {0}".format(name))
+    for name in archived:
+        click.echo("Archived {0}".format(name))
+    click.echo("{0:d} partitions created, {1:d} archived.".format(
+        len(created), len(archived)))
+
+
+@app.cli.command()
+def reconcile_play_counters():
+    """Recount the play counters of every track and DJ."""
+    click.echo("Reconcile play counters...")
+    tracks, djs = playstats.reconcile_counters()
+    click.echo("Play counters recounted for {0:d} tracks and {1:d} "
+               "DJs.".format(tracks, djs))
+
+
+@app.cli.command()
+@click.option('--full', is_flag=True,
+              help="Export every play instead of only the new ones.")
+def refresh_analytics(full):
+    """Update the columnar snapshot of plays used for analytics."""
+    click.echo("Refresh analytics snapshot...")
+    count = analytics.refresh(full=full)
+    click.echo("Added {0:d} plays to the snapshot.".format(count))
+
+
+def format_report_row(row):
+    return "\t".join(
+        value.airname if isinstance(value, DJ) else str(value)
+        for value in row)
+
+
+@app.cli.command()
+@click.argument('report', type=click.Choice(
+    ['albums', 'artists', 'dj-spins', 'new-albums', 'vinyl-share',
+     'request-rates']))
+@click.option('--start', type=click.DateTime(), help="Start of the range.")
+@click.option('--end', type=click.DateTime(), help="End of the range.")
+def analytics_report(report, start, end):
+    """Print a chart or report computed from the analytics snapshot."""
+    if report == 'albums':
+        rows = analytics.album_counts(start, end)
+    elif report == 'artists':
+        rows = analytics.artist_counts(start, end)
+    elif report == 'dj-spins':
+        rows = analytics.dj_spin_counts()
+    elif report == 'new-albums':
+        rows = []
+        for (month, rotation), albums in analytics.new_album_counts(
+                start, end).items():
+            rows.extend([month, rotation] + album for album in albums)
+    elif report == 'vinyl-share':
+        rows = analytics.vinyl_share(start, end)
+    elif report == 'request-rates':
+        rows = analytics.request_rates(start, end)
+
+    for row in rows:
+        click.echo(format_report_row(row))
+
+
+@app.cli.command()
+def rebuild_autocomplete():
+    """Rebuild the prefix index used for track autocompletion."""
+    click.echo("Rebuild autocomplete index...")
+    autocomplete.rebuild()
+    click.echo("Autocomplete index rebuilt.")
+
+
+@app.cli.command()
+@click.option('--terms', default=20,
+              help="Number of search terms to sample from the library.")
+@click.option('--iterations', default=10,
+              help="Number of times to run each search.")
+def benchmark_search(terms, iterations):
+    """Compare the latency of the available track search backends."""
+    sample = search.sample_terms(terms)
+    for name in search.available_backends():
+        backend = search.get_backend(name)
+
+        # warm up caches so that the first backend is not penalized
+        search.benchmark(backend, sample, 1)
+
+        latencies = sorted(search.benchmark(backend, sample, iterations))
+        if len(latencies) <= 0:
+            click.echo("No tracks to search for.")
+            return
+
+        click.echo("{0}: mean {1:.2f} ms, median {2:.2f} ms, "
+                   "p95 {3:.2f} ms, max {4:.2f} ms".format(
+                       name,
+                       statistics.mean(latencies) * 1000,
+                       statistics.median(latencies) * 1000,
+                       latencies[int(len(latencies) * 0.95)] * 1000,
+                       latencies[-1] * 1000))
+
+
+@app.cli.command()
+@click.option('--years', default=1.0, help="Years of plays to generate.")
+@click.option('--djs', default=1000, help="Number of DJs to generate.")
+@click.option('--tracks', default=100000,
+              help="Number of tracks to generate.")
+@click.option('--plays-per-hour', default=15.0,
+              help="Average number of plays per hour.")
+@click.option('--duplicate-rate', default=0.05,
+              help="Fraction of tracks that duplicate another track.")
+@click.option('--seed', type=int, help="Seed for the random generator.")
+@click.confirmation_option(
+    prompt="This adds a large amount of synthetic data to the database. "
+           "Continue?")
+def generate_history(years, djs, tracks, plays_per_hour, duplicate_rate,
+                     seed):
+    """Fill the database with a synthetic station history."""
+    click.echo("Generate station history...")
+    plays = db_utils.generate_history(
+        years=years, djs=djs, tracks=tracks, plays_per_hour=plays_per_hour,
+        duplicate_rate=duplicate_rate, seed=seed)
+    click.echo("Generated {0:d} plays.".format(plays))
+
+
+@app.cli.command()
+@click.option('--case', 'cases', multiple=True,
+              type=click.Choice(list(benchmarks.CASES.keys())),
+              help="Case to run; may be repeated. Runs all cases if not "
+                   "given.")
+@click.option('--iterations', default=10,
+              help="Number of times to run each case.")
+@click.option('--cached', is_flag=True,
+              help="Keep the playlist and chart caches between runs.")
+@click.option('--seed', type=int, help="Seed for picking sample data.")
+@click.option('--output', type=click.File('w'),
+              help="File to save the results to as JSON.")
+@click.option('--baseline', type=click.File('r'),
+              help="Results of an earlier run to compare with.")
+@click.option('--threshold', default=0.25,
+              help="Fraction by which the median latency may grow before it "
+                   "is reported as a regression.")
+def benchmark(cases, iterations, cached, seed, output, baseline, threshold):
+    """Measure the latency and queries of common operations."""
+    results = benchmarks.run(cases, iterations=iterations, cached=cached,
+                             seed=seed)
+    for name, result in results.items():
+        click.echo("{0}: mean {1:.2f} ms, median {2:.2f} ms, "
+                   "p95 {3:.2f} ms, max {4:.2f} ms, {5:.1f} queries".format(
+                       name,
+                       result['mean_ms'],
+                       result['median_ms'],
+                       result['p95_ms'],
+                       result['max_ms'],
+                       result['queries']))
+
+    if output is not None:
+        json.dump(results, output, indent=2)
+
+    if baseline is not None:
+        regressions = benchmarks.compare(results, json.load(baseline),
+                                         threshold)
+        for regression in regressions:
+            click.echo("Regression in {0}".format(regression), err=True)
+        if len(regressions) > 0:
+            raise click.exceptions.Exit(1)
+
+
 @app.cli.command()
 def email_weekly_charts():
     """If configured, email the weekly charts."""
@@ -75,7 +295,7 @@ def cleanup_dj_list():
 @click.option('--message', prompt=True)
 def send_message(message):
     """Send a message to the current DJ."""
-    result = pubsub.publish(
+    result = pubsub.send(
         app.config['PUBSUB_PUB_URL_DJ'],
         message={
             'event': "message",
@@ -99,6 +319,22 @@ def run_scheduler():
     scheduler.add_job(tasks.cleanup_dj_list_task, 'cron',
                       day_of_week=1, hour=0, minute=0, second=0)
     scheduler.add_job(tasks.internal_ping, 'interval', minutes=1)
+    scheduler.add_job(tasks.prewarm_charts, 'cron',
+                      minute=0, second=0,
+                      next_run_time=datetime.datetime.now())
+    scheduler.add_job(tasks.rebuild_stale_dj_charts, 'interval',
+                      minutes=15, next_run_time=datetime.datetime.now())
+    scheduler.add_job(tasks.sample_stream_listeners, 'interval',
+                      seconds=app.config['ICECAST_POLL_INTERVAL'])
     scheduler.add_job(tasks.cleanup_sessions_and_claim_tokens, 'cron',
                       hour=1, minute=0, second=0)
+    scheduler.add_job(tasks.maintain_tracklog_partitions, 'cron',
+                      day=1, hour=2, minute=0, second=0,
+                      next_run_time=datetime.datetime.now())
+    scheduler.add_job(tasks.refresh_analytics, 'interval', minutes=10)
+    scheduler.add_job(tasks.rebuild_analytics, 'cron',
+                      hour=5, minute=0, second=0)
+    scheduler.add_job(tasks.rebuild_autocomplete, 'cron',
+                      hour=4, minute=0, second=0,
+                      next_run_time=datetime.datetime.now())
     scheduler.start()
@@ -0,0 +1,101 @@
+"""Conditional GET support for public playlists, charts and now playing.
+
+Responses carry an ETag and a Last-Modified date that are known before the
+response is produced: the cache generations and invalidation times of the
+scopes a playlist depends on, when a chart was computed, or the generations
+a now-playing document was rendered at. If the client already has the
+current version, it gets an empty 304 response without anything being read
+from the database or serialized.
+
+The validators are recorded for the current request, so HTML views that get
+their data from the same cached resources send them as well. A view must not
+use more than one source of validators. As the public pages also show the
+login state of the user, which the validators do not cover, they are only
+sent to anonymous users; pages rendered for logged in users are private.
+"""
+
+from flask import abort, g, has_request_context, request, Response
+from functools import wraps
+import datetime
+import hashlib
+from werkzeug.http import is_resource_modified
+from .auth import current_user
+
+# blueprints whose views render templates that depend on the user
+USER_BLUEPRINTS = ('public',)
+
+
+def make_etag(*parts):
+    return hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+
+
+def set_validators(etag, last_modified=None):
+    """Use the provided validators for the current request. If the client
+    already has this version, abort with 304 Not Modified."""
+    if not has_request_context():
+        return
+
+    if request.blueprint in USER_BLUEPRINTS and \
+            current_user.is_authenticated:
+        g.private_response = True
+        return
+
+    g.validators = (etag, last_modified)
+    if request.method in ('GET', 'HEAD') and not is_resource_modified(
+            request.environ, etag, last_modified=last_modified):
+        response = Response(status=304)
+        add_validators(response, etag, last_modified)
+        abort(response)
+
+
+def add_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+
+
+def add_request_validators(response):
+    validators = g.get('validators')
+    if validators is not None and response.status_code == 200:
+        add_validators(response, *validators)
+    if request.blueprint in USER_BLUEPRINTS and \
+            (validators is not None or g.get('private_response')):
+        response.vary.add('Cookie')
+        if g.get('private_response'):
+            response.cache_control.private = True
+    return response
+
+
+def memoize(cache, timeout=None):
+    """Memoize a resource method in the provided cache along with the time
+    the result was computed, which is used as the Last-Modified date.
+    Results returned with a status code are not memoized."""
+
+    def memoize_decorator(f):
+        @wraps(f)
+        def memoize_wrapper(*args, **kwargs):
+            cache_key = "{0}_{1}".format(
+                f.__qualname__,
+                make_etag(args, sorted(kwargs.items()),
+                          sorted(request.args.items(multi=True))))
+
+            entry = cache.get(cache_key)
+            if entry is None:
+                rv = f(*args, **kwargs)
+                if isinstance(rv, tuple):
+                    # responses with a status, such as errors, are neither
+                    # cached nor validated
+                    return rv
+
+                entry = (rv, datetime.datetime.utcnow().replace(microsecond=0))
+                cache.set(cache_key, entry, timeout=timeout)
+
+            rv, computed = entry
+            set_validators(make_etag(cache_key, computed), computed)
+            return rv
+        return memoize_wrapper
+    return memoize_decorator
+
+
+def init_app(app):
+    app.after_request(add_request_validators)
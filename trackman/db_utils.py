@@ -1,9 +1,14 @@
-from trackman import db
-from trackman.models import DJ, Rotation, Track
+import datetime
+import random
+from trackman import autocomplete, db, djcharts, playstats
+from trackman.models import DJ, DJSet, Rotation, Track, TrackLog, match_key
+
+GENERATE_BATCH_SIZE = 10000
 
 
 def initdb():
-    db.create_all()
+    # only create tables in the primary database, not the replica
+    db.create_all(bind=None)
 
     dj = DJ("Automation", "Automation", False)
     db.session.add(dj)
@@ -47,3 +52,192 @@ def add_sample_tracks():
     except:
         db.session.rollback()
         raise
+
+
+SYLLABLES = ["ka", "ri", "mo", "sa", "ten", "vor", "li", "na", "dra", "ex",
+             "ul", "po", "zen", "ar", "mi", "tho", "gal", "es", "qua", "ny"]
+WORDS = ["night", "black", "river", "electric", "summer", "ghost", "golden",
+         "broken", "velvet", "iron", "silent", "wild", "crystal", "neon",
+         "paper", "stone", "dream", "fire", "ocean", "machine", "love",
+         "city", "shadow", "light", "heart", "storm", "desert", "glass"]
+
+
+def fake_name(rng, syllables=(2, 3)):
+    return "".join(rng.choice(SYLLABLES) for i in range(
+        rng.randint(*syllables))).capitalize()
+
+
+def fake_phrase(rng, words=(1, 4)):
+    return " ".join(rng.choice(WORDS) for i in range(
+        rng.randint(*words))).title()
+
+
+def case_variant(rng, value):
+    return rng.choice([value.lower(), value.upper(), value.swapcase()])
+
+
+def insert_rows(table, rows):
+    if len(rows) > 0:
+        db.session.execute(table.insert(), rows)
+    del rows[:]
+
+
+def generate_djs(rng, count):
+    rows = []
+    for i in range(count):
+        name = "{0} {1}".format(fake_name(rng), fake_name(rng))
+        rows.append({
+            'airname': "DJ {0} {1:d}".format(fake_name(rng), i),
+            'name': name,
+            'phone': "5405550000",
+            'email': "{0:d}@example.com".format(i),
+            'visible': rng.random() < 0.2,
+            'play_count': 0,
+            'vinyl_play_count': 0,
+            'request_play_count': 0,
+        })
+        if len(rows) >= GENERATE_BATCH_SIZE:
+            insert_rows(DJ.__table__, rows)
+    insert_rows(DJ.__table__, rows)
+
+
+def generate_tracks(rng, count, duplicate_rate):
+    labels = [fake_phrase(rng, (1, 2)) + " Records"
+              for i in range(max(count // 200, 1))]
+    labels.append("Not Available")
+
+    tracks = []
+    rows = []
+    artist = album = label = None
+    for i in range(count):
+        if len(tracks) > 0 and rng.random() < duplicate_rate:
+            # a duplicate of an existing track, often with different case
+            title, artist, album, label = rng.choice(tracks)
+            if rng.random() < 0.7:
+                title = case_variant(rng, title)
+                artist = case_variant(rng, artist)
+        else:
+            if artist is None or rng.random() < 0.1:
+                artist = fake_name(rng)
+            if album is None or rng.random() < 0.2:
+                album = fake_phrase(rng)
+                label = rng.choice(labels)
+            title = fake_phrase(rng)
+            tracks.append((title, artist, album, label))
+
+        rows.append({
+            'title': title,
+            'artist': artist,
+            'album': album,
+            'label': label,
+            'match_key': match_key(artist, title, album, label),
+            'partial_match_key': match_key(artist, title, album),
+            'play_count': 0,
+        })
+        if len(rows) >= GENERATE_BATCH_SIZE:
+            insert_rows(Track.__table__, rows)
+    insert_rows(Track.__table__, rows)
+
+    return tracks
+
+
+def generate_plays(rng, start, end, plays_per_hour, automation_rate):
+    dj_ids = [dj_id for dj_id, in DJ.query.with_entities(DJ.id).filter(
+        DJ.id > 1)]
+    tracks = Track.query.with_entities(
+        Track.id, Track.title, Track.artist, Track.album, Track.label).\
+        order_by(Track.id).all()
+    rotation_ids = [rotation_id for rotation_id, in
+                    Rotation.query.with_entities(Rotation.id)]
+    if len(tracks) <= 0:
+        raise ValueError("Cannot generate plays without any tracks")
+
+    next_set_id = (db.session.query(db.func.max(DJSet.id)).scalar() or 0) + 1
+    sets = []
+    plays = []
+    count = 0
+    dtstart = start
+    while dtstart < end:
+        dtend = min(dtstart + datetime.timedelta(hours=rng.randint(1, 3)),
+                    end)
+        if len(dj_ids) <= 0 or rng.random() < automation_rate:
+            dj_id = 1
+        else:
+            dj_id = rng.choice(dj_ids)
+
+        set_id = next_set_id
+        next_set_id += 1
+        sets.append({'id': set_id, 'dj_id': dj_id, 'dtstart': dtstart,
+                     'dtend': dtend})
+
+        played = dtstart
+        while played < dtend:
+            # a few popular tracks are played far more often than the rest
+            index = min(int(rng.paretovariate(1.2)) - 1, len(tracks) - 1)
+            track = tracks[index * 7919 % len(tracks)]
+            plays.append({
+                'track_id': track.id,
+                'djset_id': set_id,
+                'dj_id': dj_id,
+                'played': played,
+                'request': rng.random() < 0.05,
+                'vinyl': dj_id > 1 and rng.random() < 0.15,
+                'new': rng.random() < 0.1,
+                'rotation_id': rng.choice(rotation_ids),
+                'listeners': rng.randint(0, 200),
+                'title': track.title,
+                'artist': track.artist,
+                'album': track.album,
+                'label': track.label,
+            })
+            count += 1
+            played += datetime.timedelta(
+                seconds=rng.expovariate(plays_per_hour / 3600.0))
+
+            if len(plays) >= GENERATE_BATCH_SIZE:
+                insert_rows(DJSet.__table__, sets)
+                insert_rows(TrackLog.__table__, plays)
+                db.session.commit()
+
+        dtstart = dtend
+
+    insert_rows(DJSet.__table__, sets)
+    insert_rows(TrackLog.__table__, plays)
+
+    if db.session.connection().dialect.name == 'postgresql':
+        # the set IDs were assigned here, so move the sequence past them
+        db.session.execute(
+            "SELECT setval(pg_get_serial_sequence('set', 'id'), "
+            "(SELECT max(id) FROM \"set\"))")
+
+    return count
+
+
+def generate_history(years=1, djs=1000, tracks=100000, plays_per_hour=15,
+                     duplicate_rate=0.05, automation_rate=0.3, seed=None):
+    """Fill the database with a synthetic station history for benchmarks:
+    `djs` DJs, `tracks` tracks of which about `duplicate_rate` are duplicates
+    (often differing in case) of other tracks, and sets covering the last
+    `years` years around the clock, with about `plays_per_hour` plays per
+    hour. The rollups, counters, DJ chart snapshots and autocomplete index
+    are rebuilt afterwards. Returns the number of plays generated."""
+    rng = random.Random(seed)
+    end = datetime.datetime.utcnow().replace(microsecond=0)
+    start = end - datetime.timedelta(days=int(365 * years))
+
+    try:
+        generate_djs(rng, djs)
+        generate_tracks(rng, tracks, duplicate_rate)
+        db.session.commit()
+        plays = generate_plays(rng, start, end, plays_per_hour,
+                               automation_rate)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+
+    playstats.rebuild_all()
+    playstats.reconcile_counters()
+    djcharts.rebuild_all()
+    autocomplete.rebuild()
+    return plays
@@ -0,0 +1,132 @@
+"""Bulk merging of duplicate tracks.
+
+All duplicates are mapped to the oldest track with the same fields in a
+temporary table, which is then used to repoint plays and reports and to
+delete the duplicates with a handful of set-based statements in a single
+transaction.
+"""
+
+import collections
+from . import autocomplete, db, invalidation, playstats
+from .models import Track, TrackLog, TrackReport
+
+merge_metadata = db.MetaData()
+track_merge = db.Table(
+    'track_merge',
+    merge_metadata,
+    db.Column('loser_id', db.Integer, primary_key=True),
+    db.Column('canonical_id', db.Integer, nullable=False),
+    prefixes=['TEMPORARY'])
+
+
+def duplicate_fields(ignore_case):
+    if ignore_case:
+        return ['match_key']
+    else:
+        return ['artist', 'title', 'album', 'label']
+
+
+def fill_merge_table(fields):
+    """Map every duplicate track to the track with the lowest ID that has the
+    same values for `fields`."""
+    canonical = db.session.query(
+        db.func.min(Track.id).label('canonical_id'),
+        *[getattr(Track, field).label(field) for field in fields]).\
+        group_by(*[getattr(Track, field) for field in fields]).\
+        having(db.func.count(Track.id) > 1).subquery()
+
+    losers = db.session.query(Track.id, canonical.c.canonical_id).\
+        join(canonical, db.and_(*[
+            getattr(Track, field) == getattr(canonical.c, field)
+            for field in fields])).\
+        filter(Track.id != canonical.c.canonical_id)
+
+    db.session.execute(track_merge.insert().from_select(
+        ['loser_id', 'canonical_id'], losers))
+
+
+def repoint(table):
+    """Point the track_id of each row in `table` that refers to a duplicate
+    at the canonical track instead."""
+    if db.session.connection().dialect.name == 'sqlite':
+        # SQLite does not support UPDATE ... FROM here, so use a correlated
+        # subquery instead
+        update = table.update().\
+            values(track_id=db.select([track_merge.c.canonical_id]).
+                   where(track_merge.c.loser_id == table.c.track_id).
+                   scalar_subquery()).\
+            where(table.c.track_id.in_(db.select([track_merge.c.loser_id])))
+    else:
+        update = table.update().\
+            values(track_id=track_merge.c.canonical_id).\
+            where(table.c.track_id == track_merge.c.loser_id)
+
+    db.session.execute(update)
+
+
+def merge_report():
+    merges = collections.defaultdict(list)
+    for loser_id, canonical_id in db.session.query(
+            track_merge.c.loser_id, track_merge.c.canonical_id).\
+            order_by(track_merge.c.canonical_id, track_merge.c.loser_id):
+        merges[canonical_id].append(loser_id)
+
+    tracklogs = db.session.query(db.func.count(TrackLog.id)).\
+        join(track_merge, TrackLog.track_id == track_merge.c.loser_id).\
+        scalar()
+    reports = db.session.query(db.func.count(TrackReport.id)).\
+        join(track_merge, TrackReport.track_id == track_merge.c.loser_id).\
+        scalar()
+
+    return {
+        'groups': len(merges),
+        'tracks': sum(len(loser_ids) for loser_ids in merges.values()),
+        'tracklogs': tracklogs,
+        'reports': reports,
+        'merges': sorted(merges.items()),
+    }
+
+
+def deduplicate_all_tracks(ignore_case=False, dry_run=False):
+    """Merge all duplicate tracks into the oldest track with the same
+    artist, title, album, and label, ignoring case if requested. Returns a
+    report of the merges; with `dry_run`, nothing is changed."""
+    connection = db.session.connection()
+    track_merge.create(connection)
+
+    try:
+        fill_merge_table(duplicate_fields(ignore_case))
+        report = merge_report()
+        if dry_run or report['tracks'] <= 0:
+            track_merge.drop(connection)
+            db.session.rollback()
+            return report
+
+        days = set(played.date() for played, in db.session.query(
+            TrackLog.played).distinct().
+            join(track_merge, TrackLog.track_id == track_merge.c.loser_id))
+        merged_values = autocomplete.track_values(
+            Track.query.join(track_merge,
+                             Track.id == track_merge.c.loser_id))
+
+        repoint(TrackLog.__table__)
+        repoint(TrackReport.__table__)
+        db.session.execute(
+            Track.__table__.delete().
+            where(Track.id.in_(db.select([track_merge.c.loser_id]))))
+
+        playstats.rebuild_days(days)
+        playstats.recount_tracks(Track.id.in_(
+            db.select([track_merge.c.canonical_id])))
+        track_merge.drop(connection)
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+
+    # the deleted tracks may still be in the identity map
+    db.session.expire_all()
+
+    invalidation.invalidate_all()
+    autocomplete.remove_unused(merged_values)
+    return report
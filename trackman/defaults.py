@@ -3,6 +3,10 @@ DEBUG = False
 
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 SQLALCHEMY_ENGINE_OPTIONS = {'pool_pre_ping': True}
+# name of the bind in SQLALCHEMY_BINDS used as a read replica, if it is set
+DATABASE_REPLICA_BIND = "replica"
+DATABASE_REPLICA_MAX_LAG = 30
+DATABASE_REPLICA_CHECK_INTERVAL = 5
 REDIS_URL = 'redis://redis:6379/0'
 
 ARTISTS_PER_PAGE = 500
@@ -20,11 +24,21 @@ CLAIM_TOKEN_TIMEOUT = 86400
 AUTOMATION_PASSWORD = ""
 ICECAST_URL = ""
 ICECAST_MOUNTS = []
+# how often to poll Icecast for listeners, and how long to keep samples
+ICECAST_POLL_INTERVAL = 30
+ICECAST_LISTENERS_MAX_AGE = 120
+ICECAST_LISTENERS_HISTORY = 7 * 86400
 INTERNAL_IPS = ['127.0.0.1/8']
 TRACKMAN_NAME = "Trackman"
 TRACKMAN_ARTIST_PROHIBITED = ["?", "-"]
 TRACKMAN_LABEL_PROHIBITED = ["?", "-", "same"]
 TRACKMAN_DJ_HIDE_AFTER_DAYS = 425
+TRACK_SEARCH_BACKEND = None
+TRACKLOG_SNAPSHOT_READS = False
+# partition tracklog by month on PostgreSQL; see trackman/partitions.py
+TRACKLOG_PARTITIONING = False
+TRACKLOG_PARTITIONS_AHEAD = 3
+TRACKLOG_ARCHIVE_YEARS = None
 
 ARCHIVE_URL_FORMAT = ""
 MUSICBRAINZ_HOSTNAME = "musicbrainz.org"
@@ -55,5 +69,10 @@ AUTH_ROLE_GROUPS = {
 TRACKMAN_API_URL = "http://nginx/api"
 PUBSUB_PUB_URL_ALL = "http://nginx:8080/pub"
 PUBSUB_PUB_URL_DJ = "http://nginx:8080/dj/pub"
+PUBSUB_QUEUE_SIZE = 1000
+PUBSUB_MAX_RETRIES = 3
+PUBSUB_TIMEOUT = 5
+
+REQUEST_METRICS = True
 
 SENTRY_DSN = ""
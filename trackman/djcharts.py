@@ -0,0 +1,239 @@
+"""Chart snapshots of the artists, albums and tracks each DJ has played.
+
+A DJ's charts cover every play in their history, so rather than aggregating
+all of them whenever the charts are requested, the number of plays of each
+artist, album and track by each DJ is stored and the charts are read from
+those rows in order. A snapshot records the ID of the last TrackLog it has
+counted, and is updated when one of the DJ's sets ends by counting the plays
+logged since.
+
+When plays that a snapshot has already counted are edited, deleted or moved
+to another track, playstats marks the snapshot as stale. Stale snapshots
+continue to be served until the scheduler rebuilds them from scratch, and
+are not updated when a set ends in the meantime.
+
+Snapshots are never built or rebuilt while serving a request, as that would
+scan the DJ's whole history. Run `flask rebuild-dj-charts --all` after upgrading;
+until then, the charts of DJs without a snapshot are unavailable, and the
+scheduler builds the missing snapshots.
+"""
+
+import collections
+import datetime
+import sqlalchemy.exc
+from . import db, playstats
+from .charts import CHART_PER_PAGE
+from .models import DJ, DJAlbumPlays, DJArtistPlays, DJChartSnapshot, \
+    DJTrackPlays, Track, TrackLog
+
+SNAPSHOT_MODELS = (DJArtistPlays, DJAlbumPlays, DJTrackPlays)
+
+
+def play_rows(dj_id, track_id, artist, album):
+    """Return the (model, keys, display values, counts) of each snapshot row
+    that a single play is counted in."""
+    return [
+        (DJArtistPlays,
+         {'dj_id': dj_id, 'artist_key': playstats.normalize(artist)},
+         {'artist': artist},
+         {'plays': 1}),
+        (DJAlbumPlays,
+         {'dj_id': dj_id, 'artist_key': playstats.normalize(artist),
+          'album_key': playstats.normalize(album)},
+         {'artist': artist, 'album': album},
+         {'plays': 1}),
+        (DJTrackPlays,
+         {'dj_id': dj_id, 'track_id': track_id},
+         {},
+         {'plays': 1}),
+    ]
+
+
+class SnapshotBuilder(object):
+    def __init__(self, dj_id):
+        self.dj_id = dj_id
+        self.rows = collections.OrderedDict()
+        self.plays = 0
+        self.last_tracklog_id = 0
+
+    def add(self, tracklog_id, track_id, artist, album):
+        self.plays += 1
+        self.last_tracklog_id = max(self.last_tracklog_id, tracklog_id)
+        for model, keys, values, counts in play_rows(
+                self.dj_id, track_id, artist, album):
+            row_key = (model, tuple(sorted(keys.items())))
+            row = self.rows.get(row_key)
+            if row is None:
+                self.rows[row_key] = (keys, dict(values), dict(counts))
+                continue
+
+            for name, count in counts.items():
+                row[2][name] += count
+            for name, value in values.items():
+                if row[1][name] is None or \
+                        (value is not None and value < row[1][name]):
+                    row[1][name] = value
+
+    def insert(self):
+        """Insert the rows into empty tables."""
+        by_model = collections.defaultdict(list)
+        for (model, _), (keys, values, counts) in self.rows.items():
+            by_model[model].append(dict(keys, **values, **counts))
+
+        for model, rows in by_model.items():
+            db.session.execute(model.__table__.insert(), rows)
+
+    def add_to_rows(self):
+        """Add the counts to the existing rows."""
+        for (model, _), (keys, values, counts) in self.rows.items():
+            playstats.update_row(model, keys, values, counts, 1)
+
+
+def play_query(dj_id):
+    return db.session.query(
+        TrackLog.id, TrackLog.track_id, Track.artist, Track.album).\
+        join(Track, Track.id == TrackLog.track_id).\
+        filter(TrackLog.dj_id == dj_id)
+
+
+def lock_snapshot(dj_id):
+    snapshot = DJChartSnapshot.query.with_for_update().get(dj_id)
+    if snapshot is not None:
+        return snapshot
+
+    try:
+        with db.session.begin_nested():
+            snapshot = DJChartSnapshot(dj_id)
+            db.session.add(snapshot)
+    except sqlalchemy.exc.IntegrityError:
+        # the snapshot was added by a concurrent transaction
+        snapshot = DJChartSnapshot.query.with_for_update().get(dj_id)
+    return snapshot
+
+
+def update(dj_id, rebuild=True):
+    """Count the plays of a DJ logged since their chart snapshot was last
+    updated, or rebuild the snapshot from scratch if it is stale or new.
+    If `rebuild` is false, stale and new snapshots are left for the
+    scheduler instead. Returns the number of plays counted."""
+    if rebuild:
+        snapshot = lock_snapshot(dj_id)
+    else:
+        snapshot = DJChartSnapshot.query.with_for_update().get(dj_id)
+        if snapshot is None or snapshot.stale:
+            db.session.rollback()
+            return 0
+
+    builder = SnapshotBuilder(dj_id)
+
+    if snapshot.stale:
+        for model in SNAPSHOT_MODELS:
+            model.query.filter(model.dj_id == dj_id).delete(
+                synchronize_session=False)
+        for play in play_query(dj_id).yield_per(5000):
+            builder.add(*play)
+        builder.insert()
+        snapshot.stale = False
+    else:
+        for play in play_query(dj_id).filter(
+                TrackLog.id > snapshot.last_tracklog_id):
+            builder.add(*play)
+        builder.add_to_rows()
+
+    snapshot.last_tracklog_id = max(snapshot.last_tracklog_id,
+                                    builder.last_tracklog_id)
+    snapshot.updated = datetime.datetime.utcnow()
+
+    try:
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+
+    return builder.plays
+
+
+def rebuild_stale():
+    """Rebuild every stale chart snapshot, committing after each DJ. Returns
+    the number of snapshots that were rebuilt."""
+    dj_ids = [dj_id for dj_id, in DJChartSnapshot.query.with_entities(
+        DJChartSnapshot.dj_id).filter(DJChartSnapshot.stale == True)]
+    for dj_id in dj_ids:
+        update(dj_id)
+    return len(dj_ids)
+
+
+def build_missing():
+    """Build the chart snapshots of DJs who have logged tracks but do not
+    have one yet, committing after each DJ. Returns the number of snapshots
+    that were built."""
+    dj_ids = [dj_id for dj_id, in DJ.query.with_entities(DJ.id).
+              outerjoin(DJChartSnapshot, DJChartSnapshot.dj_id == DJ.id).
+              filter(DJ.play_count > 0, DJChartSnapshot.dj_id == None).
+              order_by(DJ.id)]
+    for dj_id in dj_ids:
+        update(dj_id)
+    return len(dj_ids)
+
+
+def rebuild_all():
+    """Rebuild the chart snapshots of every DJ who has logged tracks,
+    committing after each DJ. Returns the number of snapshots that were
+    rebuilt."""
+    playstats.mark_dj_charts_stale()
+    try:
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+
+    dj_ids = [dj_id for dj_id, in DJ.query.with_entities(DJ.id).filter(
+        DJ.play_count > 0).order_by(DJ.id)]
+    for dj_id in dj_ids:
+        update(dj_id)
+    return len(dj_ids)
+
+
+def is_built(dj_id):
+    """Return whether a DJ's chart snapshot has been built, or there is
+    nothing to build as they have not logged any tracks."""
+    return DJChartSnapshot.query.get(dj_id) is not None or \
+        DJ.query.with_entities(DJ.play_count).filter(
+            DJ.id == dj_id).scalar() == 0
+
+
+def chart(dj_id, query, limit):
+    results = query.limit(limit).all()
+    if len(results) <= 0 and not is_built(dj_id):
+        return None
+    return results
+
+
+def album_chart(dj_id, limit=CHART_PER_PAGE):
+    """Return a list of (artist, album, plays) for a DJ, with their most
+    played albums first, or None if their snapshot has not been built."""
+    return chart(dj_id, db.session.query(
+        DJAlbumPlays.artist, DJAlbumPlays.album, DJAlbumPlays.plays).
+        filter(DJAlbumPlays.dj_id == dj_id).
+        order_by(db.desc(DJAlbumPlays.plays), DJAlbumPlays.artist_key,
+                 DJAlbumPlays.album_key), limit)
+
+
+def artist_chart(dj_id, limit=CHART_PER_PAGE):
+    """Return a list of (artist, plays) for a DJ, with their most played
+    artists first, or None if their snapshot has not been built."""
+    return chart(dj_id, db.session.query(
+        DJArtistPlays.artist, DJArtistPlays.plays).
+        filter(DJArtistPlays.dj_id == dj_id).
+        order_by(db.desc(DJArtistPlays.plays), DJArtistPlays.artist_key),
+        limit)
+
+
+def track_chart(dj_id, limit=CHART_PER_PAGE):
+    """Return a list of (Track, plays) for a DJ, with their most played
+    tracks first, or None if their snapshot has not been built."""
+    return chart(dj_id, db.session.query(Track, DJTrackPlays.plays).
+                 join(DJTrackPlays, DJTrackPlays.track_id == Track.id).
+                 filter(DJTrackPlays.dj_id == dj_id).
+                 order_by(db.desc(DJTrackPlays.plays),
+                          DJTrackPlays.track_id), limit)
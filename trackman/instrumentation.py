@@ -0,0 +1,298 @@
+"""Per-request instrumentation of database queries and Redis commands.
+
+Every SQL statement and Redis command is counted and timed, and the totals
+for each request are recorded as uWSGI logvars, and as response headers when
+debugging. They are also aggregated into histograms for each endpoint, which
+are kept in Redis so that they cover all workers, and exported along with
+other statistics in the Prometheus text format by /metrics.
+"""
+
+from flask import current_app, g, has_request_context, request, \
+    request_started
+import collections
+import logging
+import redis
+import redis.client
+import redis.exceptions
+import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+try:
+    import uwsgi
+except ImportError:
+    uwsgi = None
+
+METRICS_KEY = "trackman_request_metrics"
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                    10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# name: (buckets, help text)
+HISTOGRAMS = collections.OrderedDict([
+    ('request_duration_seconds', (
+        DURATION_BUCKETS, "Time spent handling requests")),
+    ('request_sql_queries', (
+        COUNT_BUCKETS, "Number of SQL statements executed per request")),
+    ('request_sql_duration_seconds', (
+        DURATION_BUCKETS, "Time spent executing SQL statements per request")),
+    ('request_redis_commands', (
+        COUNT_BUCKETS, "Number of Redis commands sent per request")),
+    ('request_redis_duration_seconds', (
+        DURATION_BUCKETS, "Time spent on Redis commands per request")),
+])
+
+logger = logging.getLogger(__name__)
+
+
+class RequestStats(object):
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.sql_queries = 0
+        self.sql_duration = 0.0
+        self.redis_commands = 0
+        self.redis_duration = 0.0
+
+    @property
+    def duration(self):
+        return time.perf_counter() - self.start
+
+    def observations(self):
+        return {
+            'request_duration_seconds': self.duration,
+            'request_sql_queries': self.sql_queries,
+            'request_sql_duration_seconds': self.sql_duration,
+            'request_redis_commands': self.redis_commands,
+            'request_redis_duration_seconds': self.redis_duration,
+        }
+
+
+def get_stats():
+    if not has_request_context():
+        return None
+
+    stats = g.get('request_stats')
+    if stats is None:
+        stats = g.request_stats = RequestStats()
+    return stats
+
+
+def start_request(sender, **extra):
+    g.request_stats = RequestStats()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    conn.info['query_start_time'] = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    stats = get_stats()
+    if stats is not None:
+        stats.sql_queries += 1
+        stats.sql_duration += \
+            time.perf_counter() - conn.info['query_start_time']
+
+
+def timed_redis(f):
+    def timed_redis_wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            stats = get_stats()
+            if stats is not None:
+                stats.redis_commands += 1
+                stats.redis_duration += time.perf_counter() - start
+    timed_redis_wrapper.instrumented = True
+    return timed_redis_wrapper
+
+
+def instrument_redis():
+    # every Redis client, including the ones created by Flask-Caching, sends
+    # commands through these; a pipeline is counted as a single command since
+    # it is sent in one round trip
+    for cls, name in ((redis.Redis, 'execute_command'),
+                      (redis.client.Pipeline, 'execute')):
+        f = getattr(cls, name)
+        if not getattr(f, 'instrumented', False):
+            setattr(cls, name, timed_redis(f))
+
+
+def bucket_for(value, buckets):
+    for bucket in buckets:
+        if value <= bucket:
+            return format_bucket(bucket)
+    return "+Inf"
+
+
+def format_bucket(bucket):
+    return "{0:g}".format(bucket)
+
+
+def record(endpoint, stats, redis_conn):
+    """Add the totals for a request to the histograms of its endpoint. Only
+    the bucket the value falls into is incremented; the buckets are made
+    cumulative when the metrics are exported."""
+    pipe = redis_conn.pipeline(transaction=False)
+    for name, value in stats.observations().items():
+        buckets = HISTOGRAMS[name][0]
+        prefix = "{0}|{1}|".format(name, endpoint)
+        pipe.hincrby(METRICS_KEY, prefix + bucket_for(value, buckets), 1)
+        pipe.hincrby(METRICS_KEY, prefix + "count", 1)
+        pipe.hincrbyfloat(METRICS_KEY, prefix + "sum", value)
+    pipe.execute()
+
+
+def load_histograms(redis_conn):
+    """Return the recorded histograms as a dictionary mapping each name to a
+    dictionary of endpoints and their cumulative buckets, count and sum."""
+    histograms = collections.defaultdict(dict)
+    for field, value in redis_conn.hgetall(METRICS_KEY).items():
+        name, endpoint, key = field.decode('utf-8').split('|')
+        if name not in HISTOGRAMS:
+            continue
+
+        series = histograms[name].setdefault(endpoint, {
+            'buckets': collections.Counter(),
+            'count': 0,
+            'sum': 0.0,
+        })
+        if key == "count":
+            series['count'] = int(value)
+        elif key == "sum":
+            series['sum'] = float(value)
+        else:
+            series['buckets'][key] = int(value)
+
+    for name, (buckets, help) in HISTOGRAMS.items():
+        for series in histograms[name].values():
+            total = 0
+            cumulative = []
+            for bucket in buckets:
+                total += series['buckets'][format_bucket(bucket)]
+                cumulative.append((bucket, total))
+            series['buckets'] = cumulative
+    return histograms
+
+
+def format_labels(labels):
+    if len(labels) <= 0:
+        return ""
+    return "{" + ",".join('{0}="{1}"'.format(
+        key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in sorted(labels.items())) + "}"
+
+
+class MetricsWriter(object):
+    """Writes metrics in the Prometheus text exposition format."""
+
+    def __init__(self, prefix="trackman_"):
+        self.prefix = prefix
+        self.lines = []
+
+    def header(self, name, type_, help):
+        self.lines.append("# HELP {0}{1} {2}".format(self.prefix, name, help))
+        self.lines.append("# TYPE {0}{1} {2}".format(self.prefix, name, type_))
+
+    def sample(self, name, value, labels={}):
+        self.lines.append("{0}{1}{2} {3}".format(
+            self.prefix, name, format_labels(labels), value))
+
+    def metric(self, name, type_, help, value, labels={}):
+        self.header(name, type_, help)
+        self.sample(name, value, labels)
+
+    def histogram(self, name, help, series):
+        """Write a histogram; `series` is a list of tuples of labels, a list
+        of cumulative (bucket, count) tuples, the count and the sum."""
+        self.header(name, "histogram", help)
+        for labels, buckets, count, sum_ in series:
+            for bucket, value in buckets:
+                self.sample(name + "_bucket", value,
+                            dict(labels, le=format_bucket(bucket)))
+            self.sample(name + "_bucket", count, dict(labels, le="+Inf"))
+            self.sample(name + "_sum", sum_, labels)
+            self.sample(name + "_count", count, labels)
+
+    def render(self):
+        return "\n".join(self.lines) + "\n"
+
+
+def render_metrics(redis_conn, pubsub_stats, session_cache_stats):
+    """Render the request histograms of all workers, and the live event
+    publishing and session cache statistics of this process."""
+    writer = MetricsWriter()
+
+    histograms = load_histograms(redis_conn)
+    for name, (buckets, help) in HISTOGRAMS.items():
+        writer.histogram(name, help, [
+            ({'endpoint': endpoint}, series['buckets'], series['count'],
+             series['sum'])
+            for endpoint, series in sorted(histograms[name].items())])
+
+    writer.metric('pubsub_queue_depth', "gauge",
+                  "Live events waiting to be delivered to nchan",
+                  pubsub_stats['queue_depth'])
+    writer.header('pubsub_events_total', "counter",
+                  "Live events by outcome")
+    for result in ('published', 'sent', 'failed', 'dropped', 'coalesced'):
+        writer.sample('pubsub_events_total', pubsub_stats[result],
+                      {'result': result})
+    writer.metric('pubsub_retries_total', "counter",
+                  "Retried deliveries of live events",
+                  pubsub_stats['retries'])
+    writer.histogram(
+        'pubsub_delivery_latency_seconds',
+        "Time from queueing a live event to its delivery", [
+            ({}, pubsub_stats['latency_buckets'],
+             pubsub_stats['latency_count'], pubsub_stats['latency_sum'])])
+
+    writer.header('session_cache_requests_total', "counter",
+                  "User session cache lookups by result")
+    writer.sample('session_cache_requests_total',
+                  session_cache_stats['hits'], {'result': 'hit'})
+    writer.sample('session_cache_requests_total',
+                  session_cache_stats['misses'], {'result': 'miss'})
+
+    return writer.render()
+
+
+def finish_request(response):
+    stats = get_stats()
+    if stats is None:
+        return response
+
+    if uwsgi is not None:
+        uwsgi.set_logvar('sql_queries', str(stats.sql_queries))
+        uwsgi.set_logvar('sql_msecs',
+                         str(int(stats.sql_duration * 1000)))
+        uwsgi.set_logvar('redis_commands', str(stats.redis_commands))
+        uwsgi.set_logvar('redis_msecs',
+                         str(int(stats.redis_duration * 1000)))
+
+    if current_app.debug:
+        response.headers['X-SQL-Queries'] = str(stats.sql_queries)
+        response.headers['X-Redis-Commands'] = str(stats.redis_commands)
+        response.headers['Server-Timing'] = \
+            "sql;dur={0:.2f}, redis;dur={1:.2f}".format(
+                stats.sql_duration * 1000, stats.redis_duration * 1000)
+
+    if current_app.config['REQUEST_METRICS']:
+        from . import redis_conn
+        try:
+            record(request.endpoint or "none", stats, redis_conn)
+        except redis.exceptions.RedisError as exc:
+            logger.warning("Trackman: Failed to record request metrics: "
+                           "{0}".format(exc))
+
+    return response
+
+
+def init_app(app):
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    instrument_redis()
+    request_started.connect(start_request, app)
+    app.after_request(finish_request)
@@ -0,0 +1,137 @@
+"""Generation-based invalidation for cached playlist data.
+
+Every cached playlist result is keyed on the current generation of each scope
+it depends on (a DJSet, a DJ, a Track, a day, or what is now playing) plus a
+global generation. Invalidating a scope is a single INCR; entries keyed on an
+older generation are never read again and simply expire from the cache.
+The time each scope was last invalidated is recorded as well, and used as the
+Last-Modified date of the results that depend on it.
+"""
+
+import datetime
+import hashlib
+import time
+from flask import request
+from functools import wraps
+from . import conditional, redis_conn, replica
+
+GENERATION_KEY_PREFIX = "trackman_generation_"
+INVALIDATED_KEY = "trackman_invalidated"
+
+ALL = "all"
+NOW_PLAYING = "now_playing"
+DJS = "djs"
+
+
+def djset_scope(djset_id):
+    return "djset_{0:d}".format(int(djset_id))
+
+
+def dj_scope(dj_id):
+    return "dj_{0:d}".format(int(dj_id))
+
+
+def track_scope(track_id):
+    return "track_{0:d}".format(int(track_id))
+
+
+def day_scope(value):
+    return "day_{0}".format(value.strftime("%Y-%m-%d"))
+
+
+def djset_scopes(djset, track_ids=()):
+    """Return the scopes that depend on the start or end of a DJSet. Plays
+    include their DJSet, so the pages of any tracks played during the set are
+    affected as well."""
+    return [
+        NOW_PLAYING,
+        djset_scope(djset.id),
+        dj_scope(djset.dj_id),
+        day_scope(djset.dtstart),
+    ] + [track_scope(track_id) for track_id in track_ids]
+
+
+def tracklog_scopes(tracklog):
+    """Return the scopes that depend on a logged track."""
+    scopes = [NOW_PLAYING, track_scope(tracklog.track_id)]
+    if tracklog.djset_id is not None:
+        scopes.append(djset_scope(tracklog.djset_id))
+    return scopes
+
+
+def read_generations(pipe, scopes):
+    """Queue commands on `pipe` to read the generations of `scopes` and when
+    they were last invalidated. The two results should be passed to
+    parse_generations()."""
+    scopes = [ALL] + list(scopes)
+    pipe.mget([GENERATION_KEY_PREFIX + scope for scope in scopes])
+    pipe.hmget(INVALIDATED_KEY, scopes)
+
+
+def parse_generations(generations, times):
+    """Return the generations and the last time any of the scopes was
+    invalidated, or None if none of them have been."""
+    times = [float(value) for value in times if value is not None]
+    if len(times) > 0:
+        last_modified = datetime.datetime.utcfromtimestamp(int(max(times)))
+    else:
+        last_modified = None
+    return [int(value or 0) for value in generations], last_modified
+
+
+def get_generations(scopes):
+    pipe = redis_conn.pipeline(transaction=False)
+    read_generations(pipe, scopes)
+    return parse_generations(*pipe.execute())
+
+
+def invalidate(*scopes):
+    if len(scopes) <= 0:
+        return
+
+    now = time.time()
+    pipe = redis_conn.pipeline(transaction=False)
+    for scope in set(scopes):
+        pipe.incr(GENERATION_KEY_PREFIX + scope)
+    pipe.hset(INVALIDATED_KEY, mapping={scope: now for scope in scopes})
+    pipe.execute()
+
+
+def invalidate_all():
+    invalidate(ALL)
+
+
+def memoize(cache, timeout=None):
+    """Memoize a resource method in the provided cache. The resource must
+    implement cache_scopes(), which is called with the same arguments as the
+    method and returns the scopes that the result depends on. The same
+    generations are used to answer conditional requests, and results that
+    depend on changes the database replica may not have are read from the
+    primary."""
+
+    def memoize_decorator(f):
+        @wraps(f)
+        def memoize_wrapper(*args, **kwargs):
+            scopes = f.__self__.cache_scopes(*args, **kwargs)
+            generations, last_modified = get_generations(scopes)
+            key_data = repr((
+                f.__qualname__,
+                args,
+                sorted(kwargs.items()),
+                sorted(request.args.items(multi=True)),
+                generations,
+            ))
+            digest = hashlib.md5(key_data.encode('utf-8')).hexdigest()
+            conditional.set_validators(digest, last_modified)
+
+            cache_key = "{0}_{1}".format(f.__qualname__, digest)
+
+            rv = cache.get(cache_key)
+            if rv is None:
+                # the replica may not have the latest changes yet
+                with replica.fresh_reads(last_modified):
+                    rv = f(*args, **kwargs)
+                cache.set(cache_key, rv, timeout=timeout)
+            return rv
+        return memoize_wrapper
+    return memoize_decorator
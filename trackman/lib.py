@@ -1,43 +1,29 @@
 import base64
+import bisect
 import requests
 import os
+import time
 import urllib.parse
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from flask import current_app
 
-from . import db, redis_conn, mail, playlists_cache, pubsub
-from .models import AirLog, Track, TrackLog, DJ, DJClaimToken, DJSet
+from . import db, autocomplete, dedup, djcharts, invalidation, nowplaying, \
+    onair, playstats, redis_conn, mail, pubsub
+from .models import AirLog, Track, TrackLog, DJ, DJClaimToken, DJSet, \
+    match_key
 
 
-def get_duplicates(model, attrs, ignore_case=False):
-    if ignore_case:
-        model_attrs = [db.func.lower(getattr(model, attr)) for attr in attrs]
-    else:
-        model_attrs = [getattr(model, attr) for attr in attrs]
-
-    dups = model.query.with_entities(
-        *model_attrs).group_by(
-        *model_attrs).having(db.and_(
-            *[db.func.count(attr) > 1 for attr in model_attrs])).all()
-    return dups
-
+FIND_TRACKS_BATCH_SIZE = 500
 
-def renew_dj_lease(expire=None):
-    redis_conn.set('dj_active', 'true')
 
-    if expire is None:
-        # logout/login must delete this dj_timeout
-        expire = redis_conn.get('dj_timeout')
-        if expire is None:
-            expire = current_app.config['DJ_TIMEOUT']
-        expire = int(expire)
-
-    redis_conn.expire('dj_active', expire)
+def renew_dj_lease(expire=None, djset_id=None):
+    # logout/login must reset the dj_timeout
+    return onair.renew_lease(current_app.config['DJ_TIMEOUT'], expire,
+                             djset_id)
 
 
 def logout_all(send_email=False):
-    redis_conn.delete('onair_dj_id')
-    redis_conn.delete('onair_djset_id')
+    onair.end_set()
 
     open_djsets = DJSet.query.\
         filter(DJSet.dtend == None).with_for_update().\
@@ -60,20 +46,22 @@ def logout_all(send_email=False):
         db.session.rollback()
         raise
 
-    playlists_cache.clear()
+    invalidate_djsets(*open_djsets)
+    update_dj_charts(*open_djsets)
     pubsub.publish(
         current_app.config['PUBSUB_PUB_URL_DJ'],
         message={
             'event': "session_end",
         })
-    redis_conn.delete('dj_timeout')
 
 
 def logout_all_except(dj_id):
     """Go through all open DJSets and close any open ones that don't belong to
-    the provided `dj_id`. Note that this method does not commit changes to the
-    database."""
+    the provided `dj_id`. Returns the open DJSet belonging to `dj_id`, if any,
+    and a list of the DJSets that were closed. Note that this method does not
+    commit changes to the database."""
     current_djset = None
+    ended_djsets = []
     open_djsets = DJSet.query.\
         filter(DJSet.dtend == None).with_for_update().\
         order_by(DJSet.dtstart.desc()).all()
@@ -82,7 +70,35 @@ def logout_all_except(dj_id):
             current_djset = djset
         else:
             djset.dtend = datetime.utcnow()
-    return current_djset
+            ended_djsets.append(djset)
+    return current_djset, ended_djsets
+
+
+def update_dj_charts(*djsets):
+    """Count the plays of DJSets that have ended in the chart snapshots of
+    their DJs, unless the snapshots are stale or have not been built yet.
+    This should be called after changes have been committed."""
+    for dj_id in sorted(set(djset.dj_id for djset in djsets
+                            if djset.dtend is not None)):
+        try:
+            djcharts.update(dj_id, rebuild=False)
+        except Exception as exc:
+            # the plays are counted the next time the snapshot is updated
+            current_app.logger.warning(
+                "Trackman: Failed to update chart snapshot of DJ {0}: "
+                "{1}".format(dj_id, exc))
+
+
+def invalidate_djsets(*djsets):
+    """Invalidate cached playlist data for DJSets that have started or ended.
+    This should be called after changes have been committed."""
+    scopes = []
+    for djset in djsets:
+        track_ids = TrackLog.query.with_entities(TrackLog.track_id).\
+            filter(TrackLog.djset_id == djset.id).distinct()
+        scopes.extend(invalidation.djset_scopes(
+            djset, [track_id for track_id, in track_ids]))
+    invalidation.invalidate(*scopes)
 
 
 def perdelta(start, end, td):
@@ -93,17 +109,13 @@ def perdelta(start, end, td):
 
 
 def disable_automation():
-    if is_automation_enabled():
-        automation_set_id = redis_conn.get("onair_djset_id")
-
-        redis_conn.set("automation_enabled", b"false")
-        redis_conn.delete('onair_dj_id')
-        redis_conn.delete('onair_djset_id')
+    was_enabled, automation_set_id = onair.disable_automation()
+    if was_enabled:
         current_app.logger.info("Trackman: Automation disabled")
 
         if automation_set_id is not None:
             automation_set = DJSet.query.with_for_update().get(
-                int(automation_set_id))
+                automation_set_id)
             if automation_set is not None:
                 automation_set.dtend = datetime.utcnow()
                 try:
@@ -111,7 +123,8 @@ def disable_automation():
                 except:
                     db.session.rollback()
                     raise
-                playlists_cache.clear()
+                invalidate_djsets(automation_set)
+                update_dj_charts(automation_set)
 
                 current_app.logger.info(
                     "Trackman: Automation DJSet ID {0} ended".format(
@@ -125,12 +138,12 @@ def disable_automation():
 
 
 def enable_automation():
-    redis_conn.set('automation_enabled', b"true")
+    onair.enable_automation()
     current_app.logger.warning("Trackman: Automation enabled")
 
 
 def is_automation_enabled():
-    return redis_conn.get("automation_enabled") == b"true"
+    return onair.is_automation_enabled()
 
 
 def stream_listeners(url, mounts=None, timeout=5):
@@ -157,6 +170,56 @@ def stream_listeners(url, mounts=None, timeout=5):
         return None
 
 
+def sample_stream_listeners():
+    """Poll Icecast for the current listener count and store it in Redis,
+    along with a time series of previous samples. This is run periodically by
+    the scheduler so that nothing on the request path has to wait on
+    Icecast."""
+    listeners = stream_listeners(current_app.config['ICECAST_URL'],
+                                 current_app.config['ICECAST_MOUNTS'])
+    if listeners is None:
+        return None
+
+    now = time.time()
+    pipe = redis_conn.pipeline()
+    pipe.set('stream_listeners', listeners,
+             ex=int(current_app.config['ICECAST_LISTENERS_MAX_AGE']))
+    pipe.zadd('stream_listeners_history',
+              {"{0:.0f}:{1:d}".format(now, listeners): now})
+    pipe.zremrangebyscore(
+        'stream_listeners_history', '-inf',
+        now - int(current_app.config['ICECAST_LISTENERS_HISTORY']))
+    pipe.execute()
+    return listeners
+
+
+def get_stream_listeners():
+    """Return the most recently sampled listener count, or None if no recent
+    sample is available."""
+    listeners = redis_conn.get('stream_listeners')
+    if listeners is not None:
+        return int(listeners)
+    else:
+        return None
+
+
+def get_stream_listeners_history(start=None):
+    """Return a list of (datetime, listeners) tuples for the stored samples,
+    optionally limited to those taken at or after `start`."""
+    if start is not None:
+        min_score = start.replace(tzinfo=timezone.utc).timestamp()
+    else:
+        min_score = '-inf'
+
+    history = []
+    for entry in redis_conn.zrangebyscore('stream_listeners_history',
+                                          min_score, '+inf'):
+        timestamp, listeners = entry.decode('ascii').split(':', 1)
+        history.append((datetime.utcfromtimestamp(int(timestamp)),
+                        int(listeners)))
+    return history
+
+
 def log_track(track_id, djset_id, request=False, vinyl=False, new=False,
               rotation=None, track=None):
     tracklog = TrackLog(
@@ -166,16 +229,15 @@ def log_track(track_id, djset_id, request=False, vinyl=False, new=False,
         vinyl=vinyl,
         new=new,
         rotation=rotation,
-        listeners=stream_listeners(current_app.config['ICECAST_URL'],
-                                   current_app.config['ICECAST_MOUNTS']))
+        listeners=get_stream_listeners())
 
-    if track is not None:
-        tracklog.artist = track.artist
-        tracklog.title = track.title
-        tracklog.album = track.album
-        tracklog.label = track.label
+    if track is None:
+        track = Track.query.get(track_id)
+    tracklog.set_snapshot(track)
 
     db.session.add(tracklog)
+    db.session.flush()
+    playstats.add_play(tracklog, track)
 
     try:
         db.session.commit()
@@ -183,7 +245,9 @@ def log_track(track_id, djset_id, request=False, vinyl=False, new=False,
         db.session.rollback()
         raise
 
-    playlists_cache.clear()
+    invalidation.invalidate(*invalidation.tracklog_scopes(tracklog))
+    nowplaying.update()
+    autocomplete.count_play(track or tracklog.track)
     pubsub.publish(
         current_app.config['PUBSUB_PUB_URL_ALL'],
         message={
@@ -194,45 +258,89 @@ def log_track(track_id, djset_id, request=False, vinyl=False, new=False,
     return tracklog
 
 
-def serialize_trackinfo(tracklog):
-    if tracklog is not None:
-        data = tracklog.track.serialize()
-        data['listeners'] = tracklog.listeners
-        data['played'] = str(tracklog.played)
+def find_listeners(history, played):
+    """Return the listener count sampled most recently before `played` from
+    the (datetime, listeners) tuples in `history`, or None if there is no
+    recent enough sample."""
+    index = bisect.bisect_right(history, (played, float('inf'))) - 1
+    if index < 0:
+        return None
 
-        if tracklog.djset == None:
-            dj = DJ.query.filter_by(name="Automation").first()
-            data['dj'] = dj.airname
-            data['dj_id'] = 0
-        else:
-            data['dj'] = tracklog.djset.dj.airname
-            if tracklog.djset.dj.visible:
-                data['dj_id'] = tracklog.djset.dj_id
-            else:
-                data['dj_id'] = 0
-    else:
-        data = {
-            'artist': "",
-            'title': "",
-            'album': "",
-            'label': "",
-            'dj': "",
-            'dj_id': 0,
-        }
+    sampled, listeners = history[index]
+    max_age = timedelta(
+        seconds=int(current_app.config['ICECAST_LISTENERS_MAX_AGE']))
+    if played - sampled > max_age:
+        return None
+    return listeners
+
+
+def log_tracks(plays, djset_id):
+    """Log many plays at once, where `plays` is a list of (Track, played)
+    tuples. The TrackLogs are inserted with a single statement, the rollups
+    they affect are recounted, the counters of the DJ and tracks are
+    incremented, and caches are invalidated once for the whole batch. If one
+    of the plays is now the latest, the new current track is published.
+    Returns the number of TrackLogs inserted."""
+    if len(plays) <= 0:
+        return 0
+
+    plays = sorted(plays, key=lambda play: play[1])
+    previous_id = nowplaying.get_current_id()
+    dj_id = DJSet.query.get(djset_id).dj_id
+    history = get_stream_listeners_history(
+        plays[0][1] - timedelta(
+            seconds=int(current_app.config['ICECAST_LISTENERS_MAX_AGE'])))
+
+    db.session.execute(TrackLog.__table__.insert(), [{
+        'track_id': track.id,
+        'djset_id': djset_id,
+        'dj_id': dj_id,
+        'played': played,
+        'request': False,
+        'vinyl': False,
+        'new': False,
+        'listeners': find_listeners(history, played),
+        'title': track.title,
+        'artist': track.artist,
+        'album': track.album,
+        'label': track.label,
+    } for track, played in plays])
+
+    track_ids = set(track.id for track, played in plays)
+    playstats.add_plays([(track.id, played) for track, played in plays],
+                        dj_id)
+
+    try:
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
 
-    data['description'] = current_app.config['STATION_NAME']
-    data['contact'] = current_app.config['STATION_URL']
-    return data
+    invalidation.invalidate(
+        invalidation.NOW_PLAYING,
+        invalidation.djset_scope(djset_id),
+        *[invalidation.track_scope(track_id) for track_id in track_ids])
+    nowplaying.update()
+    autocomplete.count_plays([track for track, played in plays])
 
+    # plays backfilled from before the current track do not change it
+    tracklog = nowplaying.get_current_tracklog()
+    if tracklog.id != previous_id:
+        pubsub.publish(
+            current_app.config['PUBSUB_PUB_URL_ALL'],
+            message={
+                'event': "track_change",
+                'tracklog': tracklog.full_serialize(),
+            })
 
-def get_current_tracklog():
-    return TrackLog.query.order_by(db.desc(TrackLog.id)).first()
+    return len(plays)
 
 
 def fixup_current_track(event="track_edit"):
-    tracklog = get_current_tracklog()
+    tracklog = nowplaying.get_current_tracklog()
 
-    playlists_cache.clear()
+    invalidation.invalidate(*invalidation.tracklog_scopes(tracklog))
+    nowplaying.update()
     pubsub.publish(
         current_app.config['PUBSUB_PUB_URL_ALL'],
         message={
@@ -249,22 +357,29 @@ def merge_duplicate_tracks(*args, **kwargs):
     track_id = int(tracks[0].id)
 
     if len(tracks) > 1:
+        merge_ids = [track.id for track in tracks[1:]]
+        days = playstats.play_days(merge_ids)
+        merged_values = autocomplete.track_values(tracks[1:])
+
         # update TrackLogs
-        TrackLog.query.filter(TrackLog.track_id.in_(
-            [track.id for track in tracks[1:]])).update(
+        TrackLog.query.filter(TrackLog.track_id.in_(merge_ids)).update(
             {TrackLog.track_id: track_id}, synchronize_session=False)
 
         # delete existing Track entries
         for track in tracks[1:]:
             ret = db.session.delete(track)
 
+        playstats.rebuild_days(days)
+        playstats.recount_tracks(Track.id == track_id)
+
         try:
             db.session.commit()
         except:
             db.session.rollback()
             raise
 
-        playlists_cache.clear()
+        invalidation.invalidate_all()
+        autocomplete.remove_unused(merged_values)
 
     return count, track_id
 
@@ -278,11 +393,8 @@ def deduplicate_track_by_id(dedup_id, ignore_case=False):
 
     fields = ['artist', 'title', 'album', 'label']
     if ignore_case:
-        count, track_id = merge_duplicate_tracks(db.and_(*[
-            db.func.lower(getattr(Track, field)) ==
-            db.func.lower(getattr(source_track, field))
-            for field in fields
-        ]))
+        count, track_id = merge_duplicate_tracks(
+            Track.match_key == source_track.match_key)
     else:
         count, track_id = merge_duplicate_tracks(db.and_(*[
             getattr(Track, field) == getattr(source_track, field)
@@ -297,27 +409,46 @@ def deduplicate_track_by_id(dedup_id, ignore_case=False):
             track_id))
 
 
-def deduplicate_all_tracks(ignore_case=False):
-    dups = get_duplicates(Track, ['artist', 'title', 'album', 'label'],
-                          ignore_case=ignore_case)
-    for artist, title, album, label in dups:
-        if ignore_case:
-            count, track_id = merge_duplicate_tracks(db.and_(
-                db.func.lower(Track.artist) == db.func.lower(artist),
-                db.func.lower(Track.title) == db.func.lower(title),
-                db.func.lower(Track.album) == db.func.lower(album),
-                db.func.lower(Track.label) == db.func.lower(label)))
-        else:
-            count, track_id = merge_duplicate_tracks(db.and_(
-                Track.artist == artist,
-                Track.title == title,
-                Track.album == album,
-                Track.label == label))
+def deduplicate_all_tracks(ignore_case=False, dry_run=False):
+    report = dedup.deduplicate_all_tracks(ignore_case=ignore_case,
+                                          dry_run=dry_run)
+    current_app.logger.info(
+        "Trackman: {0} {1:d} duplicate tracks into {2:d} tracks, "
+        "repointing {3:d} TrackLogs and {4:d} TrackReports".format(
+            "Would merge" if dry_run else "Merged",
+            report['tracks'],
+            report['groups'],
+            report['tracklogs'],
+            report['reports']))
+    return report
+
+
+def backfill_tracklog_snapshots(batch_size=5000):
+    """Record the current track information on TrackLogs that were logged
+    before it was recorded with each play, committing after every
+    `batch_size` TrackLogs. Returns the number of TrackLogs updated."""
+    fields = ('title', 'artist', 'album', 'label')
+    values = {
+        getattr(TrackLog, field): db.select([getattr(Track, field)]).
+        where(Track.id == TrackLog.track_id).scalar_subquery()
+        for field in fields
+    }
+
+    count = 0
+    max_id = db.session.query(db.func.max(TrackLog.id)).scalar() or 0
+    for start in range(0, max_id + 1, batch_size):
+        count += TrackLog.query.filter(
+            TrackLog.id >= start,
+            TrackLog.id < start + batch_size,
+            TrackLog.artist == None).update(
+                values, synchronize_session=False)
+        try:
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
 
-        current_app.logger.info(
-            "Trackman: Merged {0:d} duplicates into track ID {1:d}".format(
-                count - 1,
-                track_id))
+    return count
 
 
 def autofill_na_labels():
@@ -329,6 +460,9 @@ def autofill_na_labels():
             Track.album == na_track.album,
             Track.label != "Not Available")).first()
         if other_track is not None:
+            days = playstats.play_days([na_track.id])
+            merged_values = autocomplete.track_values([na_track])
+
             # update TrackLogs to point to other Track
             TrackLog.query.\
                 filter(TrackLog.track_id == na_track.id).\
@@ -336,6 +470,8 @@ def autofill_na_labels():
                        synchronize_session=False)
 
             db.session.delete(na_track)
+            playstats.rebuild_days(days)
+            playstats.recount_tracks(Track.id == other_track.id)
 
             try:
                 db.session.commit()
@@ -343,7 +479,8 @@ def autofill_na_labels():
                 db.session.rollback()
                 raise
 
-            playlists_cache.clear()
+            invalidation.invalidate_all()
+            autocomplete.remove_unused(merged_values)
             current_app.logger.info(
                 "Trackman: Found a track with a label for track ID {0:d}, "
                 "merged into {1:d}".format(na_track.id, other_track.id))
@@ -381,7 +518,7 @@ def prune_empty_djsets():
         db.session.rollback()
         raise
 
-    playlists_cache.clear()
+    invalidation.invalidate_all()
     current_app.logger.debug("Trackman: Removed {} empty DJSets.".format(
         empty.count()))
 
@@ -417,13 +554,13 @@ def cleanup_dj_list():
             db.session.rollback()
             raise
 
+        invalidation.invalidate(invalidation.DJS, invalidation.dj_scope(dj.id))
+
 
 def find_or_add_track(track):
-    match = Track.query.filter(
-        db.func.lower(Track.artist) == db.func.lower(track.artist),
-        db.func.lower(Track.title) == db.func.lower(track.title),
-        db.func.lower(Track.album) == db.func.lower(track.album),
-        db.func.lower(Track.label) == db.func.lower(track.label)).first()
+    track.update_match_keys()
+    match = Track.query.filter(Track.match_key == track.match_key).\
+        order_by(Track.id).first()
     if match is None:
         db.session.add(track)
         try:
@@ -431,21 +568,78 @@ def find_or_add_track(track):
         except:
             db.session.rollback()
             raise
-        playlists_cache.clear()
+
+        autocomplete.add_track(track)
         return track
     else:
         return match
 
 
-def check_onair(djset_id):
-    if djset_id is None:
-        return False
+def find_or_add_tracks(values):
+    """Find or add a Track for each (title, artist, album, label) tuple in
+    `values`. Tracks with a label are matched as in find_or_add_track().
+    Tracks without one are matched on the artist, title and album alone,
+    preferring a match that has a label, and are added with a label of "Not
+    Available". Each kind of match is looked up with a single query, and all
+    new Tracks are added in one commit. Returns a list of the Tracks in the
+    same order as `values`."""
+    keys = []
+    for title, artist, album, label in values:
+        if len(label) > 0:
+            keys.append(('match_key', match_key(artist, title, album, label)))
+        else:
+            keys.append(('partial_match_key',
+                         match_key(artist, title, album)))
+
+    matches = {}
+
+    def is_better_match(column, track, match):
+        if match is None:
+            return True
+        if column == 'partial_match_key':
+            track_na = track.label == "Not Available"
+            if track_na != (match.label == "Not Available"):
+                return not track_na
+        # new tracks do not have an ID yet, and come after existing ones
+        return match.id is not None and track.id is not None and \
+            track.id < match.id
+
+    def add_match(track):
+        for column in ('match_key', 'partial_match_key'):
+            key = (column, getattr(track, column))
+            if is_better_match(column, track, matches.get(key)):
+                matches[key] = track
+
+    for column in ('match_key', 'partial_match_key'):
+        column_keys = sorted(set(key for kind, key in keys if kind == column))
+        for i in range(0, len(column_keys), FIND_TRACKS_BATCH_SIZE):
+            for track in Track.query.filter(getattr(Track, column).in_(
+                    column_keys[i:i + FIND_TRACKS_BATCH_SIZE])).\
+                    order_by(Track.id):
+                add_match(track)
+
+    new_tracks = []
+    for key, (title, artist, album, label) in zip(keys, values):
+        if key not in matches:
+            track = Track(title, artist, album, label or "Not Available")
+            db.session.add(track)
+            new_tracks.append(track)
+            add_match(track)
+
+    if len(new_tracks) > 0:
+        try:
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
 
-    onair_djset_id = redis_conn.get('onair_djset_id')
-    if onair_djset_id is not None:
-        return djset_id == int(onair_djset_id)
-    else:
-        return False
+        autocomplete.update_tracks(new_tracks)
+
+    return [matches[key] for key in keys]
+
+
+def check_onair(djset_id):
+    return onair.is_onair(djset_id)
 
 
 def generate_claim_token():
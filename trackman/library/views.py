@@ -3,7 +3,8 @@ from flask import abort, current_app, flash, render_template, redirect, \
 import string
 import uuid
 
-from trackman import auth_manager, db
+from trackman import auth_manager, autocomplete, db, invalidation, \
+    playstats
 from trackman.models import DJ, Track, TrackLog, TrackReport
 from trackman.lib import deduplicate_track_by_id
 from trackman.musicbrainz import musicbrainzngs
@@ -135,7 +136,10 @@ def artist_musicbrainz():
                     track.album = releasegroup_to_album_name[releasegroup_mbid]
                     track.releasegroup_mbid = releasegroup_mbid
 
+            old_values = autocomplete.edited_values(tracks)
+            playstats.recount_edited_tracks(tracks)
             db.session.commit()
+            autocomplete.update_tracks(tracks, old_values)
 
         return redirect(url_for('trackman_library.artist', artist=artist))
 
@@ -304,12 +308,17 @@ def track(id):
             track.album = album
             track.label = label
 
+            old_values = autocomplete.edited_values([track])
+            playstats.recount_edited_tracks([track])
+
             try:
                 db.session.commit()
             except:
                 db.session.rollback()
                 raise
 
+            autocomplete.update_tracks([track], old_values)
+
             # merge with any tracks that exactly match
             deduplicate_track_by_id(id)
 
@@ -415,12 +424,17 @@ def track_musicbrainz(id):
         else:
             track.releasegroup_mbid = None
 
+        old_values = autocomplete.edited_values([track])
+        playstats.recount_edited_tracks([track])
+
         try:
             db.session.commit()
         except:
             db.session.rollback()
             raise
 
+        autocomplete.update_tracks([track], old_values)
+
         return redirect(url_for('trackman_library.track', id=track.id,
                                 **{'from': edit_from}))
 
@@ -444,6 +458,10 @@ def track_similar(id, page=1):
     if request.method == 'POST':
         merge = [int(x) for x in request.form.getlist('merge[]')]
         if len(merge) > 0:
+            days = playstats.play_days(merge)
+            merged_values = autocomplete.track_values(
+                Track.query.filter(Track.id.in_(merge)))
+
             # update TrackLogs
             TrackLog.query.filter(TrackLog.track_id.in_(merge)).update(
                 {TrackLog.track_id: track.id}, synchronize_session=False)
@@ -461,12 +479,17 @@ def track_similar(id, page=1):
             Track.query.filter(Track.id.in_(merge)).delete(
                 synchronize_session=False)
 
+            playstats.rebuild_days(days)
+            playstats.recount_tracks(Track.id == track.id)
+
             try:
                 db.session.commit()
             except:
                 db.session.rollback()
                 raise
 
+            invalidation.invalidate_all()
+            autocomplete.remove_unused(merged_values)
             current_app.logger.warning(
                 "Trackman: Merged tracks {0} into track {1}".format(
                     ", ".join([str(x) for x in merge]),
@@ -477,11 +500,7 @@ def track_similar(id, page=1):
                                     **{'from': edit_from}))
 
     similar_tracks = Track.query.\
-        filter(db.and_(
-            db.func.lower(Track.artist) == db.func.lower(track.artist),
-            db.func.lower(Track.album) == db.func.lower(track.album),
-            db.func.lower(Track.title) == db.func.lower(track.title)
-        )).\
+        filter(Track.partial_match_key == track.partial_match_key).\
         group_by(Track.id).order_by(Track.artist).\
         paginate(page, current_app.config['ARTISTS_PER_PAGE'])
 
@@ -530,14 +549,18 @@ def bulk_edit():
     form = BulkEditForm(submit=True, **form_defaults)
 
     if form.validate_on_submit():
-        for track_id in track_ids:
-            track = Track.query.get(track_id)
-
+        # load every track first, as a query would flush the changes made to
+        # earlier tracks before they are recounted
+        tracks = [Track.query.get(track_id) for track_id in track_ids]
+        for track in tracks:
             for field in fields_to_set:
                 if len(form[field].data) > 0:
                     setattr(track, field, form[field].data)
 
+        old_values = autocomplete.edited_values(tracks)
+        playstats.recount_edited_tracks(tracks)
         db.session.commit()
+        autocomplete.update_tracks(tracks, old_values)
 
         if form.edit_from.data == "artist":
             return redirect(url_for('trackman_library.artist',
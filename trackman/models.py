@@ -1,8 +1,24 @@
 import datetime
+import hashlib
+import unicodedata
+from sqlalchemy import event
 from sqlalchemy_utils import UUIDType
 from . import db
 
 
+def normalize_match_value(value):
+    """Normalize a track field for matching: apply Unicode compatibility
+    normalization, fold case, and collapse whitespace."""
+    value = unicodedata.normalize('NFKC', value or "")
+    return " ".join(value.casefold().split())
+
+
+def match_key(*values):
+    return hashlib.sha256("\x1f".join(
+        normalize_match_value(value) for value in values).encode('utf-8')).\
+        hexdigest()
+
+
 class DJ(db.Model):
     __tablename__ = "dj"
     id = db.Column(db.Integer, primary_key=True)
@@ -13,6 +29,13 @@ class DJ(db.Model):
     genres = db.Column(db.Unicode(255))
     time_added = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     visible = db.Column(db.Boolean, default=True)
+    # Play counters, maintained by playstats
+    play_count = db.Column(db.Integer, default=0, nullable=False,
+                           index=True)
+    vinyl_play_count = db.Column(db.Integer, default=0, nullable=False,
+                                 index=True)
+    request_play_count = db.Column(db.Integer, default=0, nullable=False,
+                                   index=True)
 
     def __init__(self, airname, name, visible=True):
         self.airname = airname
@@ -140,9 +163,13 @@ class AirLog(db.Model):
 
 class TrackLog(db.Model):
     __tablename__ = "tracklog"
+    __table_args__ = (
+        db.Index('ix_tracklog_played_id', 'played', 'id'),
+        db.Index('ix_tracklog_dj_id_id', 'dj_id', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     # Relationships with the Track
-    track_id = db.Column(db.Integer, db.ForeignKey('track.id'))
+    track_id = db.Column(db.Integer, db.ForeignKey('track.id'), index=True)
     track = db.relationship('Track', backref=db.backref('plays', lazy='dynamic'))
     # When the track was entered (does not count edits)
     played = db.Column(db.DateTime, default=datetime.datetime.utcnow)
@@ -211,11 +238,57 @@ class TrackLog(db.Model):
             'listeners': self.listeners,
         }
 
-    def api_serialize(self, include_djname=False):
+    @classmethod
+    def api_serialize_options(cls, snapshot=False):
+        """Return loader options that eagerly load everything used by
+        api_serialize(), so that serializing a list of TrackLogs takes a
+        single query instead of several per row."""
+        options = (
+            db.joinedload(cls.dj),
+            db.joinedload(cls.rotation),
+            db.joinedload(cls.djset).joinedload(DJSet.dj),
+        )
+        if not snapshot:
+            options = (db.joinedload(cls.track),) + options
+        return options
+
+    def has_snapshot(self):
+        return self.artist is not None
+
+    def snapshot_serialize(self):
+        """Serialize the recorded track information with the same keys as
+        Track.api_serialize(). The snapshot does not record when the track
+        was added or its MusicBrainz IDs, so those are None."""
+        return {
+            'id': self.track_id,
+            'title': self.title,
+            'artist': self.artist,
+            'album': self.album,
+            'label': self.label,
+            'added': None,
+            'artist_mbid': None,
+            'recording_mbid': None,
+            'release_mbid': None,
+            'releasegroup_mbid': None,
+        }
+
+    def set_snapshot(self, track):
+        """Record the track information as it was when it was played."""
+        self.title = track.title
+        self.artist = track.artist
+        self.album = track.album
+        self.label = track.label
+
+    def api_serialize(self, include_djname=False, snapshot=False):
+        if snapshot and self.has_snapshot():
+            track = self.snapshot_serialize()
+        else:
+            track = self.track.api_serialize()
+
         data = {
             'id': self.id,
             'track_id': self.track_id,
-            'track': self.track.api_serialize(),
+            'track': track,
             'played': self.played,
             'djset_id': self.djset_id,
             'dj_id': self.dj_id,
@@ -253,12 +326,29 @@ class Track(db.Model):
     recording_mbid = db.Column(UUIDType())
     release_mbid = db.Column(UUIDType())
     releasegroup_mbid = db.Column(UUIDType())
+    # Hashes of the normalized artist, title, album, and label (or just the
+    # artist, title, and album for the partial key), used to find matching
+    # tracks
+    match_key = db.Column(db.String(64), index=True)
+    partial_match_key = db.Column(db.String(64), index=True)
+    # Play counters, maintained by playstats
+    play_count = db.Column(db.Integer, default=0, nullable=False,
+                           index=True)
+    first_played = db.Column(db.DateTime)
+    last_played = db.Column(db.DateTime, index=True)
 
     def __init__(self, title, artist, album, label):
         self.title = title
         self.artist = artist
         self.album = album
         self.label = label
+        self.update_match_keys()
+
+    def update_match_keys(self):
+        self.match_key = match_key(
+            self.artist, self.title, self.album, self.label)
+        self.partial_match_key = match_key(
+            self.artist, self.title, self.album)
 
     def serialize(self):
         return {
@@ -289,6 +379,27 @@ class Track(db.Model):
         }
 
 
+@event.listens_for(Track, 'before_insert')
+@event.listens_for(Track, 'before_update')
+def update_track_match_keys(mapper, connection, track):
+    track.update_match_keys()
+
+
+# trigram indexes for track search are only available with PostgreSQL
+event.listen(
+    Track.__table__,
+    'before_create',
+    db.DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(
+        dialect='postgresql'))
+for field in ('artist', 'title', 'album', 'label'):
+    event.listen(
+        Track.__table__,
+        'after_create',
+        db.DDL("CREATE INDEX ix_track_{0}_trgm ON track USING gin "
+               "({0} gin_trgm_ops)".format(field)).execute_if(
+                   dialect='postgresql'))
+
+
 class TrackReport(db.Model):
     __tablename__ = "trackreport"
     id = db.Column(db.Integer, primary_key=True)
@@ -306,3 +417,85 @@ class TrackReport(db.Model):
         self.track_id = track_id
         self.dj_id = dj_id
         self.reason = reason
+
+
+class ArtistDailyPlays(db.Model):
+    __tablename__ = "artist_daily_plays"
+    day = db.Column(db.Date, primary_key=True)
+    artist_key = db.Column(db.Unicode(255).with_variant(db.Unicode, 'postgresql'), primary_key=True)
+    artist = db.Column(db.Unicode(255).with_variant(db.Unicode, 'postgresql'))
+    plays = db.Column(db.Integer, nullable=False, default=0)
+
+
+class AlbumDailyPlays(db.Model):
+    __tablename__ = "album_daily_plays"
+    day = db.Column(db.Date, primary_key=True)
+    artist_key = db.Column(db.Unicode(255).with_variant(db.Unicode, 'postgresql'), primary_key=True)
+    album_key = db.Column(db.Unicode(255).with_variant(db.Unicode, 'postgresql'), primary_key=True)
+    artist = db.Column(db.Unicode(255).with_variant(db.Unicode, 'postgresql'))
+    album = db.Column(db.Unicode(255).with_variant(db.Unicode, 'postgresql'))
+    plays = db.Column(db.Integer, nullable=False, default=0)
+
+
+class TrackDailyPlays(db.Model):
+    __tablename__ = "track_daily_plays"
+    day = db.Column(db.Date, primary_key=True)
+    track_id = db.Column(db.Integer, db.ForeignKey('track.id', ondelete='CASCADE'), primary_key=True)
+    plays = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DJDailyPlays(db.Model):
+    __tablename__ = "dj_daily_plays"
+    day = db.Column(db.Date, primary_key=True)
+    dj_id = db.Column(db.Integer, db.ForeignKey('dj.id', ondelete='CASCADE'), primary_key=True)
+    plays = db.Column(db.Integer, nullable=False, default=0)
+    vinyl_plays = db.Column(db.Integer, nullable=False, default=0)
+    request_plays = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DJChartSnapshot(db.Model):
+    __tablename__ = "dj_chart_snapshot"
+    dj_id = db.Column(db.Integer, db.ForeignKey('dj.id', ondelete='CASCADE'), primary_key=True)
+    # ID of the last TrackLog counted in the snapshot
+    last_tracklog_id = db.Column(db.Integer, nullable=False, default=0)
+    stale = db.Column(db.Boolean, nullable=False, default=True, index=True)
+    updated = db.Column(db.DateTime)
+
+    def __init__(self, dj_id):
+        self.dj_id = dj_id
+        self.last_tracklog_id = 0
+        self.stale = True
+
+
+class DJArtistPlays(db.Model):
+    __tablename__ = "dj_artist_plays"
+    __table_args__ = (
+        db.Index('ix_dj_artist_plays_dj_id_plays', 'dj_id', 'plays'),
+    )
+    dj_id = db.Column(db.Integer, db.ForeignKey('dj.id', ondelete='CASCADE'), primary_key=True)
+    artist_key = db.Column(db.Unicode(255).with_variant(db.Unicode, 'postgresql'), primary_key=True)
+    artist = db.Column(db.Unicode(255).with_variant(db.Unicode, 'postgresql'))
+    plays = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DJAlbumPlays(db.Model):
+    __tablename__ = "dj_album_plays"
+    __table_args__ = (
+        db.Index('ix_dj_album_plays_dj_id_plays', 'dj_id', 'plays'),
+    )
+    dj_id = db.Column(db.Integer, db.ForeignKey('dj.id', ondelete='CASCADE'), primary_key=True)
+    artist_key = db.Column(db.Unicode(255).with_variant(db.Unicode, 'postgresql'), primary_key=True)
+    album_key = db.Column(db.Unicode(255).with_variant(db.Unicode, 'postgresql'), primary_key=True)
+    artist = db.Column(db.Unicode(255).with_variant(db.Unicode, 'postgresql'))
+    album = db.Column(db.Unicode(255).with_variant(db.Unicode, 'postgresql'))
+    plays = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DJTrackPlays(db.Model):
+    __tablename__ = "dj_track_plays"
+    __table_args__ = (
+        db.Index('ix_dj_track_plays_dj_id_plays', 'dj_id', 'plays'),
+    )
+    dj_id = db.Column(db.Integer, db.ForeignKey('dj.id', ondelete='CASCADE'), primary_key=True)
+    track_id = db.Column(db.Integer, db.ForeignKey('track.id', ondelete='CASCADE'), primary_key=True)
+    plays = db.Column(db.Integer, nullable=False, default=0)
@@ -0,0 +1,165 @@
+"""The now-playing document, rendered once in each output format.
+
+What is now playing is polled far more often than anything else, by the
+website, stream metadata scrapers and RDS encoders. Rather than querying the
+latest TrackLog on each request, every format is rendered when a track is
+logged or the current track changes and stored in a Redis hash, along with
+the generations of the now-playing cache scope that it was rendered at. The
+endpoints serve the stored document as is, and only render it from the
+database if it is missing or the scope has been invalidated since.
+"""
+
+from flask import current_app, json
+import re
+from . import conditional, db, invalidation, redis_conn, replica
+from .models import TrackLog
+
+DOCUMENT_KEY = "trackman_now_playing"
+SCOPES = [invalidation.NOW_PLAYING]
+
+naughty_word_re = re.compile(
+    r'shit|piss|fuck|cunt|cocksucker|tits|twat|asshole',
+    re.IGNORECASE)
+
+
+def latest_first(query):
+    """Order a query for TrackLogs by when they were played, latest first.
+    Plays backfilled after an outage have the newest IDs, so the ID alone
+    does not tell which play is current."""
+    return query.filter(TrackLog.played != None).\
+        order_by(db.desc(TrackLog.played), db.desc(TrackLog.id))
+
+
+def get_current_tracklog():
+    return latest_first(TrackLog.query).first()
+
+
+def get_current_id():
+    current = latest_first(TrackLog.query.with_entities(TrackLog.id)).first()
+    if current is not None:
+        return current[0]
+    else:
+        return None
+
+
+def serialize_trackinfo(tracklog):
+    if tracklog is not None:
+        data = tracklog.track.serialize()
+        data['listeners'] = tracklog.listeners
+        data['played'] = str(tracklog.played)
+
+        if tracklog.djset is None:
+            # plays without a DJSet are recorded as Automation's
+            data['dj'] = tracklog.dj.airname
+            data['dj_id'] = 0
+        else:
+            data['dj'] = tracklog.djset.dj.airname
+            if tracklog.djset.dj.visible:
+                data['dj_id'] = tracklog.djset.dj_id
+            else:
+                data['dj_id'] = 0
+    else:
+        data = {
+            'artist': "",
+            'title': "",
+            'album': "",
+            'label': "",
+            'dj': "",
+            'dj_id': 0,
+        }
+
+    data['description'] = current_app.config['STATION_NAME']
+    data['contact'] = current_app.config['STATION_URL']
+    return data
+
+
+def render_json(tracklog, trackinfo):
+    if tracklog is None:
+        return json.dumps(None)
+    return json.dumps(tracklog.api_serialize(
+        snapshot=current_app.config['TRACKLOG_SNAPSHOT_READS']))
+
+
+def render_trackinfo(tracklog, trackinfo):
+    return json.dumps(trackinfo)
+
+
+def render_latest_track(tracklog, trackinfo):
+    return "{artist} - {title}".format(**trackinfo)
+
+
+def render_latest_track_clean(tracklog, trackinfo):
+    clean = {k: naughty_word_re.sub('****', v) if isinstance(v, str) else v
+             for k, v in trackinfo.items()}
+    return "{artist} - {title} [DJ: {dj}]".format(**clean)
+
+
+def render_latest_track_stream(tracklog, trackinfo):
+    return """\
+title={title}
+artist={artist}
+album={album}
+description={description}
+contact={contact}
+""".format(**trackinfo)
+
+
+FORMATS = {
+    'json': render_json,
+    'trackinfo': render_trackinfo,
+    'latest_track': render_latest_track,
+    'latest_track_clean': render_latest_track_clean,
+    'latest_track_stream': render_latest_track_stream,
+}
+
+
+def format_generations(generations):
+    return ",".join(str(generation) for generation in generations)
+
+
+def update(generations=None):
+    """Render the now-playing document in every format and store it. The
+    generations must be read before the latest TrackLog is, so that a
+    document is never stored as newer than the data it was rendered from.
+    Returns a dictionary of the rendered formats."""
+    if generations is None:
+        generations = invalidation.get_generations(SCOPES)[0]
+
+    # the replica may not have the track that was just logged
+    with replica.primary_reads():
+        tracklog = latest_first(TrackLog.query.options(
+            *TrackLog.api_serialize_options())).first()
+        trackinfo = serialize_trackinfo(tracklog)
+        documents = {name: render(tracklog, trackinfo)
+                     for name, render in FORMATS.items()}
+
+    redis_conn.hset(DOCUMENT_KEY, mapping=dict(
+        documents, generation=format_generations(generations)))
+    return documents
+
+
+def get(name):
+    """Return the now-playing document in the named format, rendering it
+    first if the stored document is missing or out of date. In a request,
+    aborts with 304 Not Modified if the client already has the document."""
+    if name not in FORMATS:
+        raise ValueError("Unknown format: {}".format(name))
+
+    pipe = redis_conn.pipeline(transaction=False)
+    pipe.hmget(DOCUMENT_KEY, 'generation', name)
+    invalidation.read_generations(pipe, SCOPES)
+    (generation, document), values, times = pipe.execute()
+    generations, last_modified = invalidation.parse_generations(values, times)
+    conditional.set_validators(
+        conditional.make_etag(DOCUMENT_KEY, name, generations), last_modified)
+
+    if document is not None and generation is not None and \
+            generation.decode('ascii') == format_generations(generations):
+        return document.decode('utf-8')
+
+    return update(generations)[name]
+
+
+def get_json():
+    """Return the now-playing document in the API format, decoded."""
+    return json.loads(get('json'))
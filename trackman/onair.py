@@ -0,0 +1,204 @@
+"""On-air state shared between workers.
+
+The DJ and DJSet that are currently on air, whether automation is enabled and
+the DJ's custom activity timeout are stored as fields of a single Redis hash.
+All reads and updates are done with Lua scripts, so that each one takes a
+single round trip and is applied atomically. Whether a DJ has been active
+recently is tracked with a separate key, since it needs to expire.
+
+Older versions stored each of these in its own key; the scripts move any such
+keys into the hash the first time they run.
+"""
+
+from . import redis_conn
+
+STATE_KEY = "onair_state"
+LEASE_KEY = "dj_active"
+FIELDS = ('dj_id', 'djset_id', 'automation_enabled', 'dj_timeout')
+LEGACY_KEYS = ('onair_dj_id', 'onair_djset_id', 'automation_enabled',
+               'dj_timeout')
+KEYS = (STATE_KEY, LEASE_KEY) + LEGACY_KEYS
+
+# Run before each script to move the legacy keys into the hash; KEYS[3] to
+# KEYS[6] are the legacy keys for each of the fields, in order
+prelude = """
+local unpack = unpack or table.unpack
+local state_key = KEYS[1]
+local lease_key = KEYS[2]
+local fields = {'dj_id', 'djset_id', 'automation_enabled', 'dj_timeout'}
+
+if redis.call('EXISTS', state_key) == 0 then
+    for i, field in ipairs(fields) do
+        local value = redis.call('GET', KEYS[i + 2])
+        if value then
+            redis.call('HSET', state_key, field, value)
+        end
+    end
+    redis.call('DEL', KEYS[3], KEYS[4], KEYS[5], KEYS[6])
+end
+"""
+
+
+def register(body):
+    return redis_conn.register_script(prelude + body)
+
+
+get_state_script = register("""
+local values = redis.call('HMGET', state_key, unpack(fields))
+values[#fields + 1] = redis.call('EXISTS', lease_key)
+return values
+""")
+
+get_field_script = register("""
+return redis.call('HGET', state_key, ARGV[1])
+""")
+
+set_field_script = register("""
+if ARGV[2] == '' then
+    redis.call('HDEL', state_key, ARGV[1])
+else
+    redis.call('HSET', state_key, ARGV[1], ARGV[2])
+end
+""")
+
+# ARGV: dj_id, djset_id, whether automation must still be enabled
+start_set_script = register("""
+if ARGV[3] == '1' and
+        redis.call('HGET', state_key, 'automation_enabled') ~= 'true' then
+    return 0
+end
+redis.call('HSET', state_key, 'dj_id', ARGV[1], 'djset_id', ARGV[2])
+return 1
+""")
+
+# ARGV: djset_id (or an empty string for all sets), lease expiration
+end_set_script = register("""
+if ARGV[1] == '' or
+        redis.call('HGET', state_key, 'djset_id') == ARGV[1] then
+    redis.call('HDEL', state_key, 'dj_id', 'djset_id')
+end
+redis.call('HDEL', state_key, 'dj_timeout')
+if ARGV[2] ~= '' then
+    redis.call('SET', lease_key, 'false', 'EX', ARGV[2])
+end
+""")
+
+disable_automation_script = register("""
+if redis.call('HGET', state_key, 'automation_enabled') ~= 'true' then
+    return {0}
+end
+local djset_id = redis.call('HGET', state_key, 'djset_id')
+redis.call('HSET', state_key, 'automation_enabled', 'false')
+redis.call('HDEL', state_key, 'dj_id', 'djset_id')
+return {1, djset_id}
+""")
+
+# ARGV: expiration (or an empty string to use the DJ's timeout), default
+# expiration, and a djset_id that must be on air (or an empty string)
+renew_lease_script = register("""
+if ARGV[3] ~= '' and
+        redis.call('HGET', state_key, 'djset_id') ~= ARGV[3] then
+    return 0
+end
+local expire = ARGV[1]
+if expire == '' then
+    expire = redis.call('HGET', state_key, 'dj_timeout') or ARGV[2]
+end
+redis.call('SET', lease_key, 'true', 'EX', expire)
+return 1
+""")
+
+
+def run(script, *args):
+    return script(keys=KEYS,
+                  args=['' if arg is None else arg for arg in args])
+
+
+def to_int(value):
+    if value is None:
+        return None
+    return int(value)
+
+
+def to_bool(value):
+    if value is None:
+        return None
+    return value == b"true"
+
+
+class OnAirState(object):
+    def __init__(self, dj_id, djset_id, automation_enabled, dj_timeout,
+                 dj_active):
+        self.dj_id = to_int(dj_id)
+        self.djset_id = to_int(djset_id)
+        # None if the state is unknown
+        self.automation_enabled = to_bool(automation_enabled)
+        self.dj_timeout = to_int(dj_timeout)
+        # False if the DJ activity lease has expired
+        self.dj_active = dj_active > 0
+
+    def is_onair(self, djset_id):
+        return djset_id is not None and djset_id == self.djset_id
+
+
+def get_state():
+    return OnAirState(*run(get_state_script))
+
+
+def is_onair(djset_id):
+    if djset_id is None:
+        return False
+    return to_int(run(get_field_script, 'djset_id')) == djset_id
+
+
+def is_automation_enabled():
+    return run(get_field_script, 'automation_enabled') == b"true"
+
+
+def get_dj_timeout():
+    return to_int(run(get_field_script, 'dj_timeout'))
+
+
+def set_dj_timeout(timeout):
+    """Set the activity timeout for the DJ that is on air, or reset it to the
+    default if `timeout` is None."""
+    run(set_field_script, 'dj_timeout', timeout)
+
+
+def start_set(dj_id, djset_id):
+    run(start_set_script, dj_id, djset_id, 0)
+
+
+def start_automation_set(dj_id, djset_id):
+    """Put a DJSet started by automation on air. Returns False without
+    changing anything if automation has been disabled in the meantime."""
+    return run(start_set_script, dj_id, djset_id, 1) == 1
+
+
+def end_set(djset_id=None, lease_expire=None):
+    """Take `djset_id` off the air if it is on air, or whichever DJSet is on
+    air if it is None, and reset the DJ activity timeout. If `lease_expire`
+    is provided, the DJ activity lease is replaced with one that expires in
+    that many seconds."""
+    run(end_set_script, djset_id, lease_expire)
+
+
+def enable_automation():
+    run(set_field_script, 'automation_enabled', "true")
+
+
+def disable_automation():
+    """Disable automation and take its DJSet off the air. Returns a tuple of
+    whether automation was enabled and the ID of the DJSet that was on air."""
+    result = run(disable_automation_script)
+    if result[0] == 1:
+        return True, to_int(result[1])
+    else:
+        return False, None
+
+
+def renew_lease(default_expire, expire=None, djset_id=None):
+    """Mark the DJ as active for `expire` seconds, or the DJ's custom timeout
+    if set, or `default_expire`. If `djset_id` is provided, the lease is only
+    renewed if that DJSet is on air. Returns whether the lease was renewed."""
+    return run(renew_lease_script, expire, default_expire, djset_id) == 1
@@ -0,0 +1,101 @@
+"""Keyset pagination for long lists of plays and DJSets.
+
+Results are ordered by a unique combination of columns, such as
+(played, id), and each page starts after the last row of the previous page
+rather than at an offset, so every page costs the same to fetch no matter how
+far into the results it is. The position is handed to clients as an opaque
+cursor.
+"""
+
+import base64
+import datetime
+import dateutil.parser
+import json
+from . import db
+
+DEFAULT_LIMIT = 300
+MAX_LIMIT = 1000
+
+
+def encode_cursor(values):
+    data = [value.isoformat() if isinstance(value, datetime.datetime)
+            else value for value in values]
+    return base64.urlsafe_b64encode(
+        json.dumps(data, separators=(',', ':')).encode('utf-8')).\
+        decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, columns):
+    """Decode a cursor for the provided columns. Raises ValueError if the
+    cursor is not valid."""
+    try:
+        data = json.loads(base64.urlsafe_b64decode(
+            cursor + '=' * (-len(cursor) % 4)).decode('utf-8'))
+    except (TypeError, ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+    if not isinstance(data, list) or len(data) != len(columns):
+        raise ValueError("Invalid cursor")
+
+    values = []
+    for column, value in zip(columns, data):
+        if isinstance(column.type, db.DateTime):
+            try:
+                value = dateutil.parser.isoparse(value)
+            except (TypeError, ValueError):
+                raise ValueError("Invalid cursor")
+        elif not isinstance(value, int):
+            raise ValueError("Invalid cursor")
+        values.append(value)
+    return values
+
+
+def after(columns, values, descending=False):
+    """Return a filter for the rows that come after `values` in the order
+    given by `columns`."""
+    column, value = columns[0], values[0]
+    if descending:
+        condition = column < value
+    else:
+        condition = column > value
+
+    if len(columns) > 1:
+        condition = db.or_(condition, db.and_(
+            column == value, after(columns[1:], values[1:], descending)))
+    return condition
+
+
+def parse_limit(limit):
+    if limit is None:
+        return DEFAULT_LIMIT
+
+    limit = int(limit)
+    if limit <= 0:
+        raise ValueError("Invalid limit")
+    return min(limit, MAX_LIMIT)
+
+
+def paginate(query, columns, cursor=None, limit=None, descending=False):
+    """Return a page of results for `query`, ordered by `columns`, which must
+    uniquely identify each row, and the cursor for the next page, or None if
+    this is the last page. Raises ValueError if the cursor or limit is not
+    valid."""
+    limit = parse_limit(limit)
+    if cursor is not None:
+        query = query.filter(
+            after(columns, decode_cursor(cursor, columns), descending))
+
+    if descending:
+        query = query.order_by(*[db.desc(column) for column in columns])
+    else:
+        query = query.order_by(*columns)
+
+    results = query.limit(limit + 1).all()
+    if len(results) > limit:
+        results = results[:limit]
+        next_cursor = encode_cursor(
+            [getattr(results[-1], column.key) for column in columns])
+    else:
+        next_cursor = None
+
+    return results, next_cursor
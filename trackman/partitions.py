@@ -0,0 +1,164 @@
+"""Monthly partitions of the tracklog table on PostgreSQL.
+
+If TRACKLOG_PARTITIONING is enabled when the database is upgraded, tracklog
+is converted to a table partitioned by range of the played time, with one
+partition per month named tracklog_YYYY_MM and a default partition for plays
+outside of them. Queries are unchanged, and PostgreSQL only scans the
+partitions that a range of played times can fall in. Since the partition key
+must be part of the primary key, it is (id, played) in the database; IDs are
+still unique, as they come from a single sequence.
+
+The scheduler creates partitions for the next TRACKLOG_PARTITIONS_AHEAD
+months. If TRACKLOG_ARCHIVE_YEARS is set, partitions that ended more than
+that many years ago are detached and moved to the archive schema, where they
+are kept as ordinary tables. Archived plays no longer appear in playlists,
+but remain counted in the daily chart rollups; rebuilding the rollups or a
+DJ's chart snapshot afterwards does not count them.
+
+The foreign keys of archived tables are dropped, so that tracks, sets and
+DJs they refer to can still be merged or deleted. Archived plays are not
+updated when that happens and may refer to rows that no longer exist, but
+they keep the title, artist, album and label of the track that was played.
+"""
+
+from flask import current_app
+import datetime
+import dateutil.relativedelta
+import re
+from . import db
+
+ARCHIVE_SCHEMA = "archive"
+DEFAULT_PARTITION = "tracklog_default"
+partition_re = re.compile(r'^tracklog_(\d{4})_(\d{2})$')
+
+
+def partition_name(month):
+    return "tracklog_{0:%Y_%m}".format(month)
+
+
+def month_start(value):
+    return datetime.datetime(value.year, value.month, 1)
+
+
+def next_month(month):
+    return month + dateutil.relativedelta.relativedelta(months=1)
+
+
+def is_partitioned():
+    if db.engine.dialect.name != 'postgresql':
+        return False
+
+    return db.session.execute(db.text(
+        "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table "
+        "WHERE partrelid = to_regclass('tracklog'))")).scalar()
+
+
+def get_partitions():
+    """Return a dictionary mapping the first day of each month that has a
+    partition to the name of the partition."""
+    partitions = {}
+    for name, in db.session.execute(db.text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = to_regclass('tracklog')")):
+        m = partition_re.match(name)
+        if m is not None:
+            month = datetime.datetime(int(m.group(1)), int(m.group(2)), 1)
+            partitions[month] = name
+    return partitions
+
+
+def create_partition(month):
+    """Create the partition for a month. Any plays in the month that were
+    stored in the default partition are moved to it before it is attached,
+    as attaching it would fail otherwise. Note that this method does not
+    commit changes to the database."""
+    name = partition_name(month)
+    params = {'start': month, 'end': next_month(month)}
+
+    db.session.execute(db.text(
+        "CREATE TABLE {0} (LIKE tracklog INCLUDING DEFAULTS "
+        "INCLUDING CONSTRAINTS)".format(name)))
+    db.session.execute(db.text(
+        "WITH moved AS (DELETE FROM {0} WHERE played >= :start "
+        "AND played < :end RETURNING *) "
+        "INSERT INTO {1} SELECT * FROM moved".format(
+            DEFAULT_PARTITION, name)), params)
+    # bounds are formatted into the statement, as DDL takes no parameters
+    db.session.execute(db.text(
+        "ALTER TABLE tracklog ATTACH PARTITION {0} FOR VALUES "
+        "FROM ('{1:%Y-%m-%d}') TO ('{2:%Y-%m-%d}')".format(
+            name, params['start'], params['end'])))
+
+
+def archive_partition(name):
+    """Detach a partition, drop its foreign keys and move it to the archive
+    schema. Note that this method does not commit changes to the
+    database."""
+    db.session.execute(db.text(
+        "CREATE SCHEMA IF NOT EXISTS {0}".format(ARCHIVE_SCHEMA)))
+    db.session.execute(db.text(
+        "ALTER TABLE tracklog DETACH PARTITION {0}".format(name)))
+
+    foreign_keys = db.session.execute(db.text(
+        "SELECT conname FROM pg_constraint "
+        "WHERE conrelid = to_regclass(:name) AND contype = 'f'"),
+        {'name': name}).fetchall()
+    for constraint, in foreign_keys:
+        db.session.execute(db.text(
+            'ALTER TABLE {0} DROP CONSTRAINT "{1}"'.format(name, constraint)))
+
+    db.session.execute(db.text(
+        "ALTER TABLE {0} SET SCHEMA {1}".format(name, ARCHIVE_SCHEMA)))
+
+
+def maintain(now=None):
+    """Create the partitions for the current and upcoming months, and archive
+    partitions older than TRACKLOG_ARCHIVE_YEARS if it is set, committing
+    after each. Returns lists of the names of the partitions that were
+    created and archived. Does nothing if tracklog is not partitioned."""
+    created = []
+    archived = []
+    if not is_partitioned():
+        return created, archived
+
+    if now is None:
+        now = datetime.datetime.utcnow()
+    partitions = get_partitions()
+
+    month = month_start(now)
+    for i in range(current_app.config['TRACKLOG_PARTITIONS_AHEAD'] + 1):
+        if month not in partitions:
+            create_partition(month)
+            try:
+                db.session.commit()
+            except:
+                db.session.rollback()
+                raise
+            created.append(partition_name(month))
+        month = next_month(month)
+
+    archive_years = current_app.config['TRACKLOG_ARCHIVE_YEARS']
+    if archive_years is not None:
+        cutoff = now - dateutil.relativedelta.relativedelta(
+            years=archive_years)
+        for month, name in sorted(partitions.items()):
+            if next_month(month) > cutoff:
+                break
+
+            archive_partition(name)
+            try:
+                db.session.commit()
+            except:
+                db.session.rollback()
+                raise
+            archived.append(name)
+
+    for name in created:
+        current_app.logger.info(
+            "Trackman: Created tracklog partition {0}".format(name))
+    for name in archived:
+        current_app.logger.info(
+            "Trackman: Archived tracklog partition {0}".format(name))
+
+    return created, archived
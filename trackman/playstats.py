@@ -0,0 +1,427 @@
+"""Daily play rollups used to build charts, and play counters.
+
+Plays are counted for each day (in UTC) per normalized artist, album and
+track, and per DJ. The rollups are updated as tracks are logged, edited and
+deleted, so a chart for any period can be summed from the daily rows instead
+of aggregating every play in the period. As with the charts themselves,
+plays by automation are not counted towards artists, albums or tracks.
+
+The total number of plays and the first and last play of each Track, and the
+total, vinyl and request plays of each DJ, are kept up to date in the same
+way, including plays by automation.
+
+The chart snapshots of DJs are kept separately by djcharts, and are only
+marked as stale here when plays they have already counted change.
+"""
+
+import collections
+import datetime
+import sqlalchemy.exc
+from . import db
+from .models import AlbumDailyPlays, ArtistDailyPlays, DJ, DJChartSnapshot, \
+    DJDailyPlays, Track, TrackDailyPlays, TrackLog
+
+ROLLUP_MODELS = (ArtistDailyPlays, AlbumDailyPlays, TrackDailyPlays,
+                 DJDailyPlays)
+
+
+def normalize(value):
+    return (value or "").lower()
+
+
+def day_bounds(day):
+    start = datetime.datetime.combine(day, datetime.time())
+    return start, start + datetime.timedelta(days=1)
+
+
+def play_rows(day, dj_id, track_id, artist, album, vinyl, request):
+    """Return the (model, keys, display values, counts) of each rollup row
+    that a single play is counted in."""
+    rows = [
+        (DJDailyPlays, {'day': day, 'dj_id': dj_id}, {}, {
+            'plays': 1,
+            'vinyl_plays': int(bool(vinyl)),
+            'request_plays': int(bool(request)),
+        }),
+    ]
+
+    if dj_id > 1:
+        rows.extend([
+            (ArtistDailyPlays,
+             {'day': day, 'artist_key': normalize(artist)},
+             {'artist': artist},
+             {'plays': 1}),
+            (AlbumDailyPlays,
+             {'day': day, 'artist_key': normalize(artist),
+              'album_key': normalize(album)},
+             {'artist': artist, 'album': album},
+             {'plays': 1}),
+            (TrackDailyPlays,
+             {'day': day, 'track_id': track_id},
+             {},
+             {'plays': 1}),
+        ])
+
+    return rows
+
+
+def update_row(model, keys, values, counts, sign):
+    query = model.query.filter_by(**keys)
+
+    updates = {}
+    for name, count in counts.items():
+        column = getattr(model, name)
+        updates[column] = column + sign * count
+    if sign > 0:
+        # keep the lowest display value, as min() would when aggregating
+        for name, value in values.items():
+            if value is not None:
+                column = getattr(model, name)
+                updates[column] = db.case([(column > value, value)],
+                                          else_=column)
+
+    if query.update(updates, synchronize_session=False) > 0:
+        if sign < 0:
+            query.filter(model.plays <= 0).delete(synchronize_session=False)
+        return
+
+    if sign > 0:
+        try:
+            with db.session.begin_nested():
+                db.session.add(model(**keys, **values, **counts))
+        except sqlalchemy.exc.IntegrityError:
+            # the row was added by a concurrent transaction
+            query.update(updates, synchronize_session=False)
+
+
+def play_info(tracklog, track=None):
+    """Return the details of a TrackLog that it is counted by in the rollups,
+    using the provided Track instead of the TrackLog's own if given."""
+    if track is None:
+        track = tracklog.track
+    return (tracklog.played, tracklog.dj_id, track.id, track.artist,
+            track.album, tracklog.vinyl, tracklog.request)
+
+
+def track_counter_values():
+    plays = db.select([db.func.count(TrackLog.id)]).\
+        where(TrackLog.track_id == Track.id).scalar_subquery()
+    first_played = db.select([db.func.min(TrackLog.played)]).\
+        where(TrackLog.track_id == Track.id).scalar_subquery()
+    last_played = db.select([db.func.max(TrackLog.played)]).\
+        where(TrackLog.track_id == Track.id).scalar_subquery()
+    return {
+        Track.play_count: plays,
+        Track.first_played: first_played,
+        Track.last_played: last_played,
+    }
+
+
+def dj_counter_values():
+    def count(*criteria):
+        return db.select([db.func.count(TrackLog.id)]).\
+            where(TrackLog.dj_id == DJ.id).where(*criteria).\
+            scalar_subquery()
+
+    return {
+        DJ.play_count: count(),
+        DJ.vinyl_play_count: count(TrackLog.vinyl == True),
+        DJ.request_play_count: count(TrackLog.request == True),
+    }
+
+
+def recount_tracks(*criteria):
+    """Recount the play counters of the tracks matching `criteria` from the
+    logged tracks. Note that this method does not commit changes to the
+    database."""
+    return Track.query.filter(*criteria).update(
+        track_counter_values(), synchronize_session=False)
+
+
+def recount_djs(*criteria):
+    """Recount the play counters of the DJs matching `criteria` from the
+    logged tracks. Note that this method does not commit changes to the
+    database."""
+    return DJ.query.filter(*criteria).update(
+        dj_counter_values(), synchronize_session=False)
+
+
+def mark_dj_charts_stale(*criteria):
+    """Mark the chart snapshots of the DJs matching the provided criteria as
+    stale so that they are rebuilt. Note that this method does not commit
+    changes to the database."""
+    return DJChartSnapshot.query.filter(*criteria).update(
+        {DJChartSnapshot.stale: True}, synchronize_session=False)
+
+
+def mark_play_stale(tracklog, play):
+    # plays logged since a snapshot was last updated have not been counted
+    # in it yet, so changing them does not make it stale
+    mark_dj_charts_stale(DJChartSnapshot.dj_id == play[1],
+                         DJChartSnapshot.last_tracklog_id >= tracklog.id)
+
+
+def update_dj_counters(play, sign):
+    played, dj_id, track_id, artist, album, vinyl, request = play
+
+    DJ.query.filter(DJ.id == dj_id).update({
+        DJ.play_count: DJ.play_count + sign,
+        DJ.vinyl_play_count:
+            DJ.vinyl_play_count + sign * int(bool(vinyl)),
+        DJ.request_play_count:
+            DJ.request_play_count + sign * int(bool(request)),
+    }, synchronize_session=False)
+
+
+def increment_track_counters(track_id, count, first_played, last_played):
+    Track.query.filter(Track.id == track_id).update({
+        Track.play_count: Track.play_count + count,
+        Track.first_played: db.case(
+            [(db.or_(Track.first_played == None,
+                     Track.first_played > first_played), first_played)],
+            else_=Track.first_played),
+        Track.last_played: db.case(
+            [(db.or_(Track.last_played == None,
+                     Track.last_played < last_played), last_played)],
+            else_=Track.last_played),
+    }, synchronize_session=False)
+
+
+def update_track_counters(play, sign):
+    played, dj_id, track_id, artist, album, vinyl, request = play
+
+    if sign > 0:
+        increment_track_counters(track_id, 1, played, played)
+    else:
+        # the first or last play may be the one that was removed, so flush
+        # the removal and recount from the plays that are left
+        db.session.flush()
+        recount_tracks(Track.id == track_id)
+
+
+def update_rollups(play, sign):
+    played = play[0]
+    for model, keys, values, counts in play_rows(played.date(), *play[1:]):
+        update_row(model, keys, values, counts, sign)
+    update_dj_counters(play, sign)
+
+
+def update_rows(play, sign):
+    update_rollups(play, sign)
+    update_track_counters(play, sign)
+
+
+def add_play(tracklog, track=None):
+    """Count a TrackLog in the rollups. The TrackLog must have been flushed
+    so that it has a played time. Note that this method does not commit
+    changes to the database."""
+    update_rows(play_info(tracklog, track), 1)
+
+
+def remove_play(tracklog, track=None):
+    """Remove a TrackLog from the rollups. This must be called after the
+    TrackLog has been deleted from the session. Note that this method does
+    not commit changes to the database."""
+    play = play_info(tracklog, track)
+    update_rows(play, -1)
+    mark_play_stale(tracklog, play)
+
+
+def replace_play(old_play, tracklog, track=None):
+    """Move the count for an edited TrackLog from the details returned by
+    play_info() before it was edited to its current details. Note that this
+    method flushes the session but does not commit changes to the
+    database."""
+    new_play = play_info(tracklog, track)
+    if new_play != old_play:
+        update_rollups(old_play, -1)
+        update_rollups(new_play, 1)
+
+        # the edited TrackLog is already counted in the counters of its
+        # current track once the edit is flushed, so recount both tracks
+        # instead of adding to them
+        db.session.flush()
+        recount_tracks(Track.id.in_({old_play[2], new_play[2]}))
+
+        mark_play_stale(tracklog, old_play)
+        if new_play[1] != old_play[1]:
+            mark_play_stale(tracklog, new_play)
+
+
+class RollupBuilder(object):
+    def __init__(self):
+        self.rows = collections.OrderedDict()
+
+    def add(self, played, dj_id, track_id, artist, album, vinyl, request):
+        for model, keys, values, counts in play_rows(
+                played.date(), dj_id, track_id, artist, album, vinyl,
+                request):
+            row_key = (model, tuple(sorted(keys.items())))
+            row = self.rows.get(row_key)
+            if row is None:
+                self.rows[row_key] = dict(keys, **values, **counts)
+                continue
+
+            for name, count in counts.items():
+                row[name] += count
+            for name, value in values.items():
+                if row[name] is None or \
+                        (value is not None and value < row[name]):
+                    row[name] = value
+
+    def insert(self):
+        by_model = collections.defaultdict(list)
+        for (model, _), row in self.rows.items():
+            by_model[model].append(row)
+
+        for model, rows in by_model.items():
+            db.session.execute(model.__table__.insert(), rows)
+
+        self.rows.clear()
+
+
+def play_query():
+    return db.session.query(
+        TrackLog.played, TrackLog.dj_id, TrackLog.track_id, Track.artist,
+        Track.album, TrackLog.vinyl, TrackLog.request).\
+        join(Track, Track.id == TrackLog.track_id)
+
+
+def rebuild_days(days, mark_stale=True):
+    """Recount the rollups for the provided days from the logged tracks, and
+    unless `mark_stale` is false, mark the chart snapshots of the DJs that
+    played on those days as stale. Note that this method does not commit
+    changes to the database."""
+    dj_ids = set()
+    for day in sorted(set(days)):
+        for model in ROLLUP_MODELS:
+            model.query.filter(model.day == day).delete(
+                synchronize_session=False)
+
+        start, end = day_bounds(day)
+        builder = RollupBuilder()
+        for play in play_query().filter(TrackLog.played >= start,
+                                        TrackLog.played < end):
+            builder.add(*play)
+            dj_ids.add(play[1])
+        builder.insert()
+
+    if mark_stale and len(dj_ids) > 0:
+        mark_dj_charts_stale(DJChartSnapshot.dj_id.in_(dj_ids))
+
+
+def add_plays(plays, dj_id):
+    """Count plays that have been inserted in bulk, where `plays` is a list
+    of (track ID, played) tuples of plays by one DJ that are neither vinyl
+    nor requests. The rollups for their days are recounted, and the counters
+    of the DJ and tracks are incremented. Note that this method does not
+    commit changes to the database."""
+    # the plays are new, so DJ chart snapshots pick them up when they are
+    # next updated
+    rebuild_days(set(played.date() for track_id, played in plays),
+                 mark_stale=False)
+
+    DJ.query.filter(DJ.id == dj_id).update({
+        DJ.play_count: DJ.play_count + len(plays),
+    }, synchronize_session=False)
+
+    tracks = {}
+    for track_id, played in plays:
+        count, first_played, last_played = tracks.get(
+            track_id, (0, played, played))
+        tracks[track_id] = (count + 1, min(first_played, played),
+                            max(last_played, played))
+    for track_id, counters in tracks.items():
+        increment_track_counters(track_id, *counters)
+
+
+def play_days(track_ids):
+    """Return the days on which any of the provided tracks were played."""
+    if len(track_ids) <= 0:
+        return set()
+
+    return set(played.date() for played, in
+               TrackLog.query.with_entities(TrackLog.played).filter(
+                   TrackLog.track_id.in_(track_ids)))
+
+
+def recount_edited_tracks(tracks):
+    """Recount the days on which any of the provided tracks were played if
+    their artist or album has been changed. This must be called before the
+    changes are flushed. Note that this method does not commit changes to the
+    database."""
+    track_ids = []
+    for track in tracks:
+        state = db.inspect(track)
+        if state.attrs.artist.history.has_changes() or \
+                state.attrs.album.history.has_changes():
+            track_ids.append(track.id)
+
+    rebuild_days(play_days(track_ids))
+
+
+def rebuild_all(batch_days=30):
+    """Rebuild all of the rollups from scratch, committing after every
+    `batch_days` days of plays, and mark every DJ chart snapshot as stale.
+    Returns the number of plays counted."""
+    for model in ROLLUP_MODELS:
+        model.query.delete(synchronize_session=False)
+    mark_dj_charts_stale()
+
+    first, last = TrackLog.query.with_entities(
+        db.func.min(TrackLog.played), db.func.max(TrackLog.played)).one()
+
+    plays = 0
+    if first is not None:
+        batch_start = day_bounds(first.date())[0]
+        while batch_start <= last:
+            batch_end = batch_start + datetime.timedelta(days=batch_days)
+
+            builder = RollupBuilder()
+            for play in play_query().filter(
+                    TrackLog.played >= batch_start,
+                    TrackLog.played < batch_end).yield_per(5000):
+                builder.add(*play)
+                plays += 1
+            builder.insert()
+
+            try:
+                db.session.commit()
+            except:
+                db.session.rollback()
+                raise
+
+            batch_start = batch_end
+
+    try:
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+
+    return plays
+
+
+def reconcile_counters(batch_size=5000):
+    """Recount the play counters of every Track and DJ from the logged
+    tracks to correct any drift, committing after every `batch_size`
+    tracks. Returns the number of tracks and DJs that were recounted."""
+    tracks = 0
+    max_id = db.session.query(db.func.max(Track.id)).scalar() or 0
+    for start in range(0, max_id + 1, batch_size):
+        tracks += recount_tracks(Track.id >= start,
+                                 Track.id < start + batch_size)
+        try:
+            db.session.commit()
+        except:
+            db.session.rollback()
+            raise
+
+    djs = recount_djs()
+    try:
+        db.session.commit()
+    except:
+        db.session.rollback()
+        raise
+
+    return tracks, djs
@@ -1,6 +1,21 @@
-from flask import request
+from flask import request, url_for
 from urllib.parse import urljoin
 
 
 def make_external(url):
     return urljoin(request.url_root, url)
+
+
+def page_urls(endpoint, next_cursor, **values):
+    """Return the URLs of the first page and the next page of a paginated
+    list, or None for either if the current page is that page or the last
+    one."""
+    newest_url = None
+    if request.args.get('cursor') is not None:
+        newest_url = url_for(endpoint, **values)
+
+    older_url = None
+    if next_cursor is not None:
+        older_url = url_for(endpoint, cursor=next_cursor, **values)
+
+    return newest_url, older_url
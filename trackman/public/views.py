@@ -1,9 +1,8 @@
 from flask import (
-        current_app, make_response, render_template,
+        abort, current_app, make_response, render_template,
         redirect, request, url_for, Response,
 )
 import datetime
-import re
 from feedwerk.atom import AtomFeed
 
 from ..api.v1.charts import (
@@ -18,9 +17,7 @@ from ..api.v1.charts import (
         DJRequestCharts,
 )
 from ..api.v1.playlists import (
-        NowPlaying,
         Last15Tracks,
-        LatestTrack,
         PlaylistsByDay,
         PlaylistDJs,
         PlaylistAllDJs,
@@ -28,8 +25,9 @@ from ..api.v1.playlists import (
         Playlist,
         PlaylistTrack,
 )
+from .. import nowplaying
 from . import bp
-from .view_utils import make_external
+from .view_utils import make_external, page_urls
 
 
 #############################################################################
@@ -39,19 +37,19 @@ from .view_utils import make_external
 
 @bp.route('/playlists')
 def playlists_index():
-    track = NowPlaying().get()
+    track = nowplaying.get_json()
     return render_template('public/index.html', track=track)
 
 
 @bp.route('/last15')
 def last15():
-    result = Last15Tracks().get()
+    result = Last15Tracks.get_cached()
     return render_template('public/last15.html', tracklogs=result['tracks'])
 
 
 @bp.route('/last15.atom')
 def last15_feed():
-    result = Last15Tracks().get()
+    result = Last15Tracks.get_cached()
     tracks = result['tracks']
     feed = AtomFeed(
         "{0}: Last 15 Tracks".format(current_app.config['TRACKMAN_NAME']),
@@ -80,36 +78,19 @@ def last15_feed():
 
 @bp.route('/playlists/latest_track')
 def latest_track():
-    track = LatestTrack().get()
-    return Response("{artist} - {title}".format(**track),
-                    mimetype="text/plain")
+    return Response(nowplaying.get('latest_track'), mimetype="text/plain")
 
 
 @bp.route('/playlists/latest_track_clean')
 def latest_track_clean():
-    naughty_word_re = re.compile(
-        r'shit|piss|fuck|cunt|cocksucker|tits|twat|asshole',
-        re.IGNORECASE)
-
-    track = LatestTrack().get()
-    for k, v in list(track.items()):
-        if type(v) == str or type(v) == str:
-            track[k] = naughty_word_re.sub('****', v)
-
-    output = "{artist} - {title} [DJ: {dj}]".format(**track)
-    return Response(output, mimetype="text/plain")
+    return Response(nowplaying.get('latest_track_clean'),
+                    mimetype="text/plain")
 
 
 @bp.route('/playlists/latest_track_stream')
 def latest_track_stream():
-    track = LatestTrack().get()
-    return Response("""\
-title={title}
-artist={artist}
-album={album}
-description={description}
-contact={contact}
-""".format(**track), mimetype="text/plain")
+    return Response(nowplaying.get('latest_track_stream'),
+                    mimetype="text/plain")
 
 
 # Playlist Archive (by date) {{{
@@ -129,7 +110,7 @@ def playlists_by_date_init_js():
 
 @bp.route('/playlists/date/<int:year>/<int:month>/<int:day>')
 def playlists_date_sets(year, month, day):
-    results, status_code = PlaylistsByDay().get(year, month, day)
+    results, status_code = PlaylistsByDay.get_cached(year, month, day)
 
     now = datetime.datetime.utcnow()
     start_date = results['dtstart'].replace(tzinfo=None)
@@ -170,22 +151,25 @@ def playlists_date_jump():
 # Playlist Archive (by DJ) {{{
 @bp.route('/playlists/dj')
 def playlists_dj():
-    results = PlaylistDJs().get()
+    results = PlaylistDJs.get_cached()
     return render_template('public/playlists_dj_list.html', djs=results['djs'])
 
 
 @bp.route('/playlists/dj/all')
 def playlists_dj_all():
-    results = PlaylistAllDJs().get()
+    results = PlaylistAllDJs.get_cached()
     return render_template('public/playlists_dj_list_all.html',
                            djs=results['djs'])
 
 
 @bp.route('/playlists/dj/<int:dj_id>')
 def playlists_dj_sets(dj_id):
-    results = PlaylistsByDJ().get(dj_id)
+    results = PlaylistsByDJ.get_cached(dj_id)
+    newest_url, older_url = page_urls('public.playlists_dj_sets',
+                                      results['next'], dj_id=dj_id)
     return render_template('public/playlists_dj_sets.html',
-                           dj=results['dj'], sets=results['sets'])
+                           dj=results['dj'], sets=results['sets'],
+                           newest_url=newest_url, older_url=older_url)
 # }}}
 
 
@@ -208,7 +192,7 @@ def charts_albums(period=None, year=None, month=None):
     if period == 'dj' and year is not None:
         return redirect(url_for('.charts_albums_dj', dj_id=year))
 
-    results = AlbumCharts().get(period, year, month)
+    results = AlbumCharts.get_cached(period, year, month)
     return render_template('public/chart_albums.html',
                            start=results['start'],
                            end=results['end'],
@@ -217,7 +201,9 @@ def charts_albums(period=None, year=None, month=None):
 
 @bp.route('/playlists/charts/dj/<int:dj_id>/albums')
 def charts_albums_dj(dj_id):
-    results = DJAlbumCharts().get(dj_id)
+    results = DJAlbumCharts.get_cached(dj_id)
+    if isinstance(results, tuple):
+        abort(results[1])
     return render_template('public/chart_albums_dj.html',
                            dj=results['dj'],
                            results=results['results'])
@@ -231,7 +217,7 @@ def charts_artists(period=None, year=None, month=None):
     if period == 'dj' and year is not None:
         return redirect(url_for('.charts_artists_dj', dj_id=year))
 
-    results = ArtistCharts().get(period, year, month)
+    results = ArtistCharts.get_cached(period, year, month)
     return render_template('public/chart_artists.html',
                            start=results['start'],
                            end=results['end'],
@@ -240,7 +226,9 @@ def charts_artists(period=None, year=None, month=None):
 
 @bp.route('/playlists/charts/dj/<int:dj_id>/artists')
 def charts_artists_dj(dj_id):
-    results = DJArtistCharts().get(dj_id)
+    results = DJArtistCharts.get_cached(dj_id)
+    if isinstance(results, tuple):
+        abort(results[1])
     return render_template('public/chart_artists_dj.html',
                            dj=results['dj'],
                            results=results['results'])
@@ -254,7 +242,7 @@ def charts_tracks(period=None, year=None, month=None):
     if period == 'dj' and year is not None:
         return redirect(url_for('.charts_tracks_dj', dj_id=year))
 
-    results = TrackCharts().get(period, year, month)
+    results = TrackCharts.get_cached(period, year, month)
     return render_template('public/chart_tracks.html',
                            start=results['start'],
                            end=results['end'],
@@ -263,7 +251,9 @@ def charts_tracks(period=None, year=None, month=None):
 
 @bp.route('/playlists/charts/dj/<int:dj_id>/tracks')
 def charts_tracks_dj(dj_id):
-    results = DJTrackCharts().get(dj_id)
+    results = DJTrackCharts.get_cached(dj_id)
+    if isinstance(results, tuple):
+        abort(results[1])
     return render_template('public/chart_tracks_dj.html',
                            dj=results['dj'],
                            results=results['results'])
@@ -271,21 +261,21 @@ def charts_tracks_dj(dj_id):
 
 @bp.route('/playlists/charts/dj/spins')
 def charts_dj_spins():
-    results = DJSpinCharts().get()
+    results = DJSpinCharts.get_cached()
     return render_template('public/chart_dj_spins.html',
                            results=results['results'])
 
 
 @bp.route('/playlists/charts/dj/vinyl_spins')
 def charts_dj_vinyl_spins():
-    results = DJVinylSpinCharts().get()
+    results = DJVinylSpinCharts.get_cached()
     return render_template('public/chart_dj_vinyl_spins.html',
                            results=results['results'])
 
 
 @bp.route('/playlists/charts/dj/requests')
 def charts_dj_requests():
-    results = DJRequestCharts().get()
+    results = DJRequestCharts.get_cached()
     return render_template('public/chart_dj_requests.html',
                            results=results['results'])
 # }}}
@@ -293,7 +283,7 @@ def charts_dj_requests():
 
 @bp.route('/playlists/set/<int:set_id>')
 def playlist(set_id):
-    results = Playlist().get(set_id)
+    results = Playlist.get_cached(set_id)
     return render_template('public/playlist.html',
                            archives=results['archives'],
                            djset=results,
@@ -302,7 +292,10 @@ def playlist(set_id):
 
 @bp.route('/playlists/track/<int:track_id>')
 def playlists_track(track_id):
-    results = PlaylistTrack().get(track_id)
+    results = PlaylistTrack.get_cached(track_id)
+    newest_url, older_url = page_urls('public.playlists_track',
+                                      results['next'], track_id=track_id)
     return render_template('public/playlists_track.html',
                            track=results,
-                           tracklogs=results['plays'])
+                           tracklogs=results['plays'],
+                           newest_url=newest_url, older_url=older_url)
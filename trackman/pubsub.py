@@ -1,11 +1,204 @@
-from flask import json
+"""Publishing of live events to nchan.
+
+Events are queued in-process and delivered by a background thread over a
+pooled HTTP session, so a slow or unavailable nchan never fails a request
+after its changes have been committed. Pending track_change and track_edit
+events for the same tracklog are coalesced, since only the newest version of
+the tracklog is of interest to subscribers.
+"""
+
+from flask import current_app, json
+import atexit
+import collections
+import logging
+import os
 import requests
+import threading
+import time
+
+COALESCE_EVENTS = ('track_change', 'track_edit')
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+logger = logging.getLogger(__name__)
+
+
+class PublishEntry(object):
+    def __init__(self, url, message, retries, timeout):
+        self.url = url
+        self.message = message
+        self.data = json.dumps(message)
+        self.retries = retries
+        self.timeout = timeout
+        self.queued_at = time.monotonic()
+
+    @property
+    def tracklog_id(self):
+        if self.message.get('event') in COALESCE_EVENTS:
+            return self.message.get('tracklog', {}).get('tracklog_id')
+        return None
+
+    def supersede(self, entry):
+        """Replace the tracklog in this entry with the one from a newer entry.
+        The event name is kept so that a pending track_change is still
+        delivered as a track_change."""
+        self.message = dict(self.message, tracklog=entry.message['tracklog'])
+        self.data = json.dumps(self.message)
+
+
+class Publisher(object):
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.pending = collections.deque()
+        self.sending = 0
+        self.session = None
+        self.session_pid = None
+        self.worker = None
+        self.worker_pid = None
+        self.counters = collections.Counter()
+        self.latency_buckets = [0] * len(LATENCY_BUCKETS)
+        self.latency_count = 0
+        self.latency_sum = 0.0
+
+    def get_session(self):
+        # connections cannot be shared with a parent process after a fork
+        if self.session is None or self.session_pid != os.getpid():
+            self.session = requests.Session()
+            self.session.headers['Accept'] = "application/json"
+            self.session_pid = os.getpid()
+        return self.session
+
+    def ensure_worker(self):
+        # uWSGI forks after the app is loaded, so each process needs to start
+        # its own worker thread
+        if self.worker is not None and self.worker.is_alive() and \
+                self.worker_pid == os.getpid():
+            return
+
+        self.worker_pid = os.getpid()
+        self.worker = threading.Thread(target=self.run,
+                                       name="trackman-pubsub", daemon=True)
+        self.worker.start()
+
+    def send(self, url, data, timeout):
+        r = self.get_session().post(url, data=data, timeout=timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def enqueue(self, entry, max_queue):
+        with self.cond:
+            self.counters['published'] += 1
+
+            tracklog_id = entry.tracklog_id
+            if tracklog_id is not None:
+                for pending in self.pending:
+                    if pending.url == entry.url and \
+                            pending.tracklog_id == tracklog_id:
+                        pending.supersede(entry)
+                        self.counters['coalesced'] += 1
+                        return
+
+            if len(self.pending) >= max_queue:
+                self.counters['dropped'] += 1
+                logger.error("Trackman: Pubsub queue full, dropping {0} "
+                             "event".format(entry.message.get('event')))
+                return
+
+            self.pending.append(entry)
+            self.ensure_worker()
+            self.cond.notify()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while len(self.pending) <= 0:
+                    self.cond.wait()
+                entry = self.pending.popleft()
+                self.sending += 1
+
+            try:
+                self.deliver(entry)
+            finally:
+                with self.cond:
+                    self.sending -= 1
+                    self.cond.notify_all()
+
+    def deliver(self, entry):
+        for attempt in range(entry.retries + 1):
+            if attempt > 0:
+                self.counters['retries'] += 1
+                time.sleep(0.5 * 2 ** (attempt - 1))
+
+            try:
+                self.send(entry.url, entry.data, entry.timeout)
+            except Exception as exc:
+                logger.warning("Trackman: Failed to publish {0} event to "
+                               "{1}: {2}".format(entry.message.get('event'),
+                                                 entry.url, exc))
+            else:
+                self.counters['sent'] += 1
+                self.observe_latency(time.monotonic() - entry.queued_at)
+                return
+
+        self.counters['failed'] += 1
+
+    def observe_latency(self, seconds):
+        with self.cond:
+            self.latency_count += 1
+            self.latency_sum += seconds
+            for i, bucket in enumerate(LATENCY_BUCKETS):
+                if seconds <= bucket:
+                    self.latency_buckets[i] += 1
+
+    def flush(self, timeout=None):
+        """Wait for queued events to be delivered. Returns False if the
+        timeout expired first."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.cond:
+            while len(self.pending) > 0 or self.sending > 0:
+                if self.worker is None or not self.worker.is_alive():
+                    return False
+
+                if deadline is None:
+                    self.cond.wait()
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self.cond.wait(remaining)
+        return True
+
+    def stats(self):
+        with self.cond:
+            return {
+                'queue_depth': len(self.pending) + self.sending,
+                'published': self.counters['published'],
+                'sent': self.counters['sent'],
+                'failed': self.counters['failed'],
+                'dropped': self.counters['dropped'],
+                'coalesced': self.counters['coalesced'],
+                'retries': self.counters['retries'],
+                'latency_buckets': list(zip(LATENCY_BUCKETS,
+                                            self.latency_buckets)),
+                'latency_count': self.latency_count,
+                'latency_sum': self.latency_sum,
+            }
+
+
+publisher = Publisher()
+atexit.register(publisher.flush, 5)
 
 
 def publish(url, message):
-    r = requests.post(
-        url,
-        data=json.dumps(message),
-        headers={'Accept': "application/json"})
-    r.raise_for_status()
-    return r.json()
+    """Queue a message for delivery to nchan."""
+    publisher.enqueue(
+        PublishEntry(url, message,
+                     retries=current_app.config['PUBSUB_MAX_RETRIES'],
+                     timeout=current_app.config['PUBSUB_TIMEOUT']),
+        current_app.config['PUBSUB_QUEUE_SIZE'])
+
+
+def send(url, message):
+    """Deliver a message to nchan immediately and return nchan's response.
+    Errors are raised to the caller."""
+    return publisher.send(url, json.dumps(message),
+                          current_app.config['PUBSUB_TIMEOUT'])
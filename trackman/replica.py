@@ -0,0 +1,242 @@
+"""Routing of read-only queries to a replica of the database.
+
+If the bind named by DATABASE_REPLICA_BIND is configured in SQLALCHEMY_BINDS,
+public playlists and charts, the public pages and library browsing read from
+it, so that heavy read traffic does not slow down the DJ interface, which
+always uses the primary database. Only plain SELECT statements are sent to
+the replica; once a session writes or locks rows, it uses the primary for
+the rest of the request, and for DATABASE_REPLICA_MAX_LAG seconds afterwards
+the same user's requests do as well, so that they see their own changes.
+
+The replica's lag is checked every DATABASE_REPLICA_CHECK_INTERVAL seconds in
+each process. If it is further behind than DATABASE_REPLICA_MAX_LAG or cannot
+be reached, queries fall back to the primary until the next check. Results
+that depend on changes more recent than the lag, such as what is now
+playing, are read from the primary as well.
+"""
+
+from flask import current_app, has_request_context, request, \
+    session as flask_session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy, get_state
+from functools import wraps
+import contextlib
+import datetime
+import sqlalchemy.exc
+import time
+from sqlalchemy import event, orm
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.selectable import GenerativeSelect
+
+READ_METHODS = ('GET', 'HEAD')
+READ_ONLY_BLUEPRINTS = ('public', 'trackman_library')
+SESSION_KEY = 'replica_primary_until'
+
+# seconds added to the measured lag when deciding whether the replica has a
+# change, as modification times are truncated to the second
+LAG_MARGIN = 1
+
+PG_LAG_QUERY = """\
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+END"""
+
+
+class ReplicaStatus(object):
+    def __init__(self):
+        self.checked = None
+        self.lag = None
+
+    def mark_failed(self):
+        self.lag = None
+
+    def get_lag(self, engine):
+        """Return the lag of the replica in seconds, measuring it if it has
+        not been checked recently, or None if it could not be reached."""
+        now = time.monotonic()
+        interval = current_app.config['DATABASE_REPLICA_CHECK_INTERVAL']
+        if self.checked is not None and now - self.checked < interval:
+            return self.lag
+
+        self.checked = now
+        try:
+            with engine.connect() as conn:
+                if engine.dialect.name == 'postgresql':
+                    lag = conn.execute(
+                        sqlalchemy.text(PG_LAG_QUERY)).scalar()
+                else:
+                    conn.execute(sqlalchemy.text("SELECT 1"))
+                    lag = 0
+        except sqlalchemy.exc.SQLAlchemyError as exc:
+            current_app.logger.warning(
+                "Trackman: Database replica is unavailable: {}".format(exc))
+            lag = None
+
+        self.lag = float(lag) if lag is not None else None
+        return self.lag
+
+
+status = ReplicaStatus()
+
+
+def handle_error(context):
+    if context.is_disconnect:
+        status.mark_failed()
+
+
+def get_replica_engine(app):
+    """Return the engine for the replica, or None if it is not configured."""
+    bind = app.config['DATABASE_REPLICA_BIND']
+    if bind is None or bind not in (app.config['SQLALCHEMY_BINDS'] or {}):
+        return None
+
+    engine = get_state(app).db.get_engine(app, bind=bind)
+    if not event.contains(engine, 'handle_error', handle_error):
+        event.listen(engine, 'handle_error', handle_error)
+    return engine
+
+
+def get_lag():
+    """Return the lag of the replica in seconds, or None if it is not
+    configured or could not be reached."""
+    engine = get_replica_engine(current_app)
+    if engine is None:
+        return None
+    return status.get_lag(engine)
+
+
+def is_usable():
+    lag = get_lag()
+    return lag is not None and \
+        lag <= current_app.config['DATABASE_REPLICA_MAX_LAG']
+
+
+def is_write(clause):
+    """Return whether a statement writes to or locks rows."""
+    if isinstance(clause, GenerativeSelect):
+        return clause._for_update_arg is not None
+    return isinstance(clause, UpdateBase)
+
+
+class RoutingSession(SignallingSession):
+    """A session that sends SELECT statements to the replica while
+    use_replica is set, until it writes to the primary."""
+
+    def __init__(self, *args, **kwargs):
+        self.use_replica = False
+        self.wrote = False
+        super(RoutingSession, self).__init__(*args, **kwargs)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or is_write(clause):
+            self.wrote = True
+        elif self.use_replica and not self.wrote and \
+                isinstance(clause, GenerativeSelect) and \
+                (mapper is None or
+                 mapper.persist_selectable.info.get('bind_key') is None) and \
+                is_usable():
+            return get_replica_engine(self.app)
+
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def get_session():
+    return get_state(current_app).db.session()
+
+
+@contextlib.contextmanager
+def replica_reads():
+    """Allow queries within the block to read from the replica."""
+    session = get_session()
+    previous = session.use_replica
+    session.use_replica = True
+    try:
+        yield
+    finally:
+        session.use_replica = previous
+
+
+@contextlib.contextmanager
+def primary_reads():
+    """Read from the primary within the block."""
+    session = get_session()
+    previous = session.use_replica
+    session.use_replica = False
+    try:
+        yield
+    finally:
+        session.use_replica = previous
+
+
+def has_changes_since(changed):
+    """Return whether the replica may not have caught up with changes that
+    were made at `changed`."""
+    if changed is None:
+        return False
+
+    lag = get_lag()
+    if lag is None:
+        return True
+
+    age = (datetime.datetime.utcnow() - changed).total_seconds()
+    return age <= lag + LAG_MARGIN
+
+
+@contextlib.contextmanager
+def fresh_reads(changed):
+    """Read from the primary within the block if the replica may not have
+    caught up with changes that were made at `changed`, a naive UTC
+    datetime."""
+    if get_session().use_replica and has_changes_since(changed):
+        with primary_reads():
+            yield
+    else:
+        yield
+
+
+def read_only(f):
+    """Decorator for views and resource methods that only read from the
+    database, which allows them to read from the replica."""
+    @wraps(f)
+    def read_only_wrapper(*args, **kwargs):
+        if not has_request_context() or \
+                request.method not in READ_METHODS or wrote_recently():
+            return f(*args, **kwargs)
+
+        with replica_reads():
+            return f(*args, **kwargs)
+    return read_only_wrapper
+
+
+def wrote_recently():
+    # avoid loading the session, and varying responses on it, if there is none
+    if current_app.session_cookie_name not in request.cookies:
+        return False
+    return flask_session.get(SESSION_KEY, 0) > time.time()
+
+
+def use_replica_for_reads():
+    if request.blueprint in READ_ONLY_BLUEPRINTS and \
+            request.method in READ_METHODS and not wrote_recently():
+        get_session().use_replica = True
+
+
+def remember_writes(response):
+    """Keep the user's requests on the primary for a while after they have
+    written to it, so that they see their own changes."""
+    if get_session().wrote and \
+            get_replica_engine(current_app) is not None:
+        flask_session[SESSION_KEY] = time.time() + \
+            current_app.config['DATABASE_REPLICA_MAX_LAG']
+    return response
+
+
+def init_app(app):
+    app.before_request(use_replica_for_reads)
+    app.after_request(remember_writes)
@@ -0,0 +1,126 @@
+"""Licensing reports of the tracks played in a date range.
+
+Reports are generated from a single query that only selects the columns that
+are needed, which is read in batches using a server-side cursor where the
+database supports it. Rows are written out as CSV as they are read, so that a
+report can be streamed to the client without holding it in memory.
+
+Track information is read from the library, or from the information recorded
+with each play if TRACKLOG_SNAPSHOT_READS is enabled. Plays that were logged
+before that information was recorded, and have not been backfilled, fall
+back to the library track.
+"""
+
+import csv
+import io
+from flask import current_app
+from . import db, format_datetime
+from .models import Track, TrackLog
+
+BATCH_SIZE = 1000
+TRACK_FIELDS = ('title', 'artist', 'album', 'label')
+
+
+class BMIReport(object):
+    name = 'bmi'
+    title = "BMI Report"
+    filename_format = "bmirep-%Y-%m-%d.csv"
+    header = None
+    fields = ('played', 'title', 'artist')
+
+    def row(self, played, title, artist):
+        return [
+            current_app.config['TRACKMAN_NAME'],
+            format_datetime(played),
+            title,
+            artist,
+        ]
+
+
+class SoundExchangeReport(object):
+    name = 'soundexchange'
+    title = "SoundExchange Report"
+    filename_format = "soundexchange-%Y-%m-%d.csv"
+    header = [
+        "NAME_OF_SERVICE",
+        "FEATURED_ARTIST",
+        "SOUND_RECORDING_TITLE",
+        "ISRC",
+        "ALBUM_TITLE",
+        "MARKETING_LABEL",
+        "DATE_OF_PERFORMANCE",
+        "TIME_OF_PERFORMANCE",
+        "ACTUAL_TOTAL_PERFORMANCES",
+    ]
+    fields = ('played', 'listeners', 'artist', 'title', 'album', 'label')
+
+    def row(self, played, listeners, artist, title, album, label):
+        return [
+            current_app.config['TRACKMAN_NAME'],
+            artist,
+            title,
+            "",
+            album,
+            label,
+            format_datetime(played, "%Y-%m-%d"),
+            format_datetime(played, "%H:%M:%S"),
+            listeners or 0,
+        ]
+
+
+REPORTS = {
+    BMIReport.name: BMIReport,
+    SoundExchangeReport.name: SoundExchangeReport,
+}
+
+
+def get_report(name):
+    try:
+        return REPORTS[name]()
+    except KeyError:
+        raise ValueError("Unknown report: {}".format(name))
+
+
+def report_query(report, start, end, snapshot=None):
+    if snapshot is None:
+        snapshot = current_app.config['TRACKLOG_SNAPSHOT_READS']
+
+    columns = []
+    for field in report.fields:
+        if field not in TRACK_FIELDS:
+            columns.append(getattr(TrackLog, field))
+        elif snapshot:
+            columns.append(db.func.coalesce(getattr(TrackLog, field),
+                                            getattr(Track, field)))
+        else:
+            columns.append(getattr(Track, field))
+
+    query = db.session.query(*columns)
+    if snapshot:
+        query = query.outerjoin(Track, TrackLog.track_id == Track.id)
+    else:
+        query = query.join(Track, TrackLog.track_id == Track.id)
+    return query.\
+        filter(TrackLog.played >= start, TrackLog.played <= end).\
+        order_by(TrackLog.played, TrackLog.id)
+
+
+def generate_csv(report, start, end, batch_size=BATCH_SIZE):
+    """Yield chunks of CSV for `report` covering plays between `start` and
+    `end`, inclusive."""
+    f = io.StringIO()
+    writer = csv.writer(f)
+    if report.header is not None:
+        writer.writerow(report.header)
+
+    count = 0
+    for result in report_query(report, start, end).yield_per(batch_size):
+        writer.writerow(report.row(*result))
+        count += 1
+
+        if count % batch_size == 0:
+            yield f.getvalue()
+            f.seek(0)
+            f.truncate()
+
+    yield f.getvalue()
@@ -0,0 +1,136 @@
+"""Track search backends.
+
+Searches first look for tracks that match every provided field exactly,
+ignoring case, and fall back to partial matches if there are none. Matches
+are ranked by how similar they are to the search terms and then by how often
+they have been played.
+
+The trigram backend requires PostgreSQL with the pg_trgm extension, which
+provides GIN indexes that both exact and partial matches can use. The LIKE
+backend works with any database but has to scan the track table.
+"""
+
+import random
+import time
+from flask import current_app
+from . import db
+from .models import Track
+
+SEARCH_FIELDS = ('artist', 'title', 'album', 'label')
+
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').\
+        replace('_', '\\_')
+
+
+class LikeSearchBackend(object):
+    name = 'like'
+
+    def exact(self, column, value):
+        return db.func.lower(column) == db.func.lower(value)
+
+    def partial(self, column, value):
+        return column.ilike('%{0}%'.format(escape_like(value)), escape='\\')
+
+    def similarity(self, column, value):
+        return None
+
+
+class TrigramSearchBackend(LikeSearchBackend):
+    name = 'trigram'
+
+    def exact(self, column, value):
+        # ILIKE without wildcards is case-insensitive equality, which unlike
+        # lower() can use the trigram indexes
+        return column.ilike(escape_like(value), escape='\\')
+
+    def partial(self, column, value):
+        # also match values that contain a word similar to the search term,
+        # so that minor typos still return results
+        return db.or_(super().partial(column, value),
+                      column.op('%>')(value))
+
+    def similarity(self, column, value):
+        return db.func.word_similarity(value, column)
+
+
+BACKENDS = {
+    LikeSearchBackend.name: LikeSearchBackend,
+    TrigramSearchBackend.name: TrigramSearchBackend,
+}
+
+
+def available_backends():
+    names = [LikeSearchBackend.name]
+    if db.engine.dialect.name == 'postgresql':
+        names.append(TrigramSearchBackend.name)
+    return names
+
+
+def get_backend(name=None):
+    if name is None:
+        name = current_app.config['TRACK_SEARCH_BACKEND']
+    if name is None:
+        name = available_backends()[-1]
+
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError("Unknown track search backend: {}".format(name))
+
+
+def ranked(backend, query, criteria, limit):
+    scores = [backend.similarity(getattr(Track, field), value)
+              for field, value in criteria.items()]
+    if None in scores:
+        query = query.order_by(db.desc(Track.play_count), Track.id)
+    else:
+        score = sum(scores[1:], scores[0])
+        query = query.order_by(db.desc(score), db.desc(Track.play_count),
+                               Track.id)
+
+    return query.limit(limit).all()
+
+
+def search_tracks(criteria, limit=8, backend=None):
+    """Search for tracks using a dictionary mapping each field in
+    SEARCH_FIELDS to the value to search for."""
+    if backend is None:
+        backend = get_backend()
+
+    tracks = ranked(backend, Track.query.filter(*[
+        backend.exact(getattr(Track, field), value)
+        for field, value in criteria.items()]), criteria, limit)
+    if len(tracks) > 0:
+        return tracks
+
+    return ranked(backend, Track.query.filter(*[
+        backend.partial(getattr(Track, field), value)
+        for field, value in criteria.items()]), criteria, limit)
+
+
+def sample_terms(count):
+    """Return a list of search criteria using parts of random artist names
+    from the library, for use in benchmarks."""
+    max_id = db.session.query(db.func.max(Track.id)).scalar() or 0
+    track_ids = [random.randint(1, max_id) for i in range(count * 2)]
+
+    terms = []
+    for artist, in Track.query.with_entities(Track.artist).\
+            filter(Track.id.in_(track_ids)).limit(count):
+        start = random.randint(0, max(len(artist) - 4, 0))
+        terms.append({'artist': artist[start:start + 4]})
+    return terms
+
+
+def benchmark(backend, terms, iterations):
+    """Run each search `iterations` times and return a list of the latency
+    of each search in seconds."""
+    latencies = []
+    for i in range(iterations):
+        for criteria in terms:
+            start = time.perf_counter()
+            search_tracks(criteria, backend=backend)
+            latencies.append(time.perf_counter() - start)
+    return latencies
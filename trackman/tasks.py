@@ -1,4 +1,5 @@
-from . import app, auth_manager, lib
+from . import analytics, app, auth_manager, autocomplete, charts, djcharts, \
+    lib, partitions
 import hashlib
 import hmac
 import requests
@@ -36,6 +37,44 @@ def cleanup_sessions_and_claim_tokens():
         lib.cleanup_expired_claim_tokens()
 
 
+def rebuild_autocomplete():
+    with app.app_context():
+        app.logger.warning("Rebuilding autocomplete index...")
+        autocomplete.rebuild()
+
+
+def prewarm_charts():
+    with app.app_context():
+        charts.prewarm()
+
+
+def rebuild_stale_dj_charts():
+    with app.app_context():
+        djcharts.build_missing()
+        djcharts.rebuild_stale()
+
+
+def maintain_tracklog_partitions():
+    with app.app_context():
+        partitions.maintain()
+
+
+def refresh_analytics():
+    with app.app_context():
+        analytics.refresh()
+
+
+def rebuild_analytics():
+    with app.app_context():
+        app.logger.warning("Rebuilding analytics snapshot...")
+        analytics.refresh(full=True)
+
+
+def sample_stream_listeners():
+    with app.app_context():
+        lib.sample_stream_listeners()
+
+
 def internal_ping():
     with app.app_context():
         msg = "/internal/ping"
@@ -82,8 +82,9 @@ def dj_interact(f):
         # Call in the function first in case it changes the timeout
         ret = f(*args, **kwargs)
 
-        if check_onair(session.get('djset_id', None)):
-            renew_dj_lease()
+        djset_id = session.get('djset_id', None)
+        if djset_id is not None:
+            renew_dj_lease(djset_id=djset_id)
 
         return ret
     return dj_wrapper
@@ -3,8 +3,10 @@ from flask import jsonify, render_template, request, send_from_directory, \
 import redis.exceptions
 import sqlalchemy.exc
 
-from . import app, db, redis_conn
-from .view_utils import IPAccessDeniedException
+from . import app, auth_manager, db, redis_conn
+from .instrumentation import render_metrics
+from .pubsub import publisher
+from .view_utils import IPAccessDeniedException, local_only
 
 
 @app.route('/robots.txt')
@@ -78,6 +80,15 @@ def healthcheck():
         return "fail", 500
 
 
+@app.route('/metrics')
+@local_only
+def metrics():
+    return Response(
+        render_metrics(redis_conn, publisher.stats(),
+                       auth_manager.session_cache_stats()),
+        mimetype="text/plain; version=0.0.4")
+
+
 @app.route('/live')
 def live():
     resp = Response()